@@ -0,0 +1,184 @@
+"""Grouped statistics in a single sorted-segment pass.
+
+Every row gets an integer group code, one factorization per key column
+folded together, and the rows are sorted by it once.  Each group is then a
+contiguous segment of the sorted rows and every aggregate is a ``reduceat``
+over the same segment starts; nothing is grouped twice.
+
+The values of a group are further split into log-scale buckets, HDR
+histogram style: ``BUCKETS_PER_OCTAVE`` per power of two, so a bucket spans
+about 1.1% of its values and a group holds at most a few hundred buckets
+whatever the number of rows.  The ``AGGREGATES`` are kept per (group,
+bucket), in the same pass since the bucket is just the last key.  The
+bucket counts give quantiles to within a bucket, interpolated between the
+exact min and max of the bucket.
+
+The tables are mergeable: tables of them (per batch, spilled, kept from an
+earlier read, from other runs) are merged by the same pass, reducing each
+column with its own ufunc, and yield the same metrics as a table of all the
+rows at once.  Report ``METRICS`` are derived from them, so asking for more
+metrics costs no extra pass over the rows.
+"""
+import numpy as np
+import pandas as pd
+
+AGGREGATES = ["count", "sum", "min", "max", "sumsq"]
+_REDUCERS = dict(count=np.add, sum=np.add, min=np.minimum, max=np.maximum, sumsq=np.add)
+_MAX_BOUND = 1 << 31
+
+BUCKET = "bucket"
+BUCKETS_PER_OCTAVE = 64
+# Values that aren't positive share a single bucket below all the others
+_NON_POSITIVE_BUCKET = np.iinfo(np.int32).min
+
+
+def _variance(df):
+    """The sample variance, 0 for single rows."""
+    variance = (df["sumsq"] - df["sum"] ** 2 / df["count"]) / (df["count"] - 1)
+    return variance.where(df["count"] > 1, 0.0).clip(lower=0)
+
+
+METRICS = dict(
+    count=lambda _df: _df["count"],
+    sum=lambda _df: _df["sum"],
+    min=lambda _df: _df["min"],
+    max=lambda _df: _df["max"],
+    mean=lambda _df: _df["sum"] / _df["count"],
+    var=_variance,
+    std=lambda _df: np.sqrt(_variance(_df)),
+)
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p99.9": 0.999}
+
+
+def buckets(values):
+    """The histogram bucket of each of ``values``."""
+    values = np.asarray(values, dtype=np.float64)
+    positive = values > 0
+    logs = np.log2(np.where(positive, values, 1.0)) * BUCKETS_PER_OCTAVE
+    return np.where(positive, np.floor(logs), _NON_POSITIVE_BUCKET).astype(np.int32)
+
+
+def _codes(df, keys):
+    """``(codes, missing, bound)``: an integer below ``bound`` per row of
+    ``df``, in the order of its ``keys`` values, and which rows miss a key."""
+    codes = np.zeros(len(df), dtype=np.int64)
+    missing = np.zeros(len(df), dtype=bool)
+    bound = 1
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True)
+        missing |= key_codes < 0
+        codes = codes * max(len(uniques), 1) + key_codes
+        bound *= max(len(uniques), 1)
+        if bound > _MAX_BOUND:
+            # Refactorized so that the folded codes stay below the row count
+            codes, uniques = pd.factorize(codes, sort=True)
+            bound = len(uniques)
+    # Small codes are radix sorted
+    return codes.astype(np.min_scalar_type(max(bound - 1, 0)), copy=False), missing, bound
+
+
+def _starts(sorted_codes):
+    if not len(sorted_codes):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+
+def _segments(df, keys):
+    """``(order, starts)``: the positions of the rows of ``df`` with every key
+    present, sorted by group, and where each group starts in ``order``."""
+    codes, missing, _ = _codes(df, keys)
+    if missing.any():
+        rows = np.flatnonzero(~missing)
+        order = rows[np.argsort(codes[rows], kind="stable")]
+    else:
+        order = np.argsort(codes, kind="stable")
+    return order, _starts(codes[order])
+
+
+def _frame(df, keys, rows, columns):
+    key_df = df[keys].iloc[rows]
+    if len(keys) == 1:
+        index = pd.Index(key_df[keys[0]].values, name=keys[0])
+    else:
+        index = pd.MultiIndex.from_arrays([key_df[_k].values for _k in keys], names=keys)
+    return pd.DataFrame(columns, index=index)[list(columns)]
+
+
+def _reduced(df, order, starts):
+    if not len(order):
+        return {_a: np.zeros(0) for _a in AGGREGATES}
+    return {_a: _REDUCERS[_a].reduceat(df[_a].values[order], starts) for _a in AGGREGATES}
+
+
+def aggregate(df, keys, value):
+    """The ``AGGREGATES`` of the column ``value`` of ``df`` per ``keys`` and
+    ``BUCKET``.  Rows missing a key are left out, as by ``groupby``."""
+    values = df[value].values.astype(np.float64)
+    df = pd.DataFrame({_k: df[_k].values for _k in keys}).assign(**{BUCKET: buckets(values)})
+    keys = list(keys) + [BUCKET]
+    order, starts = _segments(df, keys)
+    values = values[order]
+    if not len(order):
+        return _frame(df, keys, order, {_a: np.zeros(0) for _a in AGGREGATES})
+    columns = dict(
+        count=np.diff(np.r_[starts, len(order)]),
+        sum=np.add.reduceat(values, starts),
+        min=np.minimum.reduceat(values, starts),
+        max=np.maximum.reduceat(values, starts),
+        sumsq=np.add.reduceat(values * values, starts),
+    )
+    return _frame(df, keys, order[starts], columns).sort_index()
+
+
+def merge(partials, keys):
+    """``aggregate`` tables over the same ``keys`` merged into one."""
+    keys = list(keys) + [BUCKET]
+    partials = [_p for _p in partials if _p is not None]
+    if not partials:
+        return _frame(pd.DataFrame(columns=keys), keys, [], {_a: np.zeros(0) for _a in AGGREGATES})
+    df = pd.concat(partials, axis="index", sort=False).reset_index()
+    order, starts = _segments(df, keys)
+    return _frame(df, keys, order[starts], _reduced(df, order, starts)).sort_index()
+
+
+def _quantiles(df, order, starts, q):
+    """The ``q`` quantile of every group of the ``aggregate`` table ``df``,
+    whose rows ``order`` are sorted by group and bucket.  As with ``linear``
+    interpolation over the values, between the two values it falls between,
+    each estimated from the min and max of its bucket."""
+    counts = df["count"].values[order]
+    lows, highs = df["min"].values[order], df["max"].values[order]
+    cumulative = np.cumsum(counts)
+    before_group = cumulative[starts] - counts[starts]
+    last = before_group + np.add.reduceat(counts, starts) - 1
+
+    def value_at(rank):
+        bucket = np.searchsorted(cumulative, rank, side="right")
+        within = (rank - (cumulative[bucket] - counts[bucket])) / np.maximum(counts[bucket] - 1, 1)
+        return lows[bucket] + (highs[bucket] - lows[bucket]) * within
+
+    # The rank of the quantile among the sorted values of the group
+    rank = before_group + q * (last - before_group)
+    below = np.floor(rank)
+    above = np.minimum(below + 1, last)
+    return value_at(below) + (value_at(above) - value_at(below)) * (rank - below)
+
+
+def metrics_df(aggregates_df, keys, metrics=None):
+    """The ``METRICS`` and ``QUANTILES`` named in ``metrics`` (all of them by
+    default) per ``keys``, from an ``aggregate`` table."""
+    metrics = list(METRICS) + list(QUANTILES) if metrics is None else metrics
+    keys = list(keys)
+    df = aggregates_df.reset_index()
+    # Sorted by group then bucket, so the buckets of a group are contiguous
+    # and in value order
+    order, _ = _segments(df, keys + [BUCKET])
+    starts = _starts(_codes(df, keys)[0][order])
+    totals_df = pd.DataFrame(_reduced(df, order, starts))
+    columns = {}
+    for metric in metrics:
+        if metric in QUANTILES:
+            columns[metric] = _quantiles(df, order, starts, QUANTILES[metric]) if len(order) else np.zeros(0)
+        else:
+            columns[metric] = METRICS[metric](totals_df).values
+    return _frame(df, keys, order[starts], columns).sort_index()
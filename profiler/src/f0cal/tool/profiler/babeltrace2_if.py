@@ -0,0 +1,277 @@
+"""Trace decoding through the babeltrace 2 graph API.
+
+A ``source.ctf.fs`` component feeds a ``filter.utils.muxer`` whose output is
+consumed by ``_CollectorSink``, through a ``filter.utils.trimmer`` when the
+iterator has a window, so that events out of it never reach Python.  Each
+``_user_consume`` call drains a batch of messages into the columnar buffers,
+which keeps the Python overhead per graph step low.  The graph is run a step
+at a time, so ``batches`` hands out the buffers whenever they hold a batch
+and never holds more.
+
+Events out of the window are still decoded: ``source.ctf.fs`` takes no time
+range and only seeks to one by reading from the beginning, so ``pr view``
+reads windows with the native reader instead (see ``SEEKS``).
+
+Babeltrace 2 has no component filtering events by name, so the collector
+decides once per event class: whether its events are kept, and how to read
+each wanted field of its scopes, from the field classes.  A message then
+costs a dictionary lookup and a call per field, not a name match and a walk
+of every field's type.
+"""
+import collections.abc
+import numbers
+
+import bt2
+import pandas as pd
+
+from . import payload
+from .pandas_helpers import ColumnBuffer
+from .trace_iterator import TraceIterator, encode_names, window_bounds
+
+
+def _py_value(field):
+    """The Python value babeltrace 1 would have returned for ``field``."""
+    if isinstance(field, bt2._StringFieldConst):
+        return str(field)
+    if isinstance(field, collections.abc.Mapping):
+        return {_k: _py_value(_v) for _k, _v in field.items()}
+    if isinstance(field, collections.abc.Sequence):
+        return [_py_value(_v) for _v in field]
+    labels = getattr(field, "labels", None)
+    if labels:
+        return labels[0]
+    if isinstance(field, numbers.Integral):
+        return int(field)
+    if isinstance(field, numbers.Real):
+        return float(field)
+    return field
+
+
+def _enum_value(field):
+    labels = field.labels
+    return labels[0] if labels else int(field)
+
+
+def _int_list(field):
+    return [int(_v) for _v in field]
+
+
+def _is_integer(field_class):
+    return isinstance(field_class, bt2._IntegerFieldClassConst) and not isinstance(field_class, _ENUM_CLASSES)
+
+
+_ENUM_CLASSES = (bt2._UnsignedEnumerationFieldClassConst, bt2._SignedEnumerationFieldClassConst)
+
+
+def _converter(field_class):
+    """A function giving ``_py_value`` of a field of ``field_class``, without
+    its type tests."""
+    if isinstance(field_class, bt2._StringFieldClassConst):
+        return str
+    if isinstance(field_class, _ENUM_CLASSES):
+        return _enum_value
+    if _is_integer(field_class):
+        return int
+    if isinstance(field_class, bt2._ArrayFieldClassConst) and _is_integer(field_class.element_field_class):
+        return _int_list
+    return _py_value
+
+
+def _scope_readers(struct_class, fields):
+    """``(name, converter)`` of the ``fields`` of a structure field class, all
+    of them for None; the converter of a field it lacks is None."""
+    if struct_class is None:
+        return [(_f, None) for _f in fields or ()]
+    members = {_n: _m.field_class for _n, _m in struct_class.items()}
+    names = list(members) if fields is None else fields
+    return [(_n, _converter(members[_n]) if _n in members else None) for _n in names]
+
+
+def _read_scope(struct_field, readers):
+    if struct_field is None:
+        return dict.fromkeys(_n for _n, _ in readers)
+    return {_n: _c(struct_field[_n]) if _c is not None else None for _n, _c in readers}
+
+
+class _Collector:
+    """What the sink fills: one buffer per requested scope."""
+
+    _SCOPE_FIELDS = dict(
+        event_fields=lambda _e: _e.payload_field,
+        event_context=lambda _e: _e.specific_context_field,
+        stream_event_context=lambda _e: _e.common_context_field,
+        stream_packet_context=lambda _e: _e.packet.context_field if _e.packet is not None else None,
+    )
+    _SCOPE_CLASSES = dict(
+        event_fields=lambda _c: _c.payload_field_class,
+        event_context=lambda _c: _c.specific_context_field_class,
+        stream_event_context=lambda _c: _c.stream_class.event_common_context_field_class,
+        stream_packet_context=lambda _c: _c.stream_class.packet_context_field_class,
+    )
+
+    def __init__(self, scopes, name_prefixes, batch_size=None):
+        """``full`` turns true once ``batch_size`` events are buffered (never,
+        for None)."""
+        self._name_prefixes = name_prefixes
+        self._batch_size = batch_size
+        self._event_attrs = scopes.get("events") or ("name", "cycles", "timestamp")
+        self._scopes = scopes
+        # Per event class address: None when its events are dropped, else its
+        # name and the readers of each scope
+        self._classes = {}
+        self.count = self.start = 0
+        self._reset()
+
+    def _reset(self):
+        self.events = ColumnBuffer() if "events" in self._scopes else None
+        self.scopes = []
+        for scope, fields in self._scopes.items():
+            if scope == "events":
+                continue
+            assert scope in self._SCOPE_FIELDS, scope
+            buf = payload.PayloadBuffer() if scope == "event_fields" else ColumnBuffer()
+            self.scopes.append((scope, self._SCOPE_FIELDS[scope], fields, buf))
+
+    def _event_class(self, event_class):
+        name = event_class.name
+        if self._name_prefixes is not None and not name.startswith(self._name_prefixes):
+            return None
+        return name, [
+            _scope_readers(self._SCOPE_CLASSES[_s](event_class), _f) for _s, _, _f, _ in self.scopes
+        ]
+
+    @property
+    def full(self):
+        return self._batch_size is not None and self.count - self.start >= self._batch_size
+
+    def add(self, msg):
+        event = msg.event
+        event_class = event.cls
+        try:
+            known = self._classes[event_class.addr]
+        except KeyError:
+            known = self._classes[event_class.addr] = self._event_class(event_class)
+        if known is None:
+            return
+        name, readers = known
+        self.count += 1
+        if self.events is not None:
+            clock = msg.default_clock_snapshot
+            values = dict(name=name, cycles=clock.value, timestamp=clock.ns_from_origin)
+            self.events.append({_a: values[_a] for _a in self._event_attrs})
+        for (_, getter, _, buf), scope_readers in zip(self.scopes, readers):
+            buf.append(_read_scope(getter(event), scope_readers))
+
+    def flush(self):
+        """The frames of the events buffered since the last flush, indexed by
+        event number."""
+        frames = {_s: _b.to_df() for _s, _, _, _b in self.scopes}
+        if self.events is not None:
+            frames["events"] = self.events.to_df()
+        for df in frames.values():
+            df.index = pd.RangeIndex(self.start, self.start + len(df))
+        self.start = self.count
+        self._reset()
+        return encode_names(frames)
+
+
+def _seconds(ns):
+    """``ns`` from the clock origin as the trimmer's ``SEC.NANO`` time."""
+    return "{}.{:09d}".format(*divmod(ns, 10 ** 9))
+
+
+class _CollectorSink(bt2._UserSinkComponent):
+    BATCH_SIZE = 4096
+
+    def __init__(self, config, params, collector):
+        self._port = self._add_input_port("in")
+        self._collector = collector
+        self._it = None
+
+    def _user_graph_is_configured(self):
+        self._it = self._create_message_iterator(self._port)
+
+    def _user_consume(self):
+        collector = self._collector
+        for _ in range(self.BATCH_SIZE):
+            msg = next(self._it)
+            if type(msg) is bt2._EventMessageConst:
+                collector.add(msg)
+                if collector.full:
+                    return
+
+
+class Bt2TraceIterator(TraceIterator):
+    """Decodes traces through a babeltrace 2 processing graph."""
+
+    STREAMS = True
+
+    def __init__(self, trace_path, scopes=None, name_prefixes=None, window=None):
+        super().__init__(scopes=scopes, name_prefixes=name_prefixes, window=window)
+        self._trace_path = trace_path
+
+    @classmethod
+    def from_path(cls, trace_path, scopes=None, name_prefixes=None, window=None):
+        assert cls.is_valid_ctf_path(trace_path)
+        return cls(trace_path, scopes=scopes, name_prefixes=name_prefixes, window=window)._with_source(trace_path)
+
+    def _source_class(self):
+        return bt2.find_plugin("ctf").source_component_classes["fs"]
+
+    def _trimmer_params(self):
+        """The ``begin`` and ``end`` of a trimmer keeping the window, which
+        starts from the earliest packet as with the other decoders."""
+        params = {"inputs": [self._trace_path]}
+        infos = bt2.QueryExecutor(self._source_class(), "babeltrace.trace-infos", params=params).query()
+        begins = [int(_s["range-ns"]["begin"]) for _t in infos for _s in _t["stream-infos"] if "range-ns" in _s]
+        low, high = window_bounds(self._window, min(begins, default=0))
+        params = {}
+        if self._window[0] is not None:
+            params["begin"] = _seconds(low)
+        if self._window[1] is not None:
+            # The trimmer's end is inclusive
+            params["end"] = _seconds(high - 1)
+        return params
+
+    def _graph(self, collector):
+        graph = bt2.Graph()
+        utils = bt2.find_plugin("utils")
+        source = graph.add_component(self._source_class(), "source", params={"inputs": [self._trace_path]})
+        muxer = graph.add_component(utils.filter_component_classes["muxer"], "muxer")
+        sink = graph.add_component(_CollectorSink, "sink", obj=collector)
+        for out_port in source.output_ports.values():
+            # The muxer adds a fresh input port every time one gets connected
+            in_port = next(_p for _p in muxer.input_ports.values() if not _p.is_connected)
+            graph.connect_ports(out_port, in_port)
+        out_port = muxer.output_ports["out"]
+        if self._window is not None:
+            trimmer_cls = utils.filter_component_classes["trimmer"]
+            trimmer = graph.add_component(trimmer_cls, "trimmer", params=self._trimmer_params())
+            graph.connect_ports(out_port, trimmer.input_ports["in"])
+            out_port = trimmer.output_ports["out"]
+        graph.connect_ports(out_port, sink.input_ports["in"])
+        return graph
+
+    def _decode(self):
+        frames = None
+        for frames in self._batches(None):
+            pass
+        return frames
+
+    def _batches(self, batch_size):
+        # No seeking here (see SEEKS): the whole trace is walked, the trimmer
+        # drops the events out of the window
+        collector = _Collector(self._scopes, self._name_prefixes, batch_size)
+        graph = self._graph(collector)
+        while True:
+            try:
+                graph.run_once()
+            except bt2.TryAgain:
+                continue
+            except bt2.Stop:
+                break
+            if collector.full:
+                yield collector.flush()
+        self._len = collector.count
+        if collector.count > collector.start or batch_size is None:
+            yield collector.flush()
@@ -1,9 +1,103 @@
-import argparse
-import logging
+import babeltrace as bt
+import pandas as pd
 
-# import babeltrace
+from . import payload
+from .pandas_helpers import ColumnBuffer
+from .trace_iterator import TraceIterator, encode_names, window_bounds
 
-import f0cal
+
+class CtfTraceIterator(TraceIterator):
+    """Decodes traces through the babeltrace 1.x ``TraceCollection`` bindings."""
+
+    STREAMS = True
+    SEEKS = True
+
+    _SCOPES = dict(event_fields=bt.CTFScope.EVENT_FIELDS,
+                   event_context=bt.CTFScope.EVENT_CONTEXT,
+                   stream_event_context=bt.CTFScope.STREAM_EVENT_CONTEXT,
+                   stream_event_header=bt.CTFScope.STREAM_EVENT_HEADER,
+                   stream_packet_context=bt.CTFScope.STREAM_PACKET_CONTEXT,
+                   trace_packet_header=bt.CTFScope.TRACE_PACKET_HEADER)
+
+    def __init__(self, collection, scopes=None, name_prefixes=None, window=None):
+        super().__init__(scopes=scopes, name_prefixes=name_prefixes, window=window)
+        self._trace_collection = collection
+
+    @property
+    def events_iter(self):
+        collection = self._trace_collection
+        if self._window is None:
+            return collection.events
+        # The collection seeks to the packets of the window, the rest isn't read
+        low, high = window_bounds(self._window, collection.timestamp_begin)
+        return collection.events_timestamps(
+            max(low, collection.timestamp_begin), min(high - 1, collection.timestamp_end)
+        )
+
+    @classmethod
+    def from_path(cls, trace_path, scopes=None, name_prefixes=None, window=None):
+        assert cls.is_valid_ctf_path(trace_path)
+        trace_collection = bt.TraceCollection()
+        trace_collection.add_traces_recursive(trace_path, "ctf")
+        it = cls(trace_collection, scopes=scopes, name_prefixes=name_prefixes, window=window)
+        return it._with_source(trace_path)
+
+    def _decode(self):
+        frames = None
+        for frames in self._decode_batches(None):
+            pass
+        return frames
+
+    def _batches(self, batch_size):
+        # The collection iterator already merges the streams in time order.
+        return self._decode_batches(batch_size)
+
+    def _decode_batches(self, batch_size):
+        """Walks the trace once, flushing the buffers every ``batch_size`` kept
+        events (never, for None)."""
+        event_attrs = self._scopes.get("events") or ("name", "cycles", "timestamp")
+        events_buf, scope_bufs = self._buffers()
+        prefixes = self._name_prefixes
+        count = start = 0
+        for event in self.events_iter:
+            if prefixes is not None and not event.name.startswith(prefixes):
+                continue
+            count += 1
+            if events_buf is not None:
+                events_buf.append({_a: getattr(event, _a) for _a in event_attrs})
+            for _, scope_enum, fields, buf in scope_bufs:
+                buf.append(self._scope_dict(event, scope_enum, fields))
+            if count - start == batch_size:
+                yield self._batch_frames(events_buf, scope_bufs, start)
+                events_buf, scope_bufs = self._buffers()
+                start = count
+        self._len = count
+        if count > start or batch_size is None:
+            yield self._batch_frames(events_buf, scope_bufs, start)
+
+    def _buffers(self):
+        """``(events_buf, scope_bufs)``: fresh buffers for every scope."""
+        scope_bufs = [
+            (_s, self._SCOPES[_s], _f, payload.PayloadBuffer() if _s == "event_fields" else ColumnBuffer())
+            for _s, _f in self._scopes.items()
+            if _s != "events"
+        ]
+        return ColumnBuffer() if "events" in self._scopes else None, scope_bufs
+
+    @staticmethod
+    def _batch_frames(events_buf, scope_bufs, start):
+        frames = {_s: _b.to_df() for _s, _, _, _b in scope_bufs}
+        if events_buf is not None:
+            frames["events"] = events_buf.to_df()
+        for df in frames.values():
+            df.index = pd.RangeIndex(start, start + len(df))
+        return encode_names(frames)
+
+    @staticmethod
+    def _scope_dict(event, scope_enum, fields=None):
+        if fields is None:
+            fields = event.field_list_with_scope(scope_enum)
+        return {k: event.field_with_scope(k, scope_enum) for k in fields}
 
 
 # @f0cal.entrypoint(['pr', 'view'], args=_run_args)
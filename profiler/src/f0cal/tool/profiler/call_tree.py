@@ -0,0 +1,144 @@
+"""Call trees of paired calls.
+
+``pair_calls`` gives each call its nesting depth but not the call it is
+nested in, so the ``dt`` of a call includes that of the traced calls it
+makes.  Within a thread, the parent of a call at depth ``d`` is the last call
+at depth ``d - 1`` entered before it.  The calls are sorted by (depth,
+thread, entry) once, after which the parents of a whole depth level are a
+binary search into the level above.  A call whose enclosing call wasn't
+paired (tracing started within it, or it never exited) is a root.  The
+exclusive time of a call is its ``dt`` less that of its children, one
+``bincount`` over the parents.
+
+A call path is the names of the calls from a root down to a call.  Paths are
+interned a tree level at a time: the path of a call is that of its parent
+plus its own name, so a level is one factorization of (parent path, name)
+pairs and a parent's path always has a smaller code than its children's.
+
+The loops are over depth levels, never over calls; only the per-path tables
+(a few hundred rows) are walked in Python, for display.
+"""
+import numpy as np
+import pandas as pd
+
+ROOT = -1
+PATH_COLUMNS = ["parent", "name", "level", "count", "inclusive", "exclusive"]
+STACK_SEPARATOR = ";"
+
+
+def _levels(values):
+    """``(order, bounds)``: the positions of ``values`` sorted, and the
+    ``order`` slice of each value from 0 to the largest one."""
+    order = np.argsort(values, kind="stable")
+    bounds = np.searchsorted(values[order], np.arange(values.max(initial=-1) + 2))
+    return order, bounds
+
+
+def call_parents(threads, entry, exit, depth):
+    """The position of the parent of each call, ``ROOT`` for roots.
+
+    ``threads``, ``entry``, ``exit`` and ``depth`` hold the thread, the entry
+    and exit event positions and the nesting depth of each call, as from
+    ``pair_calls``."""
+    threads, entry, exit, depth = (np.asarray(_a) for _a in (threads, entry, exit, depth))
+    parent = np.full(len(entry), ROOT, dtype=np.int64)
+    if not len(entry):
+        return parent
+    # Thread codes in sorted order, so that (thread, entry) keys sort as pairs
+    thread_codes = pd.factorize(threads, sort=True)[0].astype(np.int64)
+    keys = thread_codes * (int(entry.max()) + 1) + entry
+    order = np.lexsort((entry, thread_codes, depth))
+    bounds = np.searchsorted(depth[order], np.arange(depth.max() + 2))
+    for level in range(1, len(bounds) - 1):
+        above, calls = order[bounds[level - 1]:bounds[level]], order[bounds[level]:bounds[level + 1]]
+        if not len(above) or not len(calls):
+            continue
+        found = np.searchsorted(keys[above], keys[calls]) - 1
+        candidate = above[found.clip(min=0)]
+        # The last call entered above in the thread, if it is still running
+        encloses = found >= 0
+        encloses &= (thread_codes[candidate] == thread_codes[calls]) & (exit[candidate] > exit[calls])
+        parent[calls[encloses]] = candidate[encloses]
+    return parent
+
+
+def exclusive_times(parent, dt):
+    """The ``dt`` of each call less that of the calls it made."""
+    dt = np.asarray(dt)
+    if dt.dtype.kind == "u":
+        dt = dt.astype(np.int64)
+    children = np.flatnonzero(parent != ROOT)
+    nested = np.bincount(parent[children], weights=dt[children], minlength=len(dt))
+    return dt - nested.astype(dt.dtype)
+
+
+def call_paths(parent, depth, names):
+    """``(path, paths_df)``: the code of the call path of each call, and a
+    row per path code with its ``parent`` path code, ``name`` and ``level``
+    (0 for a root).
+
+    ``names`` holds an integer code per call, e.g. category codes, and
+    ``parent`` is from ``call_parents``."""
+    parent, depth, names = np.asarray(parent), np.asarray(depth), np.asarray(names).astype(np.int64)
+    path = np.full(len(parent), ROOT, dtype=np.int64)
+    # The level of a call in its tree, from that of its parent one depth up
+    level = np.zeros(len(parent), dtype=np.int64)
+    order, bounds = _levels(depth)
+    for _depth in range(1, len(bounds) - 1):
+        calls = order[bounds[_depth]:bounds[_depth + 1]]
+        nested = calls[parent[calls] != ROOT]
+        level[nested] = level[parent[nested]] + 1
+
+    span = int(names.max(initial=0)) + 1
+    frames = []
+    order, bounds = _levels(level)
+    for _level in range(len(bounds) - 1):
+        calls = order[bounds[_level]:bounds[_level + 1]]
+        parent_paths = np.where(parent[calls] != ROOT, path[parent[calls]], ROOT)
+        codes, uniques = pd.factorize((parent_paths + 1) * span + names[calls], sort=True)
+        offset = sum(len(_f) for _f in frames)
+        path[calls] = offset + codes
+        frames.append(pd.DataFrame(dict(parent=uniques // span - 1, name=uniques % span, level=_level)))
+    if not frames:
+        return path, pd.DataFrame(dict(parent=np.zeros(0, dtype=np.int64), name=0, level=0))
+    return path, pd.concat(frames, ignore_index=True)
+
+
+def path_stats_df(paths_df, path, dt, exclusive):
+    """``paths_df`` with the ``count`` of calls, their ``inclusive`` and
+    ``exclusive`` time per path."""
+    length = len(paths_df)
+    return paths_df.assign(
+        count=np.bincount(path, minlength=length),
+        inclusive=np.bincount(path, weights=dt, minlength=length),
+        exclusive=np.bincount(path, weights=exclusive, minlength=length),
+    )[PATH_COLUMNS]
+
+
+def depth_first(paths_df, by="inclusive"):
+    """The path codes of ``paths_df`` in tree order, the siblings of each
+    path heaviest ``by`` first."""
+    children = {}
+    for code in paths_df.index.values[np.argsort(-paths_df[by].values, kind="stable")]:
+        children.setdefault(paths_df.at[code, "parent"], []).append(code)
+    order, pending = [], children.get(ROOT, [])[::-1]
+    while pending:
+        code = pending.pop()
+        order.append(code)
+        pending.extend(children.get(code, [])[::-1])
+    return order
+
+
+def collapsed_stacks(paths_df, value="exclusive"):
+    """Flame graph input in the collapsed stack format, a ``"root;...;name
+    value"`` line per path with a positive integer ``value``."""
+    stacks = {}
+    lines = []
+    # Parents have smaller codes than their children
+    for code, parent, name, weight in zip(
+        paths_df.index.values, paths_df["parent"].values, paths_df["name"].astype(str).values, paths_df[value].values
+    ):
+        stacks[code] = name if parent == ROOT else stacks[parent] + STACK_SEPARATOR + name
+        if int(weight) > 0:
+            lines.append("{} {}".format(stacks[code], int(weight)))
+    return lines
@@ -0,0 +1,164 @@
+"""Decoded traces stored as a Parquet dataset.
+
+Decoding CTF is by far the slowest part of reading a trace, so ``pr convert``
+(and ``pr add`` with ``[profiler] convert_on_add``) decodes a trace once,
+with the projection ``TraceParser`` reads, pairs its calls and writes the lot
+as a single event table, in event order.  Each row is an event: its
+``event_id``, the fields of every decoded scope and, on call entries, the
+``exit``, ``depth`` and ``dt`` of the call (``NO_EXIT`` otherwise).  Parquet
+keeps per-column min/max statistics of every row group.
+
+``DatasetTraceIterator`` reads it back memory mapped, only the columns of the
+requested scopes, in the order they were written.  A ``dataset.json`` next to the ``events`` data records what
+went in; a dataset whose trace changed since is not read, see ``open_dataset``.
+
+``pyarrow`` is optional: without it there is no dataset and traces are always
+decoded.
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from . import pairing
+from .stage_cache import code_version
+from .trace_iterator import TraceIterator, trace_fingerprint
+
+AVAILABLE = pq is not None
+META_FILE_NAME = "dataset.json"
+DATA_DIR_NAME = "events"
+VERSION = 2
+CALL_COLUMNS = ["exit", "depth", "dt"]
+NO_EXIT = -1
+
+
+def write_dataset(parser, dataset_path):
+    """Writes the events and calls of the ``TraceParser`` ``parser`` to
+    ``dataset_path``, replacing what was there."""
+    assert AVAILABLE, "Converting traces needs pyarrow"
+    trace_iter = parser._trace_iter
+    frames = trace_iter.frames
+    columns, df = {}, pd.DataFrame(index=pd.RangeIndex(len(trace_iter)))
+    for scope, frame in frames.items():
+        assert not set(frame.columns) & set(df.columns), (scope, set(frame.columns) & set(df.columns))
+        columns[scope] = list(frame.columns)
+        df = pd.concat([df, frame], axis="columns")
+
+    calls_df = parser.calls_df
+    df["exit"] = NO_EXIT
+    df["depth"] = NO_EXIT
+    df["dt"] = 0
+    df.loc[calls_df["entry"].values, CALL_COLUMNS] = calls_df[CALL_COLUMNS].values
+    df.insert(0, "event_id", df.index.values)
+
+    meta = dict(
+        version=VERSION,
+        pairing=code_version(pairing.__name__),
+        fingerprint=trace_iter.fingerprint,
+        scopes=trace_iter._scopes,
+        name_prefixes=trace_iter._name_prefixes,
+        columns=columns,
+        length=len(df),
+    )
+    parent = os.path.dirname(os.path.abspath(dataset_path))
+    os.makedirs(parent, exist_ok=True)
+    # Written aside and swapped in, so readers never see a partial dataset
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix=".dataset-")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    data_path = os.path.join(tmp_path, DATA_DIR_NAME)
+    # A single file: its rows are read back in the order they are written
+    os.makedirs(data_path)
+    pq.write_table(table, os.path.join(data_path, "events.parquet"), write_statistics=True)
+    with open(os.path.join(tmp_path, META_FILE_NAME), "w") as f:
+        json.dump(meta, f)
+    if os.path.exists(dataset_path):
+        stale_path = tempfile.mkdtemp(dir=parent, prefix=".stale-")
+        os.replace(dataset_path, os.path.join(stale_path, "dataset"))
+        os.replace(tmp_path, dataset_path)
+        shutil.rmtree(stale_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, dataset_path)
+
+
+def read_meta(dataset_path):
+    meta_path = os.path.join(dataset_path, META_FILE_NAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta if meta.get("version") == VERSION else None
+
+
+def open_dataset(dataset_path, trace_path, scopes, name_prefixes):
+    """A ``DatasetTraceIterator`` over the trace at ``trace_path``, with the
+    ``TraceIterator`` ``scopes`` and ``name_prefixes``, or None when there is
+    no current dataset at ``dataset_path`` with all of that."""
+    if not AVAILABLE or dataset_path is None:
+        return None
+    meta = read_meta(dataset_path)
+    if meta is None or meta["pairing"] != code_version(pairing.__name__):
+        return None
+    scopes = TraceIterator._projection(scopes)
+    name_prefixes = None if name_prefixes is None else tuple(name_prefixes)
+    if tuple(meta["name_prefixes"] or ()) != tuple(name_prefixes or ()):
+        return None
+    for scope, fields in scopes.items():
+        stored = meta["columns"].get(scope)
+        if stored is None or fields is not None and not set(fields) <= set(stored):
+            return None
+    if meta["fingerprint"] != trace_fingerprint(trace_path, meta["scopes"], name_prefixes):
+        return None
+    return DatasetTraceIterator(dataset_path, meta, scopes=scopes, name_prefixes=name_prefixes)
+
+
+class DatasetTraceIterator(TraceIterator):
+    """The frames of a trace converted by ``write_dataset``."""
+
+    def __init__(self, dataset_path, meta, scopes=None, name_prefixes=None):
+        super().__init__(scopes=list(meta["columns"]) if scopes is None else scopes, name_prefixes=name_prefixes)
+        self._dataset_path = dataset_path
+        self._meta = meta
+        self._calls_df = None
+
+    @classmethod
+    def from_path(cls, dataset_path, scopes=None, name_prefixes=None):
+        meta = read_meta(dataset_path)
+        assert meta is not None, dataset_path
+        return cls(dataset_path, meta, scopes=scopes, name_prefixes=name_prefixes)
+
+    @property
+    def fingerprint(self):
+        # That of the trace it was converted from: the frames are the same
+        return self._meta["fingerprint"]
+
+    def _read(self, columns):
+        """``columns`` of every event, in event order."""
+        dataset = pq.ParquetDataset(os.path.join(self._dataset_path, DATA_DIR_NAME), memory_map=True)
+        df = dataset.read(columns=columns, use_threads=True).to_pandas()
+        assert len(df) == self._meta["length"], self._dataset_path
+        return df
+
+    def _decode(self):
+        fields = {
+            _s: self._meta["columns"][_s] if _f is None else list(_f) for _s, _f in self._scopes.items()
+        }
+        df = self._read(sorted({_c for _f in fields.values() for _c in _f}))
+        self._len = len(df)
+        return {_s: df[_f] for _s, _f in fields.items()}
+
+    @property
+    def calls_df(self):
+        if self._calls_df is None:
+            df = self._read(["event_id"] + CALL_COLUMNS)
+            df = df[df["exit"].values != NO_EXIT].rename(columns=dict(event_id="entry"))
+            df = df.sort_values("exit", kind="mergesort").reset_index(drop=True)
+            self._calls_df = df[["entry"] + CALL_COLUMNS]
+        return self._calls_df
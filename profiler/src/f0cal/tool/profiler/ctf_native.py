@@ -0,0 +1,1713 @@
+"""A pure NumPy reader for the CTF traces written by LTTng-UST.
+
+The TSDL metadata is parsed once and every stream file is memory-mapped and
+decoded in two phases:
+
+1. a walk over the event records that only finds record boundaries: the
+   event class, the timestamp and the offset of every fixed-layout run of
+   fields.  Records follow one another, so a packet can only be walked an
+   event at a time; the packets are walked side by side instead, each step
+   decoding the next event of every packet at once with NumPy.  Headers are
+   bit fields read at fixed offsets per (tag, alignment residue), fixed runs
+   have a size per residue and strings end at the first NUL after them;
+2. a bulk gather per (run, alignment residue) that views those records as a
+   NumPy structured array and yields whole columns at once.
+
+The walk takes as many steps as the longest packet has events, so it is
+fastest on traces of many packets, as LTTng writes them (a packet per
+sub-buffer).
+
+Only what the f0cal shims and the LTTng contexts emit is on the fast path:
+byte-aligned integers and floats, integer arrays and sequences, and strings.
+Anything else raises ``UnsupportedTrace`` while the metadata is compiled, and
+``NativeCtfTraceIterator.from_path`` falls back to the ``FALLBACK_DECODER``
+backend.
+"""
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import mmap
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import payload
+from .pandas_helpers import ColumnBuffer
+from .trace_iterator import TraceIterator, decoder_cls, segment_of, window_bounds
+
+LOG = logging.getLogger(__name__)
+
+METADATA_FILE_NAME = "metadata"
+_METADATA_MAGIC = 0x75D11D57
+_METADATA_HEADER_SIZE = 37
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+class UnsupportedTrace(Exception):
+    pass
+
+
+# --- TSDL metadata ----------------------------------------------------------
+
+_TOKEN_REGEX = re.compile(
+    r"""
+    (?P<ws>\s+|/\*.*?\*/|//[^\n]*)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?(?:0[xX][0-9a-fA-F]+|\d+)[uUlL]*)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<punct>:=|\.\.\.|[{}()\[\];=,<>:.+*-])
+""",
+    re.VERBOSE | re.DOTALL,
+)
+
+
+class _Token(str):
+    kind = None
+
+
+def _tokenize(text):
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_REGEX.match(text, pos)
+        if match is None:
+            raise UnsupportedTrace("Bad TSDL near {!r}".format(text[pos:pos + 20]))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "ws":
+            continue
+        token = _Token(match.group(kind))
+        token.kind = kind
+        yield token
+
+
+def _parse_number(token):
+    digits = token.rstrip("uUlL")
+    if re.match(r"^-?0\d+$", digits):
+        return int(digits, 8)
+    return int(digits, 0)
+
+
+def _is_true(value):
+    return value in (1, "1", "true", "TRUE")
+
+
+class _Integer:
+    def __init__(self, attrs):
+        self.size = int(attrs["size"])
+        self.align = int(attrs.get("align", 8 if self.size % 8 == 0 else 1))
+        self.signed = _is_true(attrs.get("signed", "false"))
+        self.byte_order = attrs.get("byte_order")
+        self.encoding = attrs.get("encoding", "none")
+        self.map = attrs.get("map")
+
+
+class _Float:
+    def __init__(self, attrs):
+        self.size = int(attrs["exp_dig"]) + int(attrs["mant_dig"])
+        self.align = int(attrs.get("align", 8))
+        self.byte_order = attrs.get("byte_order")
+
+
+class _String:
+    align = 8
+
+
+class _Enum:
+    def __init__(self, container, entries):
+        self.container = container
+        self.entries = entries
+        self.align = container.align
+
+    def label(self, value):
+        for label, low, high in self.entries:
+            if low <= value <= high:
+                return label
+        return None
+
+
+class _Struct:
+    def __init__(self, fields, align=1):
+        self.fields = fields
+        self.align = max([align] + [_align(_t) for _, _t in fields])
+
+
+class _Variant:
+    align = 1
+
+    def __init__(self, tag, options):
+        self.tag = tag
+        self.options = options
+
+
+class _Array:
+    def __init__(self, elem, length):
+        self.elem = elem
+        self.length = length
+        self.align = _align(elem)
+
+
+class _Sequence:
+    def __init__(self, elem, length_ref):
+        self.elem = elem
+        self.length_ref = length_ref
+        self.align = _align(elem)
+
+
+def _align(a_type):
+    return a_type.align
+
+
+class _TsdlParser:
+    _TYPE_KEYWORDS = {"integer", "floating_point", "string", "enum", "struct", "variant"}
+    _BLOCKS = {"trace", "env", "clock", "stream", "event", "callsite"}
+
+    def __init__(self, text):
+        self._tokens = list(_tokenize(text))
+        self._pos = 0
+        self._aliases = {}
+        self._structs = {}
+        self._variants = {}
+        self._enums = {}
+        self.blocks = []
+
+    def _peek(self, offset=0):
+        pos = self._pos + offset
+        return self._tokens[pos] if pos < len(self._tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise UnsupportedTrace("Unexpected end of TSDL")
+        self._pos += 1
+        return token
+
+    def _expect(self, expected):
+        token = self._next()
+        if token != expected:
+            raise UnsupportedTrace("Expected {!r}, got {!r}".format(expected, token))
+        return token
+
+    def parse(self):
+        while self._peek() is not None:
+            token = self._peek()
+            if token == "typealias":
+                self._typealias()
+            elif token == "typedef":
+                self._typedef()
+            elif token in self._BLOCKS:
+                self._next()
+                self.blocks.append((str(token), self._block()))
+            elif token in ("struct", "enum", "variant"):
+                self._type()
+            elif token == ";":
+                self._next()
+                continue
+            else:
+                raise UnsupportedTrace("Unexpected TSDL token {!r}".format(token))
+            self._expect(";")
+        return self
+
+    def _typealias(self):
+        self._expect("typealias")
+        a_type = self._type()
+        self._expect(":=")
+        self._aliases[self._name_until(";")] = a_type
+
+    def _typedef(self):
+        self._expect("typedef")
+        a_type = self._type()
+        self._aliases[self._name_until(";")] = a_type
+
+    def _name_until(self, stop):
+        idents = []
+        while self._peek() != stop:
+            idents.append(self._next())
+        return " ".join(idents)
+
+    def _dotted(self):
+        parts = [self._next()]
+        while self._peek() == ".":
+            self._next()
+            parts.append(self._next())
+        return ".".join(parts)
+
+    def _value(self):
+        token = self._peek()
+        if token.kind == "string":
+            self._next()
+            return token[1:-1]
+        if token.kind == "number":
+            self._next()
+            return _parse_number(token)
+        return self._dotted()
+
+    def _block(self):
+        self._expect("{")
+        attrs = {}
+        while self._peek() != "}":
+            if self._peek() == "typealias":
+                self._typealias()
+                self._expect(";")
+                continue
+            key = self._dotted()
+            op = self._next()
+            if op == ":=":
+                attrs[key] = self._type()
+            elif op == "=":
+                attrs[key] = self._value()
+            else:
+                raise UnsupportedTrace("Unexpected {!r} in block".format(op))
+            self._expect(";")
+        self._expect("}")
+        return attrs
+
+    def _optional_name(self):
+        token = self._peek()
+        if token is not None and token.kind == "ident":
+            self._next()
+            return str(token)
+        return None
+
+    def _type(self):
+        token = self._next()
+        if token == "integer":
+            return _Integer(self._block())
+        if token == "floating_point":
+            return _Float(self._block())
+        if token == "string":
+            if self._peek() == "{":
+                self._block()
+            return _String()
+        if token == "enum":
+            return self._enum()
+        if token == "struct":
+            return self._struct()
+        if token == "variant":
+            return self._variant()
+        idents = [token]
+        while self._peek() is not None and self._peek().kind == "ident":
+            idents.append(self._next())
+        return self._alias(" ".join(idents))
+
+    def _alias(self, name):
+        if name not in self._aliases:
+            raise UnsupportedTrace("Unknown type {!r}".format(name))
+        return self._aliases[name]
+
+    def _enum(self):
+        name = self._optional_name()
+        if self._peek() != ":" and self._peek() != "{":
+            return self._enums[name]
+        if self._peek() == ":":
+            self._next()
+            container = self._type()
+        else:
+            container = self._alias("int")
+        self._expect("{")
+        entries, value = [], 0
+        while self._peek() != "}":
+            label = self._next()
+            label = label[1:-1] if label.kind == "string" else str(label)
+            low = high = value
+            if self._peek() == "=":
+                self._next()
+                low = high = _parse_number(self._next())
+                if self._peek() == "...":
+                    self._next()
+                    high = _parse_number(self._next())
+            entries.append((label, low, high))
+            value = high + 1
+            if self._peek() == ",":
+                self._next()
+        self._expect("}")
+        enum = _Enum(container, entries)
+        if name is not None:
+            self._enums[name] = enum
+        return enum
+
+    def _fields(self):
+        self._expect("{")
+        fields = []
+        while self._peek() != "}":
+            if self._peek() == "typealias":
+                self._typealias()
+                self._expect(";")
+                continue
+            fields.append(self._field())
+        self._expect("}")
+        return fields
+
+    def _field(self):
+        if self._peek() in self._TYPE_KEYWORDS:
+            a_type = self._type()
+            name = str(self._next())
+        else:
+            idents = []
+            while self._peek() not in (";", "["):
+                idents.append(self._next())
+            name = str(idents.pop())
+            a_type = self._alias(" ".join(idents))
+        lengths = []
+        while self._peek() == "[":
+            self._next()
+            lengths.append(self._name_until("]").replace(" ", ""))
+            self._expect("]")
+        for length in reversed(lengths):
+            if re.match(r"^\d+$", length):
+                a_type = _Array(a_type, int(length))
+            else:
+                a_type = _Sequence(a_type, length)
+        self._expect(";")
+        return name, a_type
+
+    def _struct(self):
+        name = self._optional_name()
+        if self._peek() != "{":
+            return self._structs[name]
+        fields = self._fields()
+        align = 1
+        if self._peek() == "align":
+            self._next()
+            self._expect("(")
+            align = _parse_number(self._next())
+            self._expect(")")
+        a_struct = _Struct(fields, align)
+        if name is not None:
+            self._structs[name] = a_struct
+        return a_struct
+
+    def _variant(self):
+        name = self._optional_name()
+        tag = None
+        if self._peek() == "<":
+            self._next()
+            tag = self._name_until(">").replace(" ", "")
+            self._expect(">")
+        if self._peek() != "{":
+            return self._variants[name]
+        variant = _Variant(tag, dict(self._fields()))
+        if name is not None:
+            self._variants[name] = variant
+        return variant
+
+
+def read_metadata_text(path):
+    """The TSDL text of a metadata file, unpacking packetized metadata."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic = data[:4]
+    for order in ("little", "big"):
+        if int.from_bytes(magic, order) == _METADATA_MAGIC:
+            break
+    else:
+        return data.decode("utf-8", errors="replace")
+    chunks, offset = [], 0
+    while offset + _METADATA_HEADER_SIZE <= len(data):
+        content_size = int.from_bytes(data[offset + 24:offset + 28], order)
+        packet_size = int.from_bytes(data[offset + 28:offset + 32], order)
+        chunks.append(data[offset + _METADATA_HEADER_SIZE:offset + content_size // 8])
+        offset += packet_size // 8
+    return b"".join(chunks).decode("utf-8", errors="replace")
+
+
+class CtfMetadata:
+    def __init__(self, blocks):
+        trace = self._single(blocks, "trace")
+        self.byte_order = {"le": "<", "be": ">", "network": ">"}[trace.get("byte_order", "le")]
+        self.packet_header = trace.get("packet.header")
+        clocks = [_b for _n, _b in blocks if _n == "clock"]
+        self.clock = clocks[0] if clocks else dict(freq=1000000000)
+        self.streams = {}
+        for name, block in blocks:
+            if name == "stream":
+                self.streams[int(block.get("id", 0))] = block
+        self.events = {}
+        for name, block in blocks:
+            if name == "event":
+                key = (int(block.get("stream_id", 0)), int(block.get("id", 0)))
+                self.events[key] = block
+
+    @staticmethod
+    def _single(blocks, block_name):
+        found = [_b for _n, _b in blocks if _n == block_name]
+        if len(found) != 1:
+            raise UnsupportedTrace("Expected one {} block, found {}".format(block_name, len(found)))
+        return found[0]
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(_TsdlParser(text).parse().blocks)
+
+    @classmethod
+    def from_path(cls, trace_dir):
+        return cls.from_text(read_metadata_text(os.path.join(trace_dir, METADATA_FILE_NAME)))
+
+    def cycles_to_ns(self, cycles):
+        """Mirrors babeltrace 1: ``offset_s`` and ``offset`` are added to every
+        timestamp, and non-GHz clocks go through a double conversion."""
+        freq = int(self.clock.get("freq", 1000000000))
+        offset_s = int(self.clock.get("offset_s", 0))
+        offset = int(self.clock.get("offset", 0))
+        if freq == 1000000000:
+            return cycles.astype(np.int64) + (offset_s * 1000000000 + offset)
+        scale = 1e9 / float(freq)
+        base = offset_s * 1000000000 + int(offset * scale)
+        return (cycles.astype(np.float64) * scale).astype(np.int64) + base
+
+
+# --- Field compilation ------------------------------------------------------
+
+
+def _field_name(name):
+    # babeltrace strips the leading underscore LTTng uses to escape field names
+    return name[1:] if name.startswith("_") else name
+
+
+def _resolved_order(a_type, default):
+    order = getattr(a_type, "byte_order", None)
+    if order in (None, "native"):
+        return default
+    return {"le": "<", "be": ">", "network": ">"}[order]
+
+
+def _scalar_dtype(a_type, default_order):
+    """The NumPy dtype of a byte-aligned scalar, or None if it isn't one."""
+    if isinstance(a_type, _Integer):
+        if a_type.size not in (8, 16, 32, 64) or a_type.align % 8 != 0 or a_type.encoding not in ("none", None):
+            return None
+        kind = "i" if a_type.signed else "u"
+        return np.dtype("{}{}{}".format(_resolved_order(a_type, default_order), kind, a_type.size // 8))
+    if isinstance(a_type, _Float):
+        if a_type.size not in (32, 64) or a_type.align % 8 != 0:
+            return None
+        return np.dtype("{}f{}".format(_resolved_order(a_type, default_order), a_type.size // 8))
+    return None
+
+
+def _align_up(pos, align):
+    return -(-pos // align) * align
+
+
+class _RunLayout:
+    """Where the fields of a ``_FixedRun`` lie, for one start-offset residue."""
+
+    def __init__(self, run, residue):
+        pos = residue
+        offsets = []
+        for _, _, dtype, align, count in run.fields:
+            pos = _align_up(pos, align)
+            offsets.append(pos - residue)
+            pos += dtype.itemsize * count
+        self.size = pos - residue
+        self.offsets = offsets
+
+    def dtype(self, run, wanted):
+        names, formats, offsets = [], [], []
+        for index, (scope, name, dtype, _, count) in enumerate(run.fields):
+            if (scope, name) not in wanted:
+                continue
+            names.append("f{}".format(index))
+            formats.append(dtype if count == 1 else (dtype, (count,)))
+            offsets.append(self.offsets[index])
+        return np.dtype(dict(names=names, formats=formats, offsets=offsets, itemsize=max(self.size, 1)))
+
+
+class _FixedRun:
+    """Consecutive byte-aligned scalars and fixed arrays: a fixed layout once
+    the start offset modulo the largest alignment is known."""
+
+    _ids = 0
+
+    def __init__(self):
+        _FixedRun._ids += 1
+        self.id = _FixedRun._ids
+        self.fields = []
+        self.length_fields = []
+        self.align = 1
+        self._layouts = {}
+        self._tables = None
+
+    def add(self, scope, name, dtype, align, count=1):
+        self.fields.append((scope, name, dtype, align, count))
+        self.align = max(self.align, align)
+
+    def layout(self, residue):
+        layout = self._layouts.get(residue)
+        if layout is None:
+            layout = self._layouts[residue] = _RunLayout(self, residue)
+        return layout
+
+    def tables(self):
+        """``(sizes, length_reads)``, indexed by start residue: the size of the
+        run, and ``(name, offsets, dtype)`` of each field a sequence takes its
+        length from."""
+        if self._tables is None:
+            layouts = [self.layout(_r) for _r in range(self.align)]
+            sizes = np.array([_l.size for _l in layouts], dtype=np.int64)
+            length_reads = [
+                (self.fields[_i][1], np.array([_l.offsets[_i] for _l in layouts], dtype=np.int64), self.fields[_i][2])
+                for _i in self.length_fields
+            ]
+            self._tables = (sizes, length_reads)
+        return self._tables
+
+
+_ALIGN, _FIXED, _SEQ, _STR = range(4)
+
+
+class _OpCompiler:
+    def __init__(self, byte_order):
+        self._byte_order = byte_order
+        self.ops = []
+        self._run = None
+        self._fields = {}
+
+    def _close_run(self):
+        if self._run is not None and self._run.fields:
+            self.ops.append((_FIXED, self._run))
+        self._run = None
+
+    def add_struct(self, scope, a_struct):
+        if a_struct is None:
+            return
+        if not isinstance(a_struct, _Struct):
+            raise UnsupportedTrace("{} is not a struct".format(scope))
+        self._close_run()
+        self.ops.append((_ALIGN, max(a_struct.align // 8, 1)))
+        for raw_name, a_type in a_struct.fields:
+            self._add_field(scope, _field_name(raw_name), a_type)
+        self._close_run()
+
+    def _add_field(self, scope, name, a_type):
+        dtype = _scalar_dtype(a_type, self._byte_order)
+        if dtype is None and isinstance(a_type, _Array):
+            elem_dtype = _scalar_dtype(a_type.elem, self._byte_order)
+            if elem_dtype is not None:
+                self._fixed(scope, name, elem_dtype, a_type.align // 8, a_type.length)
+                return
+        if dtype is not None:
+            self._fixed(scope, name, dtype, a_type.align // 8)
+        elif isinstance(a_type, _String):
+            self._close_run()
+            self.ops.append((_STR, scope, name))
+        elif isinstance(a_type, _Sequence):
+            elem_dtype = _scalar_dtype(a_type.elem, self._byte_order)
+            length_key = (scope, _field_name(a_type.length_ref.split(".")[-1]))
+            if elem_dtype is None or length_key not in self._fields:
+                raise UnsupportedTrace("Unsupported sequence {}".format(name))
+            run, index = self._fields[length_key]
+            if index not in run.length_fields:
+                run.length_fields.append(index)
+            self._close_run()
+            self.ops.append((_SEQ, scope, name, elem_dtype, max(a_type.align // 8, 1), length_key))
+        else:
+            raise UnsupportedTrace("Unsupported field {} ({})".format(name, type(a_type).__name__))
+
+    def _fixed(self, scope, name, dtype, align, count=1):
+        if self._run is None:
+            self._run = _FixedRun()
+        self._fields[(scope, name)] = (self._run, len(self._run.fields))
+        self._run.add(scope, name, dtype, max(align, 1), count)
+
+
+class _HeaderDecoder:
+    """Decoder for the LTTng event header (``id`` enum or integer, optionally
+    followed by a ``v`` variant with compact/extended options).
+
+    The bit layout is compiled once per (tag value, start residue); the
+    headers of a walk step are grouped by those and each field is read for a
+    whole group at once.
+    """
+
+    def __init__(self, a_struct, byte_order):
+        if not isinstance(a_struct, _Struct) or not a_struct.fields:
+            raise UnsupportedTrace("Unsupported event header")
+        self._struct = a_struct
+        self._little = byte_order == "<"
+        self.align = max(a_struct.align // 8, 1)
+        _, tag_type = a_struct.fields[0]
+        self._tag = tag_type if isinstance(tag_type, _Enum) else None
+        tag_int = tag_type.container if isinstance(tag_type, _Enum) else tag_type
+        if not isinstance(tag_int, _Integer):
+            raise UnsupportedTrace("Unsupported event header tag")
+        self._tag_size = tag_int.size
+        self._plans = {}
+
+    def _plan(self, tag, residue):
+        label = None if self._tag is None else self._tag.label(tag)
+        fields = []
+        end = self._walk(self._struct, label, residue * 8, fields)
+        size = (end - residue * 8 + 7) // 8
+        # Bit offsets from the start of the header
+        specs = {_n: (_b - residue * 8, _s) for _n, _b, _s in fields}
+        plan = self._plans[(tag, residue)] = (size, specs.get("id"), specs.get("timestamp"))
+        return plan
+
+    def _walk(self, a_struct, label, bit, fields):
+        bit = _align_up(bit, a_struct.align)
+        for name, a_type in a_struct.fields:
+            if isinstance(a_type, _Variant):
+                if label not in a_type.options:
+                    raise UnsupportedTrace("Unknown event header variant {!r}".format(label))
+                bit = self._walk(a_type.options[label], label, bit, fields)
+                continue
+            if isinstance(a_type, _Struct):
+                bit = self._walk(a_type, label, bit, fields)
+                continue
+            an_int = a_type.container if isinstance(a_type, _Enum) else a_type
+            if not isinstance(an_int, _Integer):
+                raise UnsupportedTrace("Unsupported event header field {}".format(name))
+            bit = _align_up(bit, an_int.align)
+            fields.append((_field_name(name), bit, an_int.size))
+            bit += an_int.size
+        return bit
+
+    def decode(self, u8, positions):
+        """``(event_ids, timestamps, timestamp_bits, ends)`` of the headers at
+        ``positions``; ``timestamp_bits`` is 0 for headers without one."""
+        little = self._little
+        tags = _bit_fields(u8, positions, 0, self._tag_size, little).astype(np.int64)
+        event_ids = tags.copy()
+        timestamps = np.zeros(len(positions), dtype=np.uint64)
+        timestamp_bits = np.zeros(len(positions), dtype=np.int64)
+        ends = np.empty(len(positions), dtype=np.int64)
+        keys, groups = np.unique(tags * 8 + (positions & 7), return_inverse=True)
+        for group, key in enumerate(keys.tolist()):
+            tag, residue = key >> 3, key & 7
+            size, id_spec, ts_spec = self._plans.get((tag, residue)) or self._plan(tag, residue)
+            members = np.flatnonzero(groups == group) if len(keys) > 1 else slice(None)
+            at = positions[members]
+            ends[members] = at + size
+            if id_spec is not None:
+                event_ids[members] = _bit_fields(u8, at, id_spec[0], id_spec[1], little).astype(np.int64)
+            if ts_spec is not None:
+                timestamps[members] = _bit_fields(u8, at, ts_spec[0], ts_spec[1], little)
+                timestamp_bits[members] = ts_spec[1]
+        return event_ids, timestamps, timestamp_bits, ends
+
+
+def _uints(u8, positions, size, little):
+    """The unsigned integers of ``size`` bytes (8 at most) at ``positions``."""
+    raw = u8[positions[:, None] + np.arange(size)]
+    if not little:
+        raw = raw[:, ::-1]
+    padded = np.zeros((len(positions), 8), dtype=np.uint8)
+    padded[:, :size] = raw
+    return padded.view("<u8").ravel()
+
+
+def _bit_fields(u8, positions, bit, size, little):
+    """The ``size``-bit (64 at most) unsigned integers ``bit`` bits past each
+    of ``positions``, with the bit numbering of ``_read_bits``."""
+    first = positions + (bit >> 3)
+    shift = bit & 7
+    length = (shift + size + 7) >> 3
+    mask = np.uint64((1 << size) - 1)
+    if length <= 8:
+        raw = _uints(u8, first, length, little)
+        return (raw >> np.uint64(shift if little else 8 * length - shift - size)) & mask
+    # Spans 9 bytes: the first 8, then the bits left in the last one
+    head, last = _uints(u8, first, 8, little), u8[first + 8].astype(np.uint64)
+    if little:
+        return ((head >> np.uint64(shift)) | (last << np.uint64(64 - shift))) & mask
+    return ((head << np.uint64(shift)) | (last >> np.uint64(8 - shift))) >> np.uint64(64 - size)
+
+
+def _values(u8, positions, dtype):
+    """The ``dtype`` scalars at ``positions``, as int64."""
+    raw = u8[positions[:, None] + np.arange(dtype.itemsize)]
+    return raw.view(dtype).ravel().astype(np.int64)
+
+
+_STRING_WINDOW = 64
+
+
+def _string_ends(u8, starts):
+    """The position of the NUL ending the string at each of ``starts``: the
+    bytes after every start are scanned at once, over windows that double
+    until every string has ended."""
+    stops = np.empty(len(starts), dtype=np.int64)
+    pending = np.arange(len(starts))
+    skip, width = 0, _STRING_WINDOW
+    while len(pending):
+        if skip >= len(u8):
+            raise UnsupportedTrace("Unterminated string")
+        index = (starts[pending] + skip)[:, None] + np.arange(width)
+        nuls = u8[index.clip(max=len(u8) - 1)] == 0
+        nuls &= index < len(u8)
+        found = nuls.any(axis=1)
+        stops[pending[found]] = index[found, nuls[found].argmax(axis=1)]
+        pending = pending[~found]
+        skip, width = skip + width, width * 2
+    return stops
+
+
+def _read_bits(buf, bit_pos, size, little, signed):
+    first = bit_pos >> 3
+    last = (bit_pos + size + 7) >> 3
+    if little:
+        raw = int.from_bytes(buf[first:last], "little")
+        value = (raw >> (bit_pos & 7)) & ((1 << size) - 1)
+    else:
+        raw = int.from_bytes(buf[first:last], "big")
+        value = (raw >> ((last << 3) - bit_pos - size)) & ((1 << size) - 1)
+    if signed and value >> (size - 1):
+        value -= 1 << size
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def _struct_layout(a_struct):
+    """The integer fields of a small struct (packet header and context) as
+    ``([(name, bit, size, signed, length)], size)``: bits from the struct's
+    aligned start, ``length`` None for scalars and the item count for arrays.
+    A struct is aligned as its most aligned field, so the layout holds
+    wherever the struct is."""
+    fields = []
+    bit = 0
+    for raw_name, a_type in a_struct.fields:
+        name = _field_name(raw_name)
+        length = None
+        if isinstance(a_type, _Array):
+            a_type, length = a_type.elem, a_type.length
+        an_int = a_type.container if isinstance(a_type, _Enum) else a_type
+        if not isinstance(an_int, _Integer):
+            raise UnsupportedTrace("Unsupported packet field {}".format(name))
+        bit = _align_up(bit, an_int.align)
+        fields.append((name, bit, an_int.size, an_int.signed, length))
+        bit += an_int.size * (1 if length is None else length)
+    return fields, bit
+
+
+def _decode_struct(buf, pos, a_struct, byte_order):
+    """Field-by-field decode of a small struct (packet header and context)."""
+    values = {}
+    start = _align_up(pos * 8, a_struct.align)
+    little = byte_order == "<"
+    fields, size = _struct_layout(a_struct)
+    for name, bit, bits, signed, length in fields:
+        if length is None:
+            values[name] = _read_bits(buf, start + bit, bits, little, signed)
+        else:
+            values[name] = [_read_bits(buf, start + bit + _i * bits, bits, little, signed) for _i in range(length)]
+    return values, (start + size + 7) // 8
+
+
+def _struct_field(buf, pos, a_struct, name, little):
+    """``(value, end)``: the scalar field ``name`` of the struct at ``pos``
+    (None when it has no such field) and where the struct ends."""
+    start = _align_up(pos * 8, a_struct.align)
+    fields, size = _struct_layout(a_struct)
+    value = None
+    for field_name, bit, bits, signed, length in fields:
+        if field_name == name and length is None:
+            value = _read_bits(buf, start + bit, bits, little, signed)
+    return value, (start + size + 7) // 8
+
+
+def _decode_structs(u8, positions, a_struct, little):
+    """``(values, ends)``: ``_decode_struct`` of the structs at every one of
+    ``positions`` at once, ``{name: array}`` (an item per column for arrays)."""
+    starts = positions * 8
+    starts += -starts % a_struct.align
+    fields, size = _struct_layout(a_struct)
+    values = {}
+    for name, bit, bits, signed, length in fields:
+        columns = []
+        for item in range(1 if length is None else length):
+            # Bit offsets past the byte of each start, which are all the same
+            # for byte-aligned structs
+            bit_starts = starts + bit + item * bits
+            residues = bit_starts & 7
+            column = np.zeros(len(positions), dtype=np.uint64)
+            for residue in np.unique(residues).tolist():
+                members = np.flatnonzero(residues == residue)
+                column[members] = _bit_fields(u8, bit_starts[members] >> 3, residue, bits, little)
+            if signed:
+                column = column.view(np.int64)
+                if bits < 64:
+                    column = np.where(column >> (bits - 1), column - (1 << bits), column)
+            columns.append(column)
+        values[name] = columns[0] if length is None else np.stack(columns, axis=1)
+    return values, (starts + size + 7) // 8
+
+
+class _EventClass:
+    def __init__(self, name, ops, keep, order):
+        self.name = name
+        self.ops = ops
+        self.keep = keep
+        self.order = order
+
+
+# --- Stream decoding --------------------------------------------------------
+
+
+class _StreamWalk:
+    """Phase 1 output for one stream file: the ``classes`` (indices into
+    ``_TraceDecoder.class_list``), ``cycles`` and ``packet_of_event`` of the
+    events kept, in file order, and where their fields are, by event number.
+    """
+
+    def __init__(self):
+        self.classes = np.zeros(0, dtype=np.int64)
+        self.cycles = np.zeros(0, dtype=np.uint64)
+        # {field: value per packet} of the packet contexts
+        self.packets = {}
+        self.packet_of_event = np.zeros(0, dtype=np.int64)
+        # {run id: (run, seqs, offsets)}
+        self.runs = {}
+        # {(scope, name, dtype): (seqs, starts, counts)}
+        self.seqs = {}
+        # {(scope, name): (seqs, starts, stops)}
+        self.strings = {}
+
+
+class _Lanes:
+    """The packets of a walk, decoded side by side.
+
+    Events are numbered as they are found, ``packet * stride + n`` for the
+    ``n``-th event kept in a packet, and renumbered in file order once every
+    packet is done.
+    """
+
+    def __init__(self, count, stride):
+        self.stride = stride
+        self.kept = np.zeros(count, dtype=np.int64)
+        self.events = []
+        self.runs, self.seqs, self.strings = {}, {}, {}
+
+    def keep(self, packets, class_index, cycles):
+        numbers = packets * self.stride + self.kept[packets]
+        self.kept[packets] += 1
+        self.events.append((numbers, np.full(len(packets), class_index, dtype=np.int64), cycles))
+        return numbers
+
+    @staticmethod
+    def _add(groups, key, *arrays):
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = tuple([] for _ in arrays)
+        for values, column in zip(arrays, group):
+            column.append(values)
+
+    def finish(self, out):
+        """Fills ``out``, a ``_StreamWalk``, numbering the events in file order."""
+        bases = np.cumsum(self.kept) - self.kept
+
+        def renumbered(numbers):
+            return bases[numbers // self.stride] + numbers % self.stride
+
+        count = int(self.kept.sum())
+        out.classes = np.zeros(count, dtype=np.int64)
+        out.cycles = np.zeros(count, dtype=np.uint64)
+        out.packet_of_event = np.zeros(count, dtype=np.int64)
+        for numbers, classes, cycles in self.events:
+            seqs = renumbered(numbers)
+            out.classes[seqs], out.cycles[seqs], out.packet_of_event[seqs] = classes, cycles, numbers // self.stride
+        for run, (numbers, offsets) in self.runs.items():
+            out.runs[run.id] = (run, renumbered(np.concatenate(numbers)), np.concatenate(offsets))
+        for groups, target in ((self.seqs, out.seqs), (self.strings, out.strings)):
+            for key, (numbers, *columns) in groups.items():
+                target[key] = (renumbered(np.concatenate(numbers)),) + tuple(np.concatenate(_c) for _c in columns)
+
+
+class _TraceDecoder:
+    """Decodes every stream file of one trace directory."""
+
+    def __init__(self, trace_dir, scopes, name_prefixes):
+        self.trace_dir = trace_dir
+        self.metadata = CtfMetadata.from_path(trace_dir)
+        self.scopes = scopes
+        order = self.metadata.byte_order
+        self._little = order == "<"
+        supported = {"events", "event_fields", "event_context", "stream_event_context", "stream_packet_context"}
+        unsupported = set(scopes) - supported
+        if unsupported:
+            raise UnsupportedTrace("Unsupported scopes {}".format(sorted(unsupported)))
+        if not isinstance(self.metadata.packet_header, _Struct):
+            raise UnsupportedTrace("Missing trace packet header")
+
+        self._headers = {}
+        self.classes = {}
+        # The event classes by index, and the index of each by stream and id
+        self.class_list = []
+        self._stream_classes = {}
+        for key, block in sorted(self.metadata.events.items()):
+            stream_id, _ = key
+            stream = self.metadata.streams.get(stream_id)
+            if stream is None:
+                raise UnsupportedTrace("Event for unknown stream {}".format(stream_id))
+            if stream_id not in self._headers:
+                self._headers[stream_id] = _HeaderDecoder(stream.get("event.header"), order)
+            compiler = _OpCompiler(order)
+            compiler.add_struct("stream_event_context", stream.get("event.context"))
+            compiler.add_struct("event_context", block.get("context"))
+            compiler.add_struct("event_fields", block.get("fields"))
+            name = str(block.get("name"))
+            keep = name_prefixes is None or name.startswith(name_prefixes)
+            field_order = {}
+            for a_struct in (stream.get("event.context"), block.get("context"), block.get("fields")):
+                for raw_name, _ in getattr(a_struct, "fields", []):
+                    field_order.setdefault(_field_name(raw_name), len(field_order))
+            self.classes[key] = _EventClass(name, compiler.ops, keep, field_order)
+            self._stream_classes.setdefault(stream_id, {})[key[1]] = len(self.class_list)
+            self.class_list.append(self.classes[key])
+
+    def field_names(self):
+        """``(scope, name)`` of every wanted field of the event classes kept."""
+        for event_class in self.class_list:
+            if not event_class.keep:
+                continue
+            for op in event_class.ops:
+                if op[0] == _FIXED:
+                    fields = [(_s, _n) for _s, _n, _, _, _ in op[1].fields]
+                elif op[0] in (_SEQ, _STR):
+                    fields = [op[1:3]]
+                else:
+                    continue
+                for scope, name in fields:
+                    if self.wanted(scope, name):
+                        yield scope, name
+
+    def stream_files(self):
+        for file_name in sorted(os.listdir(self.trace_dir)):
+            path = os.path.join(self.trace_dir, file_name)
+            if file_name == METADATA_FILE_NAME or file_name.startswith(".") or not os.path.isfile(path):
+                continue
+            if os.path.getsize(path) > 0:
+                yield path
+
+    def wanted(self, scope, name):
+        if scope not in self.scopes:
+            return False
+        fields = self.scopes[scope]
+        return fields is None or name in fields
+
+    def walk(self, buf, packets=None):
+        """Phase 1 over every packet of a stream (or just ``packets``, a list of
+        byte offsets), see ``_Lanes``."""
+        out = _StreamWalk()
+        offsets = np.fromiter(packets if packets is not None else self._packet_offsets(buf, len(buf)), np.int64)
+        if not len(offsets):
+            return out
+        u8 = np.frombuffer(buf, dtype=np.uint8)
+        try:
+            stream_ids, out.packets, starts = self.packets_at(u8, offsets)
+            ends = offsets + (out.packets["content_size"] // 8).astype(np.int64)
+            begins = out.packets.get("timestamp_begin", np.zeros(len(offsets))).astype(np.uint64)
+            # Every event takes a byte at least
+            lanes = _Lanes(len(offsets), int((ends - starts).max(initial=0)) + 1)
+            for stream_id in np.unique(stream_ids).tolist():
+                packets = np.flatnonzero(stream_ids == stream_id)
+                if stream_id in self._headers:
+                    self._walk_packets(u8, stream_id, packets, starts[packets], ends[packets], begins[packets], lanes)
+        finally:
+            del u8
+        lanes.finish(out)
+        return out
+
+    def _walk_packets(self, u8, stream_id, packets, pos, ends, timestamps, lanes):
+        """Walks the events of ``packets`` of stream ``stream_id`` in step:
+        ``pos`` is where the events of each start and ``ends`` where they end,
+        ``timestamps`` their begin timestamps."""
+        header = self._headers[stream_id]
+        classes = self._stream_classes[stream_id]
+        while len(packets):
+            pos = pos + -pos % header.align
+            live = pos < ends
+            if not live.all():
+                packets, pos, ends, timestamps = packets[live], pos[live], ends[live], timestamps[live]
+                if not len(packets):
+                    break
+            event_ids, values, bits, pos = header.decode(u8, pos)
+            for size in np.unique(bits[bits > 0]).tolist():
+                members = np.flatnonzero(bits == size)
+                if size >= 64:
+                    timestamps[members] = values[members]
+                    continue
+                # The low bits of the timestamp, which wrap around
+                low = timestamps[members] & np.uint64((1 << size) - 1)
+                value = values[members]
+                timestamps[members] += value - low + np.where(value < low, np.uint64(1 << size), np.uint64(0))
+            unique_ids, class_of = np.unique(event_ids, return_inverse=True)
+            for position, event_id in enumerate(unique_ids.tolist()):
+                class_index = classes.get(event_id)
+                if class_index is None:
+                    raise UnsupportedTrace("Unknown event id {} in stream {}".format(event_id, stream_id))
+                members = np.flatnonzero(class_of == position)
+                event_class = self.class_list[class_index]
+                numbers = None
+                if event_class.keep:
+                    numbers = lanes.keep(packets[members], class_index, timestamps[members])
+                pos[members] = self._walk_fields(u8, event_class, pos[members], numbers, lanes)
+
+    @staticmethod
+    def _walk_fields(u8, event_class, pos, numbers, lanes):
+        """Where the events of ``event_class`` whose fields start at ``pos``
+        end, noting where the fields of those numbered ``numbers`` are (none
+        are noted without ``numbers``)."""
+        lengths = {}
+        for op in event_class.ops:
+            kind = op[0]
+            if kind == _FIXED:
+                run = op[1]
+                sizes, length_reads = run.tables()
+                residues = pos % run.align
+                if numbers is not None:
+                    lanes._add(lanes.runs, run, numbers, pos)
+                for name, offsets, dtype in length_reads:
+                    lengths[name] = _values(u8, pos + offsets[residues], dtype)
+                pos = pos + sizes[residues]
+            elif kind == _ALIGN:
+                pos = pos + -pos % op[1]
+            elif kind == _STR:
+                stops = _string_ends(u8, pos)
+                if numbers is not None:
+                    lanes._add(lanes.strings, op[1:], numbers, pos, stops)
+                pos = stops + 1
+            else:
+                _, scope, name, elem_dtype, elem_align, length_key = op
+                pos = pos + -pos % elem_align
+                counts = lengths[length_key[1]]
+                if numbers is not None:
+                    lanes._add(lanes.seqs, op[1:4], numbers, pos, counts)
+                pos = pos + counts * elem_dtype.itemsize
+        return pos
+
+    def _packet_offsets(self, buf, size):
+        offset = 0
+        while offset < size:
+            yield offset
+            packet_size = self._packet_size(buf, offset)
+            if packet_size <= 0:
+                raise UnsupportedTrace("Empty packet at {} in {}".format(offset, self.trace_dir))
+            offset += packet_size // 8
+
+    def _packet_size(self, buf, offset):
+        """The size in bits of the packet at ``offset``, reading just the
+        fields that give it."""
+        stream_id, pos = _struct_field(buf, offset, self.metadata.packet_header, "stream_id", self._little)
+        context_struct = self.metadata.streams.get(stream_id or 0, {}).get("packet.context")
+        packet_size = None
+        if context_struct is not None:
+            packet_size, _ = _struct_field(buf, pos, context_struct, "packet_size", self._little)
+        return (len(buf) - offset) * 8 if packet_size is None else packet_size
+
+    def packets_at(self, u8, offsets):
+        """``(stream_ids, contexts, starts)``: ``packet_at`` of the packets at
+        every one of ``offsets`` at once, ``contexts`` as ``{field: values}``
+        (0 for packets whose context lacks the field)."""
+        header, starts = _decode_structs(u8, offsets, self.metadata.packet_header, self._little)
+        stream_ids = header.get("stream_id", np.zeros(len(offsets), dtype=np.uint64)).astype(np.int64)
+        contexts = {}
+        for stream_id in np.unique(stream_ids).tolist():
+            members = np.flatnonzero(stream_ids == stream_id)
+            context_struct = self.metadata.streams.get(stream_id, {}).get("packet.context")
+            context = {}
+            if context_struct is not None:
+                context, starts[members] = _decode_structs(u8, starts[members], context_struct, self._little)
+            if "packet_size" not in context:
+                context["packet_size"] = ((len(u8) - offsets[members]) * 8).astype(np.uint64)
+            context.setdefault("content_size", context["packet_size"])
+            for name, values in context.items():
+                if name not in contexts:
+                    contexts[name] = np.zeros((len(offsets),) + values.shape[1:], dtype=values.dtype)
+                contexts[name][members] = values
+        return stream_ids, contexts, starts
+
+    def packet_at(self, buf, offset):
+        order = self.metadata.byte_order
+        header, pos = _decode_struct(buf, offset, self.metadata.packet_header, order)
+        stream_id = header.get("stream_id", 0)
+        context_struct = self.metadata.streams.get(stream_id, {}).get("packet.context")
+        context = {}
+        if context_struct is not None:
+            context, pos = _decode_struct(buf, pos, context_struct, order)
+        if "packet_size" not in context:
+            context["packet_size"] = (len(buf) - offset) * 8
+        context.setdefault("content_size", context["packet_size"])
+        return stream_id, context, pos
+
+    def gather(self, buf, walk, base, chunks):
+        """Phase 2: bulk-decode the columns recorded by ``walk``, appending
+        ``(seqs, values)`` chunks to ``chunks[(scope, name)]``."""
+        u8 = np.frombuffer(buf, dtype=np.uint8)
+        try:
+            for run, run_seqs, run_offsets in walk.runs.values():
+                wanted = {(_s, _n) for _s, _n, _, _, _ in run.fields if self.wanted(_s, _n)}
+                if not wanted:
+                    continue
+                residues = run_offsets % run.align
+                for residue in np.unique(residues).tolist():
+                    members = np.flatnonzero(residues == residue)
+                    layout = run.layout(residue)
+                    index = run_offsets[members, None] + np.arange(layout.size, dtype=np.int64)
+                    records = u8[index].view(layout.dtype(run, wanted)).ravel()
+                    seqs = run_seqs[members] + base
+                    for field_index, (scope, name, _, _, _) in enumerate(run.fields):
+                        if (scope, name) in wanted:
+                            values = _normalized(records["f{}".format(field_index)])
+                            chunks.setdefault((scope, name), []).append((seqs, values))
+            for (scope, name, dtype), (seqs, starts, counts) in walk.seqs.items():
+                if not self.wanted(scope, name):
+                    continue
+                counts = np.asarray(counts, dtype=np.int64)
+                starts = np.asarray(starts, dtype=np.int64)
+                if len(counts) and (counts == counts[0]).all():
+                    values = _normalized(_rows(u8, starts, int(counts[0]), dtype))
+                else:
+                    values = np.empty(len(counts), dtype=object)
+                    for count, members in _by_value(counts):
+                        values[members] = _object_array(_rows(u8, starts[members], count, dtype).tolist())
+                chunks.setdefault((scope, name), []).append((np.asarray(seqs, dtype=np.int64) + base, values))
+            for (scope, name), (seqs, starts, stops) in walk.strings.items():
+                if not self.wanted(scope, name):
+                    continue
+                values = np.empty(len(starts), dtype=object)
+                # Strings of a length at a time, each distinct one decoded once
+                for length, members in _by_value(stops - starts):
+                    if not length:
+                        values[members] = ""
+                        continue
+                    raw = u8[starts[members, None] + np.arange(length)].view("S{}".format(length)).ravel()
+                    uniques, inverse = np.unique(raw, return_inverse=True)
+                    texts = [_r.decode("utf-8", errors="replace") for _r in uniques.tolist()]
+                    values[members] = _object_array(texts)[inverse.ravel()]
+                chunks.setdefault((scope, name), []).append((np.asarray(seqs, dtype=np.int64) + base, values))
+        finally:
+            del u8
+
+
+def _rows(u8, starts, count, dtype):
+    """The ``count`` ``dtype`` items at each of ``starts``, a row per start."""
+    index = starts[:, None] + np.arange(count * dtype.itemsize if count else 0, dtype=np.int64)
+    return u8[index].view(dtype).reshape(len(starts), count)
+
+
+def _by_value(values):
+    """``(value, positions)`` of every distinct one of ``values``."""
+    uniques, inverse = np.unique(values, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind="stable")
+    bounds = np.searchsorted(inverse.ravel()[order], np.arange(len(uniques) + 1))
+    for position, value in enumerate(uniques.tolist()):
+        yield value, order[bounds[position]:bounds[position + 1]]
+
+
+def _normalized(values):
+    """Integer columns come out as babeltrace's Python ints would: int64,
+    or uint64 when a value does not fit."""
+    if values.dtype.kind == "u" and values.dtype.itemsize == 8:
+        if len(values) and values.max() > _INT64_MAX:
+            return values.astype(np.uint64)
+        return values.astype(np.int64)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64)
+    if values.dtype.kind == "f":
+        return values.astype(np.float64)
+    return values
+
+
+def _object_array(items):
+    out = np.empty(len(items), dtype=object)
+    for index, item in enumerate(items):
+        out[index] = item
+    return out
+
+
+def _concat_values(chunks):
+    same_dtype = len({_v.dtype for _v in chunks}) == 1
+    if all(_v.ndim == 2 for _v in chunks) and len({_v.shape[1] for _v in chunks}) == 1 and same_dtype:
+        return np.concatenate(chunks)
+    if any(_v.ndim == 2 for _v in chunks) or not same_dtype:
+        as_object = [_object_array(_v.tolist()) if _v.ndim == 2 else _v.astype(object) for _v in chunks]
+        return np.concatenate(as_object)
+    return np.concatenate(chunks)
+
+
+def find_trace_dirs(trace_path):
+    """Every directory under ``trace_path`` holding a CTF metadata file."""
+    found = []
+    for root, _, files in os.walk(trace_path):
+        if METADATA_FILE_NAME in files:
+            found.append(root)
+    return sorted(found)
+
+
+class _StreamResult:
+    """Everything decoded from one stream file, with events numbered from 0."""
+
+    def __init__(self, decoder, buf, packets=None):
+        self.chunks = {}
+        walk = decoder.walk(buf, packets)
+        decoder.gather(buf, walk, 0, self.chunks)
+        self.len = len(walk.classes)
+        # Names are dictionary-encoded: a code per event, a name per event
+        # class, the classes in the order they first occur
+        class_indices, first, codes = np.unique(walk.classes, return_index=True, return_inverse=True)
+        by_first = np.argsort(first, kind="stable")
+        event_classes = [decoder.class_list[_i] for _i in class_indices[by_first].tolist()]
+        self.name_codes = np.argsort(by_first)[codes.ravel()].astype(np.int64)
+        self.name_categories = [_c.name for _c in event_classes]
+        self.field_orders = {}
+        for event_class in event_classes:
+            for name, index in event_class.order.items():
+                self.field_orders.setdefault(name, index)
+        self.cycles = walk.cycles
+        self.timestamps = decoder.metadata.cycles_to_ns(self.cycles)
+        # The packet contexts, which become columns of every event of the packet
+        self.packets = {}
+        self.packet_of_event = walk.packet_of_event.astype(np.int32)
+        if self.len and "stream_packet_context" in decoder.scopes:
+            for key, values in walk.packets.items():
+                if decoder.wanted("stream_packet_context", key):
+                    self.packets[key] = _normalized(values)
+        self._add_packet_chunks()
+
+    def _add_packet_chunks(self):
+        seqs = np.arange(self.len, dtype=np.int64)
+        for key, values in self.packets.items():
+            self.chunks[("stream_packet_context", key)] = [(seqs, values[self.packet_of_event])]
+
+    def __getstate__(self):
+        # Results of worker processes are pickled back: the packet context
+        # columns go as they are in the packets, not repeated for every event
+        state = dict(self.__dict__)
+        state["chunks"] = {_k: _c for _k, _c in self.chunks.items() if _k[0] != "stream_packet_context"}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._add_packet_chunks()
+
+    @classmethod
+    def from_path(cls, decoder, path, packets=None):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return cls(decoder, buf, packets)
+
+
+def _hashable_scopes(scopes):
+    return tuple((_s, None if _f is None else tuple(_f)) for _s, _f in scopes.items())
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_decoder(trace_dir, scopes, name_prefixes):
+    return _TraceDecoder(trace_dir, dict(scopes), name_prefixes)
+
+
+def _decode_stream(trace_dir, path, scopes, name_prefixes, packets):
+    """Pool entry point: decode one stream file in a worker process.  The
+    metadata is compiled once per worker and trace."""
+    return _StreamResult.from_path(_cached_decoder(trace_dir, scopes, name_prefixes), path, packets)
+
+
+class NativeCtfTraceIterator(TraceIterator):
+    """Decodes LTTng-UST traces with NumPy, without the babeltrace bindings.
+
+    The frames are the ones ``CtfTraceIterator`` produces; events with equal
+    timestamps on different streams are ordered by stream path.
+
+    With ``workers`` > 1 every stream file (per-CPU/per-UID buffer) is decoded
+    in its own worker process, which sends back the columns as NumPy arrays
+    (the packet contexts once per packet, strings as shared objects).  The
+    per-stream results are concatenated and put in timestamp order by one
+    vectorized sort instead of an event-by-event merge; pairing needs that
+    order anyway since a thread's events spread over the streams of every CPU
+    it ran on.
+    """
+
+    FALLBACK_DECODER = "bt1"
+    STREAMS = True
+    INGESTS = True
+    SEEKS = True
+    # Packet bytes walked at once per event of a batch; events take 30 to 100
+    # bytes in LTTng-UST traces.  A walk costs a step per event of its longest
+    # packet however many packets it has, so a group is never below
+    # MIN_WALK_BYTES
+    WALK_BYTES_PER_EVENT = 64
+    MIN_WALK_BYTES = 1 << 20
+
+    def __init__(
+        self, trace_dirs, scopes=None, name_prefixes=None, workers=1, window=None, sample=None, seed=0, tails=None,
+        marks=None, since=None,
+    ):
+        """With a ``sample`` fraction, only that share of the packets of each
+        stream is decoded, picked at random (``seed``), see ``_seek``.  With
+        ``marks``, ``{stream path: offset}`` of the last packet already read
+        of each stream, only the packets past them and the events from
+        ``since`` (ns) on are decoded."""
+        super().__init__(scopes=scopes, name_prefixes=name_prefixes, window=window)
+        self._trace_dirs = trace_dirs
+        self._decoders = [_TraceDecoder(_d, self._scopes, self._name_prefixes) for _d in trace_dirs]
+        self._workers = workers
+        self._sample = sample
+        self._seed = seed
+        self._tails = tails
+        self._marks = marks
+        self._since = since
+        if sample is not None:
+            tails_key = None if tails is None else tuple(int(_t) for _t in tails)
+            self._selection = (self._window, sample, seed, tails_key)
+        if marks is not None:
+            self._selection = (self._selection, tuple(sorted(marks.items())), since)
+        self._segments = self._entry_segments = None
+        self._coverage = 1.0
+        self._high_water = None
+        self._begin = self._horizon = None
+        self._seek_streams = None if self._window is None and sample is None and marks is None else self._seek()
+
+    @classmethod
+    def options_from_config(cls, config):
+        return dict(workers=int(config["profiler"].get("decode_workers", 1)))
+
+    @classmethod
+    def from_path(
+        cls, trace_path, scopes=None, name_prefixes=None, workers=1, window=None, sample=None, seed=0, marks=None,
+        since=None,
+    ):
+        assert cls.is_valid_ctf_path(trace_path)
+        trace_dirs = find_trace_dirs(trace_path)
+        options = dict(scopes=scopes, name_prefixes=name_prefixes, window=window)
+        try:
+            it = cls(trace_dirs, workers=workers, sample=sample, seed=seed, marks=marks, since=since, **options)
+            return it._with_source(trace_path)
+        except UnsupportedTrace as err:
+            if cls.FALLBACK_DECODER is None or sample is not None or marks is not None:
+                raise
+            LOG.info("Native CTF reader can't decode %s (%s); falling back", trace_path, err)
+            fallback_cls = decoder_cls(cls.FALLBACK_DECODER)
+            return fallback_cls.from_path(trace_path, **options)
+
+    @property
+    def segments(self):
+        return self._segments
+
+    @property
+    def entry_segments(self):
+        return self._entry_segments
+
+    @property
+    def coverage(self):
+        return self._coverage
+
+    @property
+    def marks(self):
+        """``{stream path: offset}`` of the last packet of each stream that ends
+        before ``horizon``, to pick up from once the trace has grown; None
+        unless decoding from ``marks``."""
+        return self._high_water
+
+    @property
+    def horizon(self):
+        """The end (ns) of the stream that ends first.  The streams are written
+        independently, so only the events before it are sure to be followed by
+        no older ones once the trace grows; None unless decoding from
+        ``marks``."""
+        return self._horizon
+
+    @property
+    def begin(self):
+        """The timestamp (ns) of the first packet of the trace, or None unless
+        the packet index was read."""
+        return self._begin
+
+    def extended(self, segments):
+        """A sample like this one, with the entry segments ``segments`` decoded
+        further on, or None when they already reach the end of the window."""
+        lows, highs = self._entry_segments
+        tails = np.zeros(len(lows), dtype=np.int64) if self._tails is None else self._tails.copy()
+        ends = highs[segments] + tails[segments]
+        if (ends >= self._end).all():
+            return None
+        tails[segments] = np.maximum(2 * tails[segments], highs[segments] - lows[segments])
+        it = type(self)(
+            self._trace_dirs, scopes=self._scopes, name_prefixes=self._name_prefixes, workers=self._workers,
+            window=self._window, sample=self._sample, seed=self._seed, tails=tails,
+        )
+        return it._with_source(self._source_path)
+
+    def _seek(self):
+        """The streams restricted to the packets of the segments, found in the
+        packet index.
+
+        The segments are the window or, when sampling, the time spans of the
+        packets picked in each stream (within the window), merged where they
+        overlap.  Every packet of any stream overlapping a segment is decoded
+        so that a segment holds all the events in its time span.  When
+        sampling, these are the entry segments; each is decoded on for its
+        ``tails`` so that the calls entered in it can exit, see
+        ``TraceParser.from_lttng_trace``.
+
+        With ``marks``, the packets up to the mark of their stream are left
+        out, and so is a last packet that isn't wholly written yet; the
+        segment starts at ``since``.
+        """
+        from .packet_index import stream_packets_df  # builds on this module
+
+        tables = []
+        for decoder in self._decoders:
+            for path in decoder.stream_files():
+                with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    df = stream_packets_df(decoder, path, buf)
+                    tables.append((decoder, path, df[(df["offset"] + df["packet_size"] // 8 <= len(buf)).values]))
+        tables = [_t for _t in tables if len(_t[2])]
+        begin = self._begin = min((int(_df["timestamp_begin"].min()) for _, _, _df in tables), default=0)
+        end = max((int(_df["timestamp_end"].max()) + 1 for _, _, _df in tables), default=0)
+        low, high = window_bounds(self._window or (None, None), begin)
+        low, high = self._start, self._end = max(low, begin, self._since or begin), min(high, end)
+        lows, highs = np.array([low], dtype=np.int64), np.array([high], dtype=np.int64)
+        if self._sample is not None:
+            rng = np.random.RandomState(self._seed)
+            spans = []
+            for _, _, df in tables:
+                # A packet spans up to the next one of its stream, so that
+                # picking every packet leaves no gaps
+                begins, ends = df["timestamp_begin"].values, df["timestamp_end"].values + 1
+                packet_lows = begins.clip(min=low)
+                packet_highs = np.maximum(ends, np.r_[begins[1:], 0]).clip(max=high)
+                inside = np.flatnonzero(packet_lows < packet_highs)
+                count = int(np.ceil(self._sample * len(inside)))
+                picked = rng.choice(inside, size=count, replace=False)
+                spans.extend(zip(packet_lows[picked], packet_highs[picked]))
+            lows, highs = self._entry_segments = self._merged_spans(sorted(spans))
+            self._coverage = (highs - lows).sum() / max(high - low, 1)
+            if self._tails is not None:
+                lows, highs = self._merged_spans(sorted(zip(lows, (highs + self._tails).clip(max=high))))
+        self._segments = (lows, highs)
+
+        streams = []
+        if self._marks is not None:
+            self._high_water = dict(self._marks)
+            self._horizon = min((int(_df["timestamp_end"].max()) + 1 for _, _, _df in tables), default=begin)
+        for decoder, path, df in tables:
+            packet_lows, packet_highs = df["timestamp_begin"].values, df["timestamp_end"].values + 1
+            # A packet overlaps the last segment starting before its end
+            segment = np.searchsorted(lows, packet_highs, side="left") - 1
+            overlaps = (segment >= 0) & (packet_lows < highs[segment.clip(min=0)])
+            if self._marks is not None:
+                offsets, mark = df["offset"].values, self._marks.get(path, -1)
+                overlaps &= offsets > mark
+                read = offsets[(offsets > mark) & (packet_highs <= self._horizon)]
+                self._high_water[path] = int(read.max()) if len(read) else mark
+            if overlaps.any():
+                streams.append((decoder, path, df["offset"].values[overlaps].tolist()))
+        return streams
+
+    @staticmethod
+    def _merged_spans(spans):
+        lows, highs = [], []
+        for span_low, span_high in spans:
+            if highs and span_low <= highs[-1]:
+                highs[-1] = max(highs[-1], span_high)
+            else:
+                lows.append(span_low)
+                highs.append(span_high)
+        return np.array(lows, dtype=np.int64), np.array(highs, dtype=np.int64)
+
+    def _schema(self):
+        schema = {}
+        for decoder in self._decoders:
+            for scope, name in decoder.field_names():
+                schema.setdefault(scope, {})[name] = None
+        return {_s: list(_n) for _s, _n in schema.items()}
+
+    def _in_segments(self, timestamps):
+        if self._segments is None:
+            return np.ones(len(timestamps), dtype=bool)
+        return segment_of(self._segments, timestamps) >= 0
+
+    def _streams(self):
+        if self._seek_streams is not None:
+            yield from self._seek_streams
+            return
+        for decoder in self._decoders:
+            for path in decoder.stream_files():
+                yield decoder, path, None
+
+    def _stream_results(self):
+        streams = list(self._streams())
+        if self._workers <= 1 or len(streams) <= 1:
+            return [_StreamResult.from_path(_d, _p, _k) for _d, _p, _k in streams]
+        scopes = _hashable_scopes(self._scopes)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self._workers) as pool:
+            futures = [
+                pool.submit(_decode_stream, _d.trace_dir, _p, scopes, self._name_prefixes, _k)
+                for _d, _p, _k in streams
+            ]
+            return [_f.result() for _f in futures]
+
+    def _decode(self):
+        results = self._stream_results()
+        timestamps = np.concatenate([_r.timestamps for _r in results]) if results else np.zeros(0, np.int64)
+        take = np.argsort(timestamps, kind="stable")
+        take = take[self._in_segments(timestamps[take])]
+        self._len = len(take)
+        return self._merged_frames(results, take)
+
+    def _merged_frames(self, results, take):
+        """Frames of the events ``take`` (positions in the concatenation of
+        ``results``, in output order); the other events are left out."""
+        chunks, field_orders = {}, {}
+        base = 0
+        for result in results:
+            for key, stream_chunks in result.chunks.items():
+                chunks.setdefault(key, []).extend((_s + base, _v) for _s, _v in stream_chunks)
+            for name, index in result.field_orders.items():
+                field_orders.setdefault(name, index)
+            base += result.len
+        length = len(take)
+        rank = np.full(base, -1, dtype=np.int64)
+        rank[take] = np.arange(length)
+
+        columns = {}
+        for (scope, name), scope_chunks in chunks.items():
+            rows = rank[np.concatenate([_s for _s, _ in scope_chunks])]
+            values = _concat_values([_v for _, _v in scope_chunks])
+            kept = rows >= 0
+            if not kept.any():
+                continue
+            rows, values = rows[kept], values[kept]
+            row_order = np.argsort(rows, kind="stable")
+            columns.setdefault(scope, {})[name] = (rows[row_order], values[row_order])
+
+        frames = {}
+        for scope in self._scopes:
+            if scope == "events":
+                continue
+            scope_columns = columns.get(scope, {})
+            ordered = sorted(scope_columns, key=lambda _n: (scope_columns[_n][0][0], field_orders.get(_n, 0)))
+            buffer_cls = payload.PayloadBuffer if scope == "event_fields" else ColumnBuffer
+            frames[scope] = buffer_cls.from_columns(length, {_n: scope_columns[_n] for _n in ordered}).to_df()
+        if "events" in self._scopes:
+            categories = pd.Index(sorted({_n for _r in results for _n in _r.name_categories}))
+            if results:
+                codes = [categories.get_indexer(_r.name_categories)[_r.name_codes] for _r in results]
+                names = pd.Categorical.from_codes(np.concatenate(codes)[take], categories)
+                cycles = np.concatenate([_r.cycles for _r in results])[take]
+                timestamps = np.concatenate([_r.timestamps for _r in results])[take]
+            else:
+                names = pd.Categorical.from_codes(np.zeros(0, np.int64), categories)
+                cycles, timestamps = np.zeros(0, np.uint64), np.zeros(0, np.int64)
+            event_cols = dict(name=names, cycles=_normalized(cycles), timestamp=timestamps)
+            wanted = self._scopes["events"] or list(event_cols)
+            all_rows = np.arange(length)
+            frames["events"] = ColumnBuffer.from_columns(
+                length, {_k: (all_rows, event_cols[_k]) for _k in wanted}
+            ).to_df()
+        return frames
+
+    def _packet_queue(self, bufs):
+        """``(begin_ns, stream_index, offset, size)`` of every packet, ``size``
+        the bytes of its content, in the order the packets have to be decoded
+        for a time-ordered merge, or None when a stream lacks packet begin
+        timestamps."""
+        queue = []
+        for index, (decoder, path, packets) in enumerate(self._streams()):
+            buf = bufs[index]
+            offsets = packets if packets is not None else decoder._packet_offsets(buf, len(buf))
+            offsets = np.fromiter(offsets, dtype=np.int64)
+            if not len(offsets):
+                continue
+            u8 = np.frombuffer(buf, dtype=np.uint8)
+            try:
+                _, contexts, _ = decoder.packets_at(u8, offsets)
+            finally:
+                del u8
+            if "timestamp_begin" not in contexts:
+                return None
+            begins = decoder.metadata.cycles_to_ns(contexts["timestamp_begin"].astype(np.uint64))
+            sizes = (contexts["content_size"] // 8).astype(np.int64)
+            queue.extend(zip(begins.tolist(), [index] * len(offsets), offsets.tolist(), sizes.tolist()))
+        return sorted(queue)
+
+    @classmethod
+    def _packet_groups(cls, queue, batch_size):
+        """``(packets, horizon)``: the packets of ``queue`` walked at once, as
+        ``{stream_index: offsets}``, about ``WALK_BYTES_PER_EVENT`` bytes per
+        event of a batch of them (``MIN_WALK_BYTES`` and a packet at least),
+        and the begin timestamp of the next packet (None after the last
+        group)."""
+        budget = max(batch_size * cls.WALK_BYTES_PER_EVENT, cls.MIN_WALK_BYTES)
+        position = 0
+        while position < len(queue):
+            stop, size = position + 1, queue[position][3]
+            while stop < len(queue) and size + queue[stop][3] <= budget:
+                size += queue[stop][3]
+                stop += 1
+            packets = {}
+            for _, index, offset, _ in queue[position:stop]:
+                packets.setdefault(index, []).append(offset)
+            yield packets, queue[stop][0] if stop < len(queue) else None
+            position = stop
+
+    def _batches(self, batch_size):
+        """Merges the streams a group of packets at a time.  No event that is
+        still to be decoded can be older than the begin timestamp of the next
+        packet in the queue, so everything pending before that horizon is
+        final and is handed out in batches.  The packets of a group are walked
+        side by side, a walk per stream, and a group holds about as many
+        events as a batch, so memory stays bounded by a few batches."""
+        streams = list(self._streams())
+        with contextlib.ExitStack() as stack:
+            bufs = []
+            for _, path, _ in streams:
+                f = stack.enter_context(open(path, "rb"))
+                bufs.append(stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)))
+            queue = self._packet_queue(bufs)
+            if queue is None:
+                yield from super()._batches(batch_size)
+                return
+            pending, start = [], 0
+            for packets, horizon in self._packet_groups(queue, batch_size):
+                for index, offsets in sorted(packets.items()):
+                    result = _StreamResult(streams[index][0], bufs[index], offsets)
+                    result.done = ~self._in_segments(result.timestamps)
+                    result.stream = index
+                    pending.append(result)
+                while True:
+                    take = self._ready(pending, horizon, batch_size)
+                    if take is None:
+                        break
+                    frames = self._merged_frames(pending, take)
+                    yield self._offset(frames, start)
+                    start += len(take)
+                    pending = self._retire(pending, take)
+            self._len = start
+
+    @staticmethod
+    def _ready(pending, horizon, batch_size):
+        """The next batch out of ``pending``, or None if there isn't a full one
+        before ``horizon`` (None: the end of the trace)."""
+        if not pending:
+            return None
+        timestamps = np.concatenate([_r.timestamps for _r in pending])
+        done = np.concatenate([_r.done for _r in pending])
+        # Equal timestamps in stream order, as in a whole decode
+        streams = np.concatenate([np.full(_r.len, _r.stream) for _r in pending])
+        order = np.lexsort((streams, timestamps))
+        order = order[~done[order]]
+        if horizon is not None:
+            order = order[timestamps[order] < horizon]
+            if len(order) < batch_size:
+                return None
+        elif not len(order):
+            return None
+        return order[:batch_size]
+
+    @staticmethod
+    def _retire(pending, take):
+        base = 0
+        for result in pending:
+            mine = take[(take >= base) & (take < base + result.len)]
+            result.done[mine - base] = True
+            base += result.len
+        return [_r for _r in pending if not _r.done.all()]
+
+    @staticmethod
+    def _offset(frames, start):
+        for df in frames.values():
+            df.index = pd.RangeIndex(start, start + len(df))
+        return frames
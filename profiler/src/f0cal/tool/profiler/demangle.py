@@ -0,0 +1,99 @@
+"""A persistent demangling cache shared by every trace and session.
+
+The same OpenCV symbols show up in every run, so demangled names are kept in
+a SQLite table under the profiler dir, keyed by mangled name.  Each lookup
+refreshes the entries it hits and the least recently used ones are dropped
+beyond ``max_entries``.  Misses are demangled in one batch, streamed through
+a single ``c++filt`` child process, or with ``cxxfilt`` when there is no
+``c++filt`` on the host.
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import time
+
+import cxxfilt
+
+
+def demangle_batch(names):
+    """Demangled ``names``, in order; names that aren't mangled come back as is."""
+    if not names:
+        return []
+    cxxfilt_exe = shutil.which("c++filt")
+    if cxxfilt_exe is not None:
+        out = subprocess.run(
+            [cxxfilt_exe], input="\n".join(names) + "\n", stdout=subprocess.PIPE, universal_newlines=True, check=True
+        ).stdout.splitlines()
+        if len(out) == len(names):
+            return out
+    return [_demangle(_n) for _n in names]
+
+
+def _demangle(name):
+    try:
+        return cxxfilt.demangle(name)
+    except cxxfilt.InvalidName:
+        return name
+
+
+class DemangleCache:
+    FILE_NAME = "demangle.sqlite"
+    MAX_ENTRIES = 100000
+    # SQLite caps the number of host parameters in a statement
+    _CHUNK = 500
+
+    def __init__(self, path=":memory:", max_entries=MAX_ENTRIES):
+        self._db = sqlite3.connect(path, timeout=30)
+        self._max_entries = max_entries
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS demangled "
+                "(mangled TEXT PRIMARY KEY, demangled TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS demangled_used ON demangled (used)")
+
+    @classmethod
+    def from_config(cls, config):
+        profiler_dir = config["profiler"].get("profiler_dir")
+        max_entries = int(config["profiler"].get("demangle_cache_size", cls.MAX_ENTRIES))
+        if profiler_dir is None:
+            return cls(max_entries=max_entries)
+        os.makedirs(profiler_dir, exist_ok=True)
+        return cls(os.path.join(profiler_dir, cls.FILE_NAME), max_entries)
+
+    def demangle(self, names):
+        """``{mangled: demangled}`` for every name in ``names``."""
+        names = list(dict.fromkeys(names))
+        found = {}
+        for start in range(0, len(names), self._CHUNK):
+            chunk = names[start:start + self._CHUNK]
+            query = "SELECT mangled, demangled FROM demangled WHERE mangled IN ({})".format(",".join("?" * len(chunk)))
+            found.update(self._db.execute(query, chunk))
+        misses = [_n for _n in names if _n not in found]
+        found.update(zip(misses, demangle_batch(misses)))
+
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO demangled (mangled, demangled, used) VALUES (?, ?, ?)",
+                ((_n, found[_n], now) for _n in names),
+            )
+            self._db.execute(
+                "DELETE FROM demangled WHERE mangled IN "
+                "(SELECT mangled FROM demangled ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            )
+        return found
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM demangled").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
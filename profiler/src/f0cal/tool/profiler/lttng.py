@@ -14,6 +14,7 @@ import f0cal
 
 from .manager import ProfileManager, MultiprocRunner
 from .ld_debug import LDDebugSession
+from . import columnar
 
 
 class EVENT_PARANIOD_FLAG_ERROR(Exception):
@@ -75,6 +76,12 @@ def config_file():
     [profiler]
     profiler_dir=${f0cal:prefix}/home/f0cal
     manifest_glob=${f0cal:prefix}/etc/f0cal/*.json
+    decoder=bt1
+    decode_workers=1
+    parse_workers=1
+    demangle_cache_size=100000
+    stage_cache_budget=2G
+    convert_on_add=no
     
     [f0cal]
     browser=firefox
@@ -233,3 +240,14 @@ def _pr_add_entrypoint(parser, core, executable, name, ldd, **_):
                 file=session._EVENT_PARANOID_FILE))
             exit(1)
         runner.run(_exe, env=_env)
+
+    # Decode the trace once now rather than on every `pr view`; that takes
+    # about as long as a view, so only when asked for (`pr convert` later on)
+    if columnar.AVAILABLE and core.config['profiler'].getboolean('convert_on_add', False):
+        from .reportage import convert_trace
+        try:
+            convert_trace(mgr, mgr.session_id, core.config)
+        except Exception as e:
+            # The trace is kept all the same, `pr view` then decodes it
+            LOG.warning("Couldn't convert trace %s: %s", mgr.session_id, e)
+            LOG.debug("Conversion failure", exc_info=True)
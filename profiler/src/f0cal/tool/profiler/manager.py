@@ -7,6 +7,8 @@ import multiprocessing as mp
 import uuid
 import pandas as pd
 
+from .manifest_index import ManifestIndex
+
 
 class MultiprocRunner:
     _ACK = 0
@@ -64,19 +66,11 @@ class MultiprocRunner:
         return cls()
 
 class Manifest:
-    @property
-    def _manifest_iter(self):
-        _field = self._BLOB_FIELD
-        manifest_list = glob.glob(self._manifest_glob)
-        for manifest_file in manifest_list:
-            blob = json.load(open(manifest_file))
-            for a_dict in blob[_field]:
-                yield a_dict
-
     @property
     def manifest_df(self):
-        _len = len(list(self._manifest_iter))
-        _df = pd.DataFrame.from_records(self._manifest_iter, nrows=_len)
+        profiler_dir = getattr(self, "_profiler_dir", None)
+        index_path = None if profiler_dir is None else os.path.join(profiler_dir, ManifestIndex.FILE_NAME)
+        _df = ManifestIndex.from_glob(self._manifest_glob, index_path).callables_df
         return _df[["hash", "return_type", "prefix", "suffix"]].drop_duplicates()
 
 
@@ -185,11 +179,11 @@ class ProfileManager:
         new_class = type("ManagedSession", (ManagerMixin, self.SESSION_CLS), {})
         return new_class.from_config(config, self.session_id)
 
-    def create_hdf_path(self, trace_id):
+    def create_dataset_path(self, trace_id):
         metadata = self.trace_metadata
         assert trace_id in metadata
-        output_file = os.path.join(self._profiler_dir, '{}.hdf5'.format(trace_id))
+        output_path = os.path.join(self._profiler_dir, 'datasets', trace_id)
 
-        metadata[trace_id]['hdf_path'] = output_file
+        metadata[trace_id]['dataset_path'] = output_path
         self.save_metadata(metadata)
-        return output_file
+        return output_path
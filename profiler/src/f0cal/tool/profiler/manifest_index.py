@@ -0,0 +1,124 @@
+"""A compiled, columnar index of the shim manifests.
+
+Every installed f0cal library package ships a JSON manifest describing its
+shims.  Reading all of them is slow with many packages installed, so they are
+compiled into two tables, persisted under the profiler dir:
+
+* ``callables_df``: one row per shim (``hash``, ``prefix``, ``suffix``,
+  ``mangled_name``, ``return_type``, ...);
+* ``args_df``: one row per shim argument (``hash``, ``arg_num``,
+  ``arg_type``, ...).
+
+The index remembers the size and mtime of each manifest; when those change it
+compares content digests before recompiling, so a touched but unchanged
+manifest only refreshes the stamps.  The ``fingerprint`` of an index digests
+the manifests it was compiled from, for caches of what was derived from it.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+
+class ManifestIndex:
+    FILE_NAME = "manifest_index.pkl"
+    BLOB_FIELD = "shims"
+    ARGS_FIELD = "arg_list"
+    VERSION = 1
+
+    _CALLABLE_COLUMNS = ["hash", "prefix", "suffix", "mangled_name", "return_type"]
+    _ARG_COLUMNS = ["hash", "arg_num", "arg_type"]
+
+    def __init__(self, callables_df, args_df, digests=()):
+        self.callables_df = callables_df
+        self.args_df = args_df
+        self._digests = sorted(digests)
+
+    @property
+    def fingerprint(self):
+        return self._digest("\n".join(self._digests).encode())
+
+    @classmethod
+    def from_config(cls, config):
+        profiler_dir = config["profiler"].get("profiler_dir")
+        index_path = None if profiler_dir is None else os.path.join(profiler_dir, cls.FILE_NAME)
+        return cls.from_glob(config["profiler"]["manifest_glob"], index_path)
+
+    @classmethod
+    def from_glob(cls, manifest_glob, index_path=None):
+        """The index of the manifests matching ``manifest_glob``, loaded from
+        ``index_path`` when it is still current and (re)written otherwise."""
+        paths = sorted(glob.glob(manifest_glob))
+        stamps = {_p: cls._stamp(_p) for _p in paths}
+        saved = cls._load(index_path) if index_path is not None else None
+        if saved is not None and saved["glob"] == manifest_glob and sorted(saved["digests"]) == paths:
+            if saved["stamps"] == stamps:
+                return cls(saved["callables"], saved["args"], saved["digests"].values())
+            if saved["digests"] == {_p: cls._digest(open(_p, "rb").read()) for _p in paths}:
+                saved["stamps"] = stamps
+                cls._save(index_path, saved)
+                return cls(saved["callables"], saved["args"], saved["digests"].values())
+
+        blobs, digests = [], {}
+        for path in paths:
+            data = open(path, "rb").read()
+            digests[path] = cls._digest(data)
+            blobs.append(json.loads(data.decode()))
+        index = cls.from_blobs(blobs)
+        index._digests = sorted(digests.values())
+        if index_path is not None:
+            state = dict(glob=manifest_glob, stamps=stamps, digests=digests)
+            state.update(callables=index.callables_df, args=index.args_df)
+            cls._save(index_path, state)
+        return index
+
+    @classmethod
+    def from_blobs(cls, blobs):
+        callables, args = [], []
+        for blob in blobs:
+            for shim in blob[cls.BLOB_FIELD]:
+                callables.append({_k: _v for _k, _v in shim.items() if _k != cls.ARGS_FIELD})
+                args.extend(dict(arg, hash=shim["hash"]) for arg in shim.get(cls.ARGS_FIELD, []))
+        callables_df = pd.DataFrame.from_records(callables, columns=cls._columns(callables, cls._CALLABLE_COLUMNS))
+        args_df = pd.DataFrame.from_records(args, columns=cls._columns(args, cls._ARG_COLUMNS))
+        digests = [cls._digest(json.dumps(_b, sort_keys=True).encode()) for _b in blobs]
+        return cls(callables_df, args_df, digests)
+
+    @staticmethod
+    def _columns(records, leading):
+        extra = sorted({_k for _r in records for _k in _r} - set(leading))
+        return leading + extra
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.sha1(data).hexdigest()
+
+    @classmethod
+    def _load(cls, index_path):
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, "rb") as f:
+            try:
+                saved = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                return None
+        return saved if saved.get("version") == cls.VERSION else None
+
+    @classmethod
+    def _save(cls, index_path, state):
+        # Written aside and renamed, so concurrent readers never see a partial index
+        directory = os.path.dirname(index_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".manifest_index-")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(dict(state, version=cls.VERSION), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
@@ -0,0 +1,157 @@
+"""Trace size and duration from packet headers alone.
+
+Every CTF packet starts with a context holding its ``content_size``,
+``timestamp_begin``/``timestamp_end``, the running count of
+``events_discarded`` of its stream and its ``cpu_id``.  LTTng also writes
+these, big-endian, to an ``index/<stream>.idx`` file per stream; those are
+read when present, the packet headers otherwise.  Nothing else is decoded
+but the first packet with events of each stream, whose bytes per event turn
+content sizes into event count estimates.
+"""
+import logging
+import mmap
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from .ctf_native import UnsupportedTrace, _TraceDecoder, find_trace_dirs
+
+INDEX_DIR_NAME = "index"
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = 0xC1F1DCC1
+_INDEX_HEADER = np.dtype([("magic", ">u4"), ("major", ">u4"), ("minor", ">u4"), ("entry_size", ">u4")])
+_INDEX_FIELDS = ["offset", "packet_size", "content_size", "timestamp_begin", "timestamp_end", "events_discarded"]
+# LTTng names per-CPU stream files <channel>_<cpu>
+_CPU_REGEX = re.compile(r"_(\d+)$")
+
+SUMMARY_COLUMNS = ["events", "duration", "discarded", "size", "cpu_size"]
+PACKET_COLUMNS = [
+    "stream", "cpu_id", "offset", "content_size", "timestamp_begin", "timestamp_end", "events_discarded", "events"
+]
+
+LOG = logging.getLogger(__name__)
+
+
+def read_index(path):
+    """The ``_INDEX_FIELDS`` of every packet listed in an LTTng index file, or
+    None when ``path`` isn't one."""
+    data = np.fromfile(path, dtype=np.uint8)
+    if len(data) < _INDEX_HEADER.itemsize:
+        return None
+    header = data[: _INDEX_HEADER.itemsize].view(_INDEX_HEADER)[0]
+    entry_size = int(header["entry_size"])
+    if header["magic"] != INDEX_MAGIC or entry_size < 8 * len(_INDEX_FIELDS) or entry_size % 8:
+        return None
+    body = data[_INDEX_HEADER.itemsize:]
+    entries = body[: len(body) - len(body) % entry_size].view(">u8").reshape(-1, entry_size // 8)
+    return pd.DataFrame(entries[:, : len(_INDEX_FIELDS)].astype(np.int64), columns=_INDEX_FIELDS)
+
+
+def stream_packets_df(decoder, path, buf):
+    """The packets of the stream file ``path``, mapped at ``buf``: their
+    ``offset``, ``content_size`` (bytes), ``timestamp_begin``/``timestamp_end``
+    (ns), ``events_discarded`` and ``cpu_id``."""
+    name = os.path.basename(path)
+    index_path = os.path.join(os.path.dirname(path), INDEX_DIR_NAME, name + INDEX_SUFFIX)
+    df = read_index(index_path) if os.path.exists(index_path) else None
+    if df is None:
+        df = pd.DataFrame.from_records(_packet_headers(decoder, buf), columns=_INDEX_FIELDS + ["cpu_id"])
+    else:
+        match = _CPU_REGEX.search(name)
+        df["cpu_id"] = int(match.group(1)) if match else -1
+    df["content_size"] //= 8
+    for column in ("timestamp_begin", "timestamp_end"):
+        df[column] = decoder.metadata.cycles_to_ns(df[column].values.astype(np.uint64))
+    return df
+
+
+def _packet_headers(decoder, buf):
+    for offset in decoder._packet_offsets(buf, len(buf)):
+        _, context, _ = decoder.packet_at(buf, offset)
+        if "timestamp_begin" not in context:
+            raise UnsupportedTrace("Packets without timestamps in {}".format(decoder.trace_dir))
+        yield [offset] + [context.get(_f, 0) for _f in _INDEX_FIELDS[1:]] + [context.get("cpu_id", -1)]
+
+
+class PacketIndex:
+    """The packets of every stream of a trace, as ``packets_df``: a row per
+    packet with ``PACKET_COLUMNS``, sizes in bytes and timestamps in ns."""
+
+    def __init__(self, packets_df):
+        self.packets_df = packets_df
+
+    @classmethod
+    def from_trace(cls, trace_path):
+        frames = []
+        for trace_dir in find_trace_dirs(trace_path):
+            decoder = _TraceDecoder(trace_dir, {"events": None}, None)
+            for path in decoder.stream_files():
+                frames.append(cls._stream_df(decoder, path, trace_path))
+        if not frames:
+            return cls(pd.DataFrame(columns=PACKET_COLUMNS))
+        return cls(pd.concat(frames, ignore_index=True))
+
+    @classmethod
+    def _stream_df(cls, decoder, path, trace_path):
+        error = None
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            try:
+                df = stream_packets_df(decoder, path, buf)
+                df["events"] = cls._events(decoder, buf, df)
+            except (IndexError, ValueError) as e:
+                # Raised once unmapped: the frames of its traceback hold views
+                # of ``buf``, which can't be closed while they are alive
+                error = "{}: {}".format(path, e)
+        if error is not None:
+            raise ValueError(error)
+        df["stream"] = os.path.relpath(path, trace_path)
+        return df[PACKET_COLUMNS]
+
+    @staticmethod
+    def _events(decoder, buf, df):
+        """Event counts estimated from the bytes per event of the first packet
+        of the stream that has events."""
+        if not len(df):
+            return np.zeros(0)
+        _, _, pos = decoder.packet_at(buf, int(df["offset"].iloc[0]))
+        header_size = pos - int(df["offset"].iloc[0])
+        payload = (df["content_size"].values - header_size).clip(min=0)
+        for row in np.flatnonzero(payload):
+            count = len(decoder.walk(buf, packets=[int(df["offset"].iloc[row])]).cycles)
+            if count:
+                return payload * (count / payload[row])
+        return np.zeros(len(df))
+
+    @property
+    def summary(self):
+        """``{column: value}`` describing the whole trace, for ``pr list``."""
+        df = self.packets_df
+        if not len(df):
+            return dict(events=0, duration=pd.Timedelta(0), discarded=0, size=0, cpu_size={})
+        # events_discarded is a running count per stream
+        discarded = df.groupby("stream")["events_discarded"].max().sum()
+        cpu_size = df.groupby("cpu_id")["content_size"].sum()
+        return dict(
+            events=int(round(df["events"].sum())),
+            duration=pd.Timedelta(int(df["timestamp_end"].max() - df["timestamp_begin"].min()), unit="ns"),
+            discarded=int(discarded),
+            size=int(df["content_size"].sum()),
+            cpu_size={int(_c): int(_s) for _c, _s in cpu_size.items()},
+        )
+
+
+def trace_summary(trace_path):
+    """``PacketIndex.summary`` of the trace at ``trace_path``, or None when it
+    is gone or can't be read."""
+    if not isinstance(trace_path, str) or not os.path.isdir(trace_path):
+        return None
+    try:
+        return PacketIndex.from_trace(trace_path).summary
+    except UnsupportedTrace:
+        return None
+    except (IndexError, ValueError) as e:
+        # A truncated or corrupt index or stream file
+        LOG.warning("Can't summarize %s: %s", trace_path, e)
+        return None
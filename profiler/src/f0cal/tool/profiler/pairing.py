@@ -0,0 +1,138 @@
+"""Vectorized matching of call entries to call exits.
+
+Within a thread calls nest, so a call's entry and exit sit at the same
+nesting level: the level of an entry is the stack depth right after it is
+pushed, the level of an exit the depth right before it pops.  Both come from
+a per-thread cumulative sum of +1 (entry) / -1 (exit).  Sorting the events by
+(thread, level) and keeping time order otherwise puts every entry right in
+front of its exit, so pairs are found by comparing neighbours.  Recursion
+needs no special care, and an exit whose entry is not in the trace (tracing
+started mid-call) leaves the depth at 0 and ends up without a partner.
+"""
+import concurrent.futures
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def pair_calls(threads, is_entry, hashes=None):
+    """Pairs up the entries and exits of a time-ordered event sequence.
+
+    ``threads`` holds one integer per event identifying its thread and
+    ``is_entry`` tells entries from exits.  When ``hashes`` is given, paired
+    events must be calls of the same function.
+
+    Returns ``(entry, exit, depth, open)``: the positions of each paired
+    entry and exit, ordered by exit, the nesting depth of the call (0 for
+    an outermost call) and the positions of the entries still open at the
+    end, in time order.
+    """
+    threads = np.asarray(threads)
+    is_entry = np.asarray(is_entry, dtype=bool)
+    length = len(is_entry)
+    if not length:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    by_thread = np.argsort(threads, kind="stable")
+    thread = threads[by_thread]
+    entry_flags = is_entry[by_thread]
+    step = np.where(entry_flags, 1, -1)
+    depth = np.cumsum(step)
+    starts = np.flatnonzero(np.r_[True, thread[1:] != thread[:-1]])
+    sizes = np.diff(np.r_[starts, length])
+    depth -= np.repeat(depth[starts] - step[starts], sizes)
+    # An exit on an empty stack does not pop: clamp the depth at 0 with the
+    # thread's running minimum.  Each thread is lifted above all the threads
+    # after it so the running minimum can't leak from one into the next.
+    lift = np.repeat(np.arange(len(starts), 0, -1, dtype=np.int64) * (length + 1), sizes)
+    depth -= np.minimum.accumulate(np.minimum(depth, 0) + lift) - lift
+    before = np.r_[0, depth[:-1]]
+    before[starts] = 0
+    level = np.where(entry_flags, depth, before)
+
+    by_level = np.lexsort((level, thread))
+    positions = by_thread[by_level]
+    flags = entry_flags[by_level]
+    thread, level = thread[by_level], level[by_level]
+    paired = np.flatnonzero(
+        flags[:-1] & ~flags[1:] & (thread[:-1] == thread[1:]) & (level[:-1] == level[1:])
+    )
+    entries, exits, depths = positions[paired], positions[paired + 1], level[paired] - 1
+    if hashes is not None:
+        hashes = np.asarray(hashes)
+        assert (hashes[entries] == hashes[exits]).all(), "Mismatched entry/exit"
+
+    by_exit = np.argsort(exits, kind="stable")
+    matched = np.zeros(length, dtype=bool)
+    matched[entries] = True
+    still_open = np.flatnonzero(is_entry & ~matched)
+    return entries[by_exit], exits[by_exit], depths[by_exit], still_open
+
+
+def call_dts(threads, is_entry, hashes, clock, workers=1):
+    """``pair_calls`` plus each call's ``clock`` delta, as ``(entry, exit,
+    depth, dt)`` ordered by exit.
+
+    With ``workers`` > 1 the threads are spread over a process pool.  The
+    columns are written once as ``.npy`` files that every worker maps read
+    only, and each shard is a set of runs of the thread-sorted columns;
+    results come back the same way."""
+    threads = np.asarray(threads)
+    clock = np.asarray(clock)
+    thread_ids, sizes = np.unique(threads, return_counts=True)
+    if workers <= 1 or len(thread_ids) <= 1:
+        entry, exit, depth, _ = pair_calls(threads, is_entry, hashes)
+        return entry, exit, depth, clock[exit] - clock[entry]
+
+    with tempfile.TemporaryDirectory(prefix="f0cal-shards-") as directory:
+        by_thread = np.argsort(threads, kind="stable")
+        columns = dict(
+            position=by_thread,
+            thread=threads[by_thread],
+            is_entry=np.asarray(is_entry, dtype=bool)[by_thread],
+            hash=pd.factorize(np.asarray(hashes))[0][by_thread],
+            clock=clock[by_thread],
+        )
+        for name, values in columns.items():
+            np.save(os.path.join(directory, name + ".npy"), values)
+        shards = _shards(sizes, workers)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_pair_shard, directory, _n, _r) for _n, _r in enumerate(shards)]
+            outputs = [_f.result() for _f in futures]
+        results = [[np.load(_p) for _p in _o] for _o in outputs]
+    entry, exit, depth, dt = (np.concatenate(_c) for _c in zip(*results))
+    by_exit = np.argsort(exit, kind="stable")
+    return entry[by_exit], exit[by_exit], depth[by_exit], dt[by_exit]
+
+
+def _shards(sizes, count):
+    """Runs ``[(start, stop), ...]`` of the thread-sorted columns per shard,
+    biggest threads first onto the least loaded shard."""
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    loads = np.zeros(count, dtype=np.int64)
+    shards = [[] for _ in range(count)]
+    for thread in np.argsort(-sizes, kind="stable"):
+        shard = int(np.argmin(loads))
+        loads[shard] += sizes[thread]
+        shards[shard].append((int(starts[thread]), int(starts[thread] + sizes[thread])))
+    return [sorted(_s) for _s in shards if _s]
+
+
+def _pair_shard(directory, number, runs):
+    """Pool entry point: pairs the threads of one shard."""
+    columns = {}
+    for name in ("position", "thread", "is_entry", "hash", "clock"):
+        mapped = np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+        columns[name] = np.concatenate([mapped[_a:_b] for _a, _b in runs])
+    entry, exit, depth, _ = pair_calls(columns["thread"], columns["is_entry"], columns["hash"])
+    clock, position = columns["clock"], columns["position"]
+    outputs = dict(entry=position[entry], exit=position[exit], depth=depth, dt=clock[exit] - clock[entry])
+    paths = []
+    for name, values in outputs.items():
+        path = os.path.join(directory, "shard-{}-{}.npy".format(number, name))
+        np.save(path, values)
+        paths.append(path)
+    return paths
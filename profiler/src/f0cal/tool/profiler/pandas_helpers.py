@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import wrapt
 
@@ -13,3 +14,75 @@ def required_columns(cols):
         return ret_df
     return verify_columns
 
+
+def broadcast_categorical(per_category, codes):
+    """A categorical over rows from values computed once per category:
+    ``per_category[i]`` is the value of the rows with code ``i``."""
+    values = pd.Categorical(np.asarray(per_category, dtype=object))
+    return pd.Categorical.from_codes(values.codes[codes], values.categories)
+
+
+def positions(index, labels):
+    """Positions of ``labels`` in the sorted ``index`` (e.g. event ids in a
+    ``RangeIndex``), for gathering with ``take`` instead of joining."""
+    return np.searchsorted(index.values, labels)
+
+
+def take(values, indices):
+    """``values[indices]``, missing where an index is -1.  Keeps categoricals."""
+    if isinstance(values, pd.Series):
+        values = values.values
+    if isinstance(values, pd.api.extensions.ExtensionArray):
+        return values.take(indices, allow_fill=True)
+    return pd.api.extensions.take(np.asarray(values), indices, allow_fill=True)
+
+
+class ColumnBuffer:
+    """Row-aligned columnar accumulator.
+
+    Rows may carry different keys (event payloads differ per event type), so
+    each column remembers the rows it was set on and is scattered into a
+    full-length column when the frame is built.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, row):
+        index = self._len
+        for key, value in row.items():
+            column = self._columns.get(key)
+            if column is None:
+                column = self._columns[key] = ([], [])
+            column[0].append(index)
+            column[1].append(value)
+        self._len += 1
+
+    @classmethod
+    def from_columns(cls, length, columns):
+        """Build a buffer from whole columns, ``{key: (rows, values)}`` with
+        ``rows`` ascending, for decoders that decode a column at a time."""
+        buf = cls()
+        buf._len = length
+        for key, (rows, values) in columns.items():
+            buf.set_column(key, rows, values)
+        return buf
+
+    def set_column(self, key, rows, values):
+        self._columns[key] = (rows, values)
+
+    def _full_column(self, rows, values):
+        index = pd.RangeIndex(self._len)
+        if getattr(values, "ndim", 1) > 1:
+            values = values.tolist()
+        if len(rows) == self._len:
+            return pd.Series(values, index=index)
+        return pd.Series(values, index=rows).reindex(index)
+
+    def to_df(self):
+        data = {_k: self._full_column(*_c) for _k, _c in self._columns.items()}
+        return pd.DataFrame(data, index=pd.RangeIndex(self._len))
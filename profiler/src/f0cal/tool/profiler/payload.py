@@ -0,0 +1,213 @@
+"""Typed decoding of the event payloads written by the f0cal shims.
+
+Shim events carry their arguments as ``vN_shape`` (a list of dimensions),
+``vN_ptr`` (the address of the argument) and ``mangled_name_field``.  Those are
+decoded straight into typed columns instead of generic Python objects:
+
+* ``vN_shape`` becomes one int64 column per dimension, ``vN_shape_0``,
+  ``vN_shape_1``, ..., with ``MISSING_DIM`` where the event has no such arg;
+* ``vN_ptr`` becomes a uint64 column with ``NULL_PTR`` where it is absent;
+* ``vN_type``, the ``cv::Mat::type()`` of the argument when the shim
+  records it, becomes an int64 column with ``UNKNOWN`` where it is absent;
+* ``mangled_name_field`` becomes a categorical.
+
+Any other field is kept as a plain column, as ``ColumnBuffer`` would.
+
+``args_df`` then melts all the argument slots of a decoded frame into one
+row per (event, arg).
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from .pandas_helpers import ColumnBuffer
+
+MISSING_DIM = -1
+NULL_PTR = 0
+UNKNOWN = -1
+MANGLED_NAME_FIELD = "mangled_name_field"
+
+_SHAPE_REGEX = re.compile(r"^v(?P<arg_num>\d+)_shape$")
+_SHAPE_DIM_REGEX = re.compile(r"^v(?P<arg_num>\d+)_shape_(?P<dim>\d+)$")
+_PTR_REGEX = re.compile(r"^v(?P<arg_num>\d+)_ptr$")
+_TYPE_REGEX = re.compile(r"^v(?P<arg_num>\d+)_type$")
+
+# OpenCV type codes: the depth is in the low 3 bits, channels - 1 above them
+_CV_DEPTH_BITS = 3
+_CV_ELEM_SIZES = np.array([1, 1, 2, 2, 4, 4, 8, 2], dtype=np.int64)
+
+_SHAPE, _PTR, _TYPE, _NAME, _OTHER = range(5)
+
+
+def _field_kind(key):
+    if _SHAPE_REGEX.match(key):
+        return _SHAPE
+    if _PTR_REGEX.match(key):
+        return _PTR
+    if _TYPE_REGEX.match(key):
+        return _TYPE
+    if key == MANGLED_NAME_FIELD:
+        return _NAME
+    return _OTHER
+
+
+class PayloadBuffer(ColumnBuffer):
+    """A ``ColumnBuffer`` that knows the shim payload conventions."""
+
+    def __init__(self):
+        super().__init__()
+        self._kinds = {}
+
+    def append(self, row):
+        # The kind of each field is resolved once per field name, not per row.
+        for key in row:
+            if key not in self._kinds:
+                self._kinds[key] = _field_kind(key)
+        super().append(row)
+
+    def set_column(self, key, rows, values):
+        self._kinds[key] = _field_kind(key)
+        super().set_column(key, rows, values)
+
+    def _shape_columns(self, key, rows, values):
+        if getattr(values, "ndim", 1) == 2:
+            ndim = values.shape[1]
+        else:
+            ndim = max((len(_v) for _v in values), default=0)
+        dims = np.full((self._len, ndim), MISSING_DIM, dtype=np.int64)
+        if getattr(values, "ndim", 1) == 2:
+            dims[rows] = values
+        elif all(len(_v) == ndim for _v in values):
+            # A list per row, e.g. an object array of them
+            dims[rows] = np.asarray(list(values), dtype=np.int64).reshape(len(rows), ndim)
+        else:
+            for row, value in zip(rows, values):
+                dims[row, : len(value)] = value
+        return {"{key}_{dim}".format(key=key, dim=_d): dims[:, _d] for _d in range(ndim)}
+
+    def _ptr_column(self, rows, values):
+        ptrs = np.full(self._len, NULL_PTR, dtype=np.uint64)
+        ptrs[rows] = np.asarray(values, dtype=np.uint64)
+        return ptrs
+
+    def _type_column(self, rows, values):
+        types = np.full(self._len, UNKNOWN, dtype=np.int64)
+        types[rows] = np.asarray(values, dtype=np.int64)
+        return types
+
+    def _name_column(self, rows, values):
+        return self._full_column(rows, values).astype("category")
+
+    def to_df(self):
+        data = {}
+        for key, (rows, values) in self._columns.items():
+            kind = self._kinds[key]
+            if kind == _SHAPE:
+                data.update(self._shape_columns(key, rows, values))
+            elif kind == _PTR:
+                data[key] = self._ptr_column(rows, values)
+            elif kind == _TYPE:
+                data[key] = self._type_column(rows, values)
+            elif kind == _NAME:
+                data[key] = self._name_column(rows, values)
+            else:
+                data[key] = self._full_column(rows, values)
+        return pd.DataFrame(data, index=pd.RangeIndex(self._len))
+
+
+def field_columns(names):
+    """The columns a decoded frame has for the payload fields ``names``, as
+    far as they are known without the data: a shape gets a column per dim
+    of the longest one, of which the two that ``args_df`` always has, width
+    and height, are taken to be there."""
+    columns = []
+    for name in names:
+        if _field_kind(name) == _SHAPE:
+            columns.extend("{key}_{dim}".format(key=name, dim=_d) for _d in range(2))
+        else:
+            columns.append(name)
+    return columns
+
+
+def absent_column(column, length):
+    """``length`` values of the decoded payload ``column`` for events without
+    the field, as a frame with the column fills them in."""
+    if _SHAPE_DIM_REGEX.match(column):
+        return np.full(length, MISSING_DIM, dtype=np.int64)
+    kind = _field_kind(column)
+    if kind == _PTR:
+        return np.full(length, NULL_PTR, dtype=np.uint64)
+    if kind == _TYPE:
+        return np.full(length, UNKNOWN, dtype=np.int64)
+    if kind == _NAME:
+        return pd.Categorical.from_codes(np.full(length, -1), categories=[])
+    return np.full(length, np.nan)
+
+
+def shape_columns(columns):
+    """``{arg_num: [dim_0_column, dim_1_column, ...]}`` of a decoded payload frame."""
+    dims = {}
+    for column in columns:
+        match = _SHAPE_DIM_REGEX.match(column)
+        if match is None:
+            continue
+        arg_dims = dims.setdefault(int(match.group("arg_num")), {})
+        arg_dims[int(match.group("dim"))] = column
+    return {_a: [_d[_i] for _i in sorted(_d)] for _a, _d in dims.items()}
+
+
+def ptr_columns(columns):
+    """``{arg_num: ptr_column}`` of a decoded payload frame."""
+    matches = ((_PTR_REGEX.match(_c), _c) for _c in columns)
+    return {int(_m.group("arg_num")): _c for _m, _c in matches if _m is not None}
+
+
+def type_columns(columns):
+    """``{arg_num: type_column}`` of a decoded payload frame."""
+    matches = ((_TYPE_REGEX.match(_c), _c) for _c in columns)
+    return {int(_m.group("arg_num")): _c for _m, _c in matches if _m is not None}
+
+
+def args_df(df):
+    """One row per (event, arg) that has a shape or a pointer.
+
+    The slots of all args are laid out as an ``(events, args, dims)`` block
+    and flattened at once.  ``width``/``height`` are dims 0 and 1, further
+    dims are ``dim_2``, ... (all ``MISSING_DIM`` where the arg has fewer),
+    ``numel`` is the product of the dims.  ``channels``, ``elem_size`` and
+    ``nbytes`` come from ``vN_type`` and are ``UNKNOWN`` without it.
+    """
+    shapes, ptrs, types = shape_columns(df.columns), ptr_columns(df.columns), type_columns(df.columns)
+    arg_nums = np.array(sorted(set(shapes) | set(ptrs)), dtype=np.int64)
+    n_events, n_args = len(df), len(arg_nums)
+    n_dims = max([2] + [len(shapes.get(_a, [])) for _a in arg_nums])
+
+    dims = np.full((n_events, n_args, n_dims), MISSING_DIM, dtype=np.int64)
+    ptr = np.full((n_events, n_args), NULL_PTR, dtype=np.uint64)
+    cv_type = np.full((n_events, n_args), UNKNOWN, dtype=np.int64)
+    for slot, arg_num in enumerate(arg_nums):
+        for dim, column in enumerate(shapes.get(arg_num, [])):
+            dims[:, slot, dim] = df[column].values
+        if arg_num in ptrs:
+            ptr[:, slot] = df[ptrs[arg_num]].values
+        if arg_num in types:
+            cv_type[:, slot] = df[types[arg_num]].values
+    dims = dims.reshape(n_events * n_args, n_dims)
+    ptr, cv_type = ptr.reshape(-1), cv_type.reshape(-1)
+
+    rows = np.flatnonzero((dims[:, 0] != MISSING_DIM) | (ptr != NULL_PTR))
+    dims, ptr, cv_type = dims[rows], ptr[rows], cv_type[rows]
+    present = dims != MISSING_DIM
+    ndim = present.sum(axis=1)
+    numel = np.where(present, dims, 1).prod(axis=1) * (ndim > 0)
+    known = cv_type != UNKNOWN
+    channels = np.where(known, (cv_type >> _CV_DEPTH_BITS) + 1, UNKNOWN)
+    elem_size = np.where(known, _CV_ELEM_SIZES[cv_type & ((1 << _CV_DEPTH_BITS) - 1)], UNKNOWN)
+    nbytes = np.where(known, numel * channels * elem_size, UNKNOWN)
+
+    columns = dict(event_id=df.index.values[rows // max(n_args, 1)], arg_num=arg_nums[rows % max(n_args, 1)])
+    columns.update(width=dims[:, 0], height=dims[:, 1])
+    columns.update(("dim_{}".format(_d), dims[:, _d]) for _d in range(2, n_dims))
+    columns.update(ndim=ndim, numel=numel, ptr=ptr, channels=channels, elem_size=elem_size, nbytes=nbytes)
+    return pd.DataFrame(columns)
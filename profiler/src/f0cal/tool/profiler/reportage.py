@@ -1,24 +1,37 @@
 import re
+import copy
+import logging
+import numpy as np
 import pandas as pd
-import babeltrace as bt
 import os
 import wrapt
-import cxxfilt
 import time
-import json
 import glob
 import tabulate
 import tempfile
 
 import f0cal
 
+from .ctf_native import UnsupportedTrace
+from .demangle import DemangleCache
 from .manager import ProfileManager
-from .pandas_helpers import required_columns
+from .manifest_index import ManifestIndex
+from .packet_index import SUMMARY_COLUMNS, trace_summary
+from .pandas_helpers import broadcast_categorical, positions, required_columns, take
+from .stage_cache import StageCache, code_version, file_stamps, stage_key
+from .trace_iterator import (
+    DEFAULT_DECODER, FrameIterator, decoder_cls, decoder_from_config, parse_duration, parse_fraction, segment_of,
+    trace_fingerprint,
+)
+from .streaming import IngestState, PairCarry, RunningStats, SpaceSaving, parse_size
+from . import aggregate, call_tree, columnar, pairing, payload
 from .ld_debug import LDDebugOutputParser
 
 HERE = os.path.dirname(__file__)
 TABLE_TEMPLATE = "table_template.html"
 BLOB_FIELD = "${BLOB}"
+LOG = logging.getLogger(__name__)
+
 
 @wrapt.decorator
 def timing(fn, instance, args, dargs):
@@ -29,350 +42,709 @@ def timing(fn, instance, args, dargs):
     return result
 
 
-class CtfTraceIterator:
-    _SCOPES = dict(event_fields=bt.CTFScope.EVENT_FIELDS,
-                   event_context=bt.CTFScope.EVENT_CONTEXT,
-                   stream_event_context=bt.CTFScope.STREAM_EVENT_CONTEXT,
-                   stream_event_header=bt.CTFScope.STREAM_EVENT_HEADER,
-                   stream_packet_context=bt.CTFScope.STREAM_PACKET_CONTEXT,
-                   trace_packet_header=bt.CTFScope.TRACE_PACKET_HEADER)
-
-    def __init__(self, collection):
-        self._trace_collection = collection
-        self._len = None
+# ``{stage name: (upstream stage names, parameter attribute names)}``
+STAGES = {}
 
-    @property
-    def events_iter(self):
-        return self._trace_collection.events
 
-    @classmethod
-    def from_path(cls, trace_path):
-        assert cls.is_valid_ctf_path(trace_path)
-        trace_collection = bt.TraceCollection()
-        trace_collection.add_traces_recursive(trace_path, "ctf")
-        return cls(trace_collection)
-
-    @classmethod
-    def is_valid_ctf_path(cls, trace_path):
-        assert os.path.exists(trace_path), trace_path
-        assert os.path.isdir(trace_path), trace_path
-        return True
-
-    @property
-    @required_columns(["name", "cycles", "timestamp"])
-    def events_df(self):
-        _e_dict = lambda e: dict(name=e.name, cycles=e.cycles, timestamp=e.timestamp)
-        return pd.DataFrame.from_records(_e_dict(e) for e in self.events_iter)
-
-    @property
-    @required_columns(["payload"])
-    def event_fields_json_df(self):
-        it = self._value_iter("event_fields")
-        return pd.DataFrame.from_records(dict(payload=json.dumps(k)) for k in it)
-
-    @property
-    @required_columns(['perf_thread_cpu_clock', 'perf_thread_cycles', 'pthread_id', 'vpid'])
-    def stream_event_context_df(self):
-        return self._df("stream_event_context")
-
-    @property
-    @required_columns(['content_size', 'cpu_id', 'events_discarded', 'packet_seq_num',
-       'packet_size', 'timestamp_begin', 'timestamp_end'])
-    def stream_packet_context_df(self):
-        return self._df("stream_packet_context")
-
-    def _df(self, scope):
-        return pd.DataFrame.from_records(self._value_iter(scope))
-
-    def _value_iter(self, scope):
-        scope_enum = self._SCOPES[scope]
-        for event in self.events_iter:
-            fields = event.field_list_with_scope(scope_enum)
-            yield {k: event.field_with_scope(k, scope_enum) for k in fields}
-
-    def __len__(self):
-        if self._len is not None:
-            return self._len
-        count = 0
-        for event in self.events_iter:
-            count += 1
-        self._len = count
-        return self._len
+def stage(*deps, params=()):
+    """Declares a ``TraceParser`` stage computed from the stages named in
+    ``deps`` and from the parser attributes named in ``params``, and caches
+    it under ``TraceParser._stage_key``."""
+    def decorator(fn):
+        STAGES[fn.__name__] = (deps, params)
+        return _cached_stage(fn)
+    return decorator
 
 
 @wrapt.decorator
-def cached(fn, instance, args, dargs):
+def _cached_stage(fn, instance, args, dargs):
     self = args[0]
     fn_name = fn.__name__
-    if fn_name in self._cache:
-        return self._cache[fn_name]
-    result = fn(*args, **dargs)
-    self._cache[fn_name] = result
+    if fn_name in self._memo:
+        return self._memo[fn_name]
+    key = self._stage_key(fn_name)
+    if key is None:
+        result = fn(*args, **dargs)
+    else:
+        try:
+            result = self._cache[key]
+        except KeyError:
+            result = fn(*args, **dargs)
+            self._cache[key] = result
+    self._memo[fn_name] = result
     return result
 
+
 class TraceParser:
     _CACHE_FACTORY = dict
+    # The code the stages are computed by; editing it invalidates cached stages
+    _CODE_MODULES = (
+        __name__, pairing.__name__, payload.__name__, required_columns.__module__, FrameIterator.__module__,
+        call_tree.__name__,
+    )
+    _DEMANGLER_FACTORY = DemangleCache.from_config
     _F0CAL_REGEX = re.compile(
         "^(?P<provider>\w*):(?P<pkg>\w*)_(?P<io>[io])(?P<hash>\w*)$"
     )
-    _BLOB_FIELD='shims'
+    # What the parser reads from a trace; everything else is skipped at decode time.
+    _EVENT_PREFIXES = ("f0cal",)
+    # How many times a sample is decoded further on for its calls to exit
+    MAX_SAMPLE_EXTENSIONS = 8
+    _PROJECTION = dict(
+        events=["name", "cycles", "timestamp"],
+        event_fields=None,
+        stream_event_context=["perf_thread_cpu_clock", "perf_thread_cycles", "pthread_id", "vpid"],
+    )
 
-    def __init__(self, trace_iter, config,  cache=None):
+    def __init__(
+        self, trace_iter, config,  cache=None, shaped_only=False, manifest=None, workers=None, stat_keys=None
+    ):
+        """With ``shaped_only`` set, args without a positive width are dropped
+        while the arg tables are built rather than after ``big_table_df``.
+        ``workers`` (default ``[profiler] parse_workers``) > 1 pairs the calls
+        of different threads in a process pool.  ``stat_keys`` (default
+        ``DEFAULT_KEYS``) are what ``stats_df`` groups the calls by."""
         self._trace_iter = trace_iter
+        self._config = config
         self._cache = self._CACHE_FACTORY() if cache is None else cache
+        self._shaped_only = shaped_only
+        self._stat_keys = list(DEFAULT_KEYS if stat_keys is None else stat_keys)
+        self._workers = int(config['profiler'].get('parse_workers', 1)) if workers is None else workers
+        self._manifest = ManifestIndex.from_config(config) if manifest is None else manifest
+        self._memo = {}
+        self._keys = {}
+        fingerprint = trace_iter.fingerprint
+        if fingerprint is None:
+            self._source_key = None
+        else:
+            code = code_version(*self._CODE_MODULES, type(trace_iter).__module__)
+            self._source_key = stage_key(fingerprint, self._manifest.fingerprint, code)
+
+    def _stage_key(self, name):
+        """The cache key of stage ``name``: a digest of the trace, the manifests,
+        the parser code, the stage's parameters and its upstream stages' keys.
+        None for frames that don't come from a trace, which are only memoized."""
+        if self._source_key is None:
+            return None
+        if name not in self._keys:
+            deps, params = STAGES[name]
+            parts = [repr(getattr(self, _p)) for _p in params] + [self._stage_key(_d) for _d in deps]
+            self._keys[name] = stage_key(name, self._source_key, *parts)
+        return self._keys[name]
 
-        manifest_glob = config['profiler']['manifest_glob']
-        self.shims_dicts = []
-        for file in glob.glob(manifest_glob):
-            blob = json.load(open(file))
-            self.shims_dicts.extend(blob[self._BLOB_FIELD])
+    @classmethod
+    def from_iter(cls, some_iter, config, **dargs):
+        return cls(some_iter, config, **dargs)
 
     @classmethod
-    def from_iter(cls, some_iter, config):
-        return cls(some_iter, config)
+    def from_lttng_trace(
+        cls, trace_path, config, trace_format="ctf", iterator_cls=None, dataset_path=None, window=None, sample=None,
+        **dargs
+    ):
+        it = cls.open_trace(
+            trace_path, config, iterator_cls=iterator_cls, dataset_path=dataset_path, window=window, sample=sample
+        )
+        tp = cls.from_iter(it, config, **dargs)
+        # Calls entered in a sampled span are decoded on until they exit, so
+        # that long calls aren't dropped from the sample more than short ones
+        for _ in range(cls.MAX_SAMPLE_EXTENSIONS if sample is not None else 0):
+            segments = tp._open_entry_segments()
+            it = tp._trace_iter.extended(segments) if len(segments) else None
+            if it is None:
+                break
+            tp = cls.from_iter(it, config, **dargs)
+        return tp
 
     @classmethod
-    def from_lttng_trace(cls, trace_path, config, trace_format="ctf"):
-        it = CtfTraceIterator.from_path(trace_path)
-        return cls.from_iter(it, config)
+    def open_trace(
+        cls, trace_path, config, iterator_cls=None, dataset_path=None, window=None, sample=None, marks=None,
+        since=None,
+    ):
+        """The configured decoder, reading just what the parser needs, or the
+        trace's ``pr convert`` dataset at ``dataset_path`` when it is current.
+        ``window`` is a ``(start, stop)`` pair of ns since the start of the
+        trace (either may be None); only the events in between are read.
+        With a ``sample`` fraction, only that share of the packets is decoded,
+        and with ``marks`` only the packets past them and the events from
+        ``since`` on (see ``IngestState``); both take the native reader, as
+        does a window when the configured decoder would walk the whole trace
+        for it (see ``TraceIterator.SEEKS``)."""
+        if window is None and sample is None and marks is None:
+            it = columnar.open_dataset(dataset_path, trace_path, cls._PROJECTION, cls._EVENT_PREFIXES)
+            if it is not None:
+                return it
+        options = dict(window=window)
+        for name, value in dict(sample=sample, marks=marks, since=since).items():
+            if value is not None:
+                iterator_cls = decoder_cls("native")
+                options[name] = value
+        if iterator_cls is None:
+            iterator_cls = decoder_from_config(config)
+            if window is not None and not iterator_cls.SEEKS:
+                iterator_cls = decoder_cls("native")
+        options.update(iterator_cls.options_from_config(config))
+        return iterator_cls.from_path(
+            trace_path, scopes=cls._PROJECTION, name_prefixes=cls._EVENT_PREFIXES, **options
+        )
 
     @property
     @required_columns(['cycles', 'name', 'timestamp'])
-    @cached
+    @stage()
     def raw_events_df(self):
         return self._trace_iter.events_df
 
     @property
     @required_columns(['name'])
-    @cached
+    @stage("raw_events_df")
     def f0cal_events_df(self):
-        return self.raw_events_df.query(
-            "name.str.startswith('f0cal')", engine="python"
-        )[["name"]]
+        df = self.raw_events_df
+        names = df["name"].astype("category")
+        is_f0cal = np.array([_n.startswith(self._EVENT_PREFIXES) for _n in names.cat.categories], dtype=bool)
+        return df[is_f0cal[names.cat.codes.values]][["name"]]
 
     @property
     @required_columns(['provider',  'pkg', 'io',  'hash'])
-    @cached
+    @stage("f0cal_events_df")
     def parsed_f0cal_events_df(self):
-        return self.f0cal_events_df["name"].str.extract(self._F0CAL_REGEX)
+        # The regex runs once per distinct name and is broadcast through the codes
+        names = self.f0cal_events_df["name"].astype("category")
+        parsed = pd.Series(list(names.cat.categories), dtype=object).str.extract(self._F0CAL_REGEX)
+        codes = names.cat.codes.values
+        columns = {_c: broadcast_categorical(parsed[_c], codes) for _c in ["provider", "pkg", "io", "hash"]}
+        return pd.DataFrame(columns, index=names.index)
 
     @property
-    @cached
+    @stage()
     def payload_df(self):
-        def _make_series(_a_dict):
-            _a_dict = json.loads(_a_dict)
-            return pd.Series(_a_dict)
-        events = self._trace_iter.event_fields_json_df
-        return events.payload.apply(_make_series)
+        return self._trace_iter.event_fields_df
 
     @property
     @required_columns(['provider', 'pkg', 'io',  'hash',  'pid', 'thid'])
-    @cached
+    @stage("parsed_f0cal_events_df")
     def threaded_f0cal_events_df(self):
         _df = self._trace_iter.stream_event_context_df
-        _pid = _df["vpid"].astype(int)
-        _thid = _df["pthread_id"].astype(int)
-        return self.parsed_f0cal_events_df.assign(pid=_pid, thid=_thid)
+        fe_df = self.parsed_f0cal_events_df
+        rows = positions(_df.index, fe_df.index.values)
+        _pid = np.take(_df["vpid"].values, rows).astype(int)
+        _thid = np.take(_df["pthread_id"].values, rows).astype(int)
+        return fe_df.assign(pid=_pid, thid=_thid)
+
+    @property
+    @required_columns(['entry', 'exit', 'depth', 'dt'])
+    @stage("threaded_f0cal_events_df")
+    def calls_df(self):
+        stored_df = self._trace_iter.calls_df
+        if stored_df is not None:
+            return stored_df
+        df = self.threaded_f0cal_events_df
+        keys = ["pid", "thid"]
+        segments = self._trace_iter.segments
+        if segments is not None:
+            # Calls are paired within a decoded segment, never across a gap
+            df = df.assign(segment=np.searchsorted(segments[0], self._timestamps(df), side="right"))
+            keys.append("segment")
+        threads = df.groupby(keys, sort=False).ngroup().values
+        is_entry = (df["io"] == "i").values
+        _df = self._trace_iter.stream_event_context_df
+        clock = np.take(_df["perf_thread_cpu_clock"].values, positions(_df.index, df.index.values))
+        hashes = df["hash"].cat.codes.values
+        entry, exit, depth, dt = pairing.call_dts(threads, is_entry, hashes, clock, self._workers)
+        event_ids = df.index.values
+        entry_segments = self._trace_iter.entry_segments
+        if entry_segments is not None:
+            # A sample counts the calls entered in the sampled spans only
+            sampled = segment_of(entry_segments, np.take(self._timestamps(df), entry)) >= 0
+            entry, exit, depth, dt = entry[sampled], exit[sampled], depth[sampled], dt[sampled]
+        return pd.DataFrame(dict(entry=event_ids[entry], exit=event_ids[exit], depth=depth, dt=dt))
+
+    def _timestamps(self, df):
+        """The timestamps of the events of ``df``, by event id."""
+        events_df = self.raw_events_df
+        return np.take(events_df["timestamp"].values, positions(events_df.index, df.index.values))
+
+    def _open_entry_segments(self):
+        """The entry segments of a sample in which calls were entered that
+        don't exit in what was decoded."""
+        df = self.threaded_f0cal_events_df
+        entries = df.index.values[(df["io"] == "i").values]
+        open_entries = np.setdiff1d(entries, self.calls_df["entry"].values)
+        segment = segment_of(self._trace_iter.entry_segments, self._timestamps(df.loc[open_entries]))
+        return np.unique(segment[segment >= 0])
 
     @property
-    @required_columns(['entry', 'exit'])
-    @cached
+    @required_columns(['entry', 'exit', 'depth'])
+    @stage("calls_df")
     def pairs_df(self):
-        _stacker = lambda _df: Stacker(_df).pairs_df
-        df = (
-            self.threaded_f0cal_events_df.groupby(["pid", "thid"])
-            .apply(_stacker)
-            .reset_index()
-        )
-        df = df[["entry", "exit"]]
-        return df
+        return self.calls_df[["entry", "exit", "depth"]]
 
     @property
     @required_columns(["entry", "exit", "dt"])
-    @cached
+    @stage("calls_df")
     def dt_df(self):
-        merger_df = self.pairs_df
-        payload_df = self._trace_iter.stream_event_context_df[["perf_thread_cpu_clock"]]
-        _df = pd.merge(payload_df, merger_df, left_index=True, right_on="entry")
-        _df = pd.merge(
-            payload_df, _df, left_index=True, right_on="exit", suffixes=("_o", "_i")
-        )
-        _df["dt"] = _df["perf_thread_cpu_clock_o"] - _df["perf_thread_cpu_clock_i"]
-        return _df[["entry", "exit", "dt"]]
+        return self.calls_df[["entry", "exit", "dt"]]
+
+    @property
+    @required_columns(['entry', 'exit', 'depth', 'dt', 'parent', 'exclusive', 'name'])
+    @stage("calls_df", "threaded_f0cal_events_df", "unique_callables_df")
+    def call_tree_df(self):
+        """``calls_df`` with the ``parent`` row of each call (``call_tree.ROOT``
+        for roots), its ``exclusive`` time and the ``name`` it was called by,
+        the prefix of its callable or else its hash."""
+        calls_df = self.calls_df
+        fe_df = self.threaded_f0cal_events_df
+        rows = positions(fe_df.index, calls_df["entry"].values)
+        threads = np.take(fe_df.groupby(["pid", "thid"], sort=False).ngroup().values, rows)
+        entry, exit, depth = (calls_df[_c].values for _c in ("entry", "exit", "depth"))
+        parent = call_tree.call_parents(threads, entry, exit, depth)
+        exclusive = call_tree.exclusive_times(parent, calls_df["dt"].values)
+
+        hashes = fe_df["hash"].cat.categories
+        uc_df = self.unique_callables_df
+        prefixes = pd.Series(uc_df["prefix"].astype(str).values, index=uc_df["hash"].astype(str).values)
+        names = prefixes.reindex(hashes.astype(str))
+        names = names.where(names.notnull(), hashes.astype(str))
+        name_codes, name_categories = pd.factorize(names.values)
+        codes = name_codes[np.take(fe_df["hash"].cat.codes.values, rows)]
+        name = pd.Categorical.from_codes(codes, categories=name_categories)
+        return calls_df[["entry", "exit", "depth", "dt"]].assign(parent=parent, exclusive=exclusive, name=name)
+
+    @property
+    @required_columns(call_tree.PATH_COLUMNS)
+    @stage("call_tree_df")
+    def call_paths_df(self):
+        """A row per call path: its ``parent`` path (row), ``name`` and
+        ``level``, the ``count`` of calls and their ``inclusive`` and
+        ``exclusive`` time."""
+        df = self.call_tree_df
+        path, paths_df = call_tree.call_paths(df["parent"].values, df["depth"].values, df["name"].cat.codes.values)
+        paths_df = call_tree.path_stats_df(paths_df, path, df["dt"].values, df["exclusive"].values)
+        return paths_df.assign(name=pd.Categorical.from_codes(paths_df["name"].values, df["name"].cat.categories))
+
+    @property
+    @required_columns(['event_id', 'arg_num', 'width', 'height', 'ndim', 'numel', 'ptr', 'nbytes'])
+    @stage("payload_df")
+    def args_df(self):
+        return payload.args_df(self.payload_df)
+
+    def _shaped(self, df):
+        width = df["width"].values
+        return width > 0 if self._shaped_only else width != payload.MISSING_DIM
 
     @property
     @required_columns(['event_id', 'arg_num', 'width', 'height'])
-    @cached
+    @stage("args_df", params=["_shaped_only"])
     def shape_df(self):
-        df = self.payload_df
-        _test = lambda _c: _c.startswith("v") and _c.endswith("_shape")
-        cols = [_col for _col in df.columns if _test(_col)]
-        df = df[cols]
-        all_dfs = []
-        for col in df.columns:
-            _df = df[[col]].query(f"{col}.notnull()", engine="python")
-            _df["width"] = _df[col].str.get(0)  # HACK (br) This shouldn't work
-            _df["height"] = _df[col].str.get(1)  # HACK (br)
-            _df["arg_num"] = int(col.split("_")[0][1:])
-            _df["event_id"] = _df.index
-            all_dfs.append(_df)
-        df = pd.concat(all_dfs, axis="index", ignore_index=True)
-        return df[["event_id", "arg_num", "width", "height"]]
+        df = self.args_df
+        columns = ["event_id", "arg_num", "width", "height"] + [_c for _c in df.columns if _c.startswith("dim_")]
+        return df[self._shaped(df)][columns + ["ndim", "numel"]].reset_index(drop=True)
 
     @property
     @required_columns(['event_id', 'arg_num', 'ptr'])
-    @cached
+    @stage("args_df")
     def ptr_df(self):
-        df = self.payload_df
-        _test = lambda _c: _c.startswith("v") and _c.endswith("_ptr")
-        cols = [_col for _col in df.columns if _test(_col)]
-        df = df[cols]
-        all_dfs = []
-        for col in df.columns:
-            _df = df[[col]].query(f"{col}.notnull()", engine="python")
-            _df["ptr"] = _df[col]
-            _df["arg_num"] = int(col.split("_")[0][1:])
-            _df["event_id"] = _df.index
-            all_dfs.append(_df)
-        df = pd.concat(all_dfs, axis="index", ignore_index=True)
-        return df[["event_id", "arg_num", "ptr"]]
+        df = self.args_df
+        return df[df["ptr"].values != payload.NULL_PTR][["event_id", "arg_num", "ptr"]].reset_index(drop=True)
 
     @property
-    @required_columns(['event_id', 'arg_num', 'width', 'height', 'ptr'])
-    @cached
+    @required_columns(['event_id', 'arg_num', 'width', 'height', 'ptr', 'nbytes'])
+    @stage("args_df", params=["_shaped_only"])
     def arg_fields_df(self):
-        shp_df = self.shape_df
-        ptr_df = self.ptr_df
-        return pd.merge(shp_df, ptr_df, on=["event_id", "arg_num"])
+        df = self.args_df
+        return df[self._shaped(df) & (df["ptr"].values != payload.NULL_PTR)].reset_index(drop=True)
 
     @property
     @required_columns(['mangled_name'])
-    @cached
+    @stage("payload_df")
     def event_mangled_names_df(self):
         _renames = dict(mangled_name_field="mangled_name")
         return self.payload_df[["mangled_name_field"]].rename(columns=_renames)
 
-
     @property
     @required_columns(['index', 'mangled_name', 'demangled_name'])
-    @cached
+    @stage("event_mangled_names_df")
     def mangling_lookup_df(self):
         _df = self.event_mangled_names_df.drop_duplicates().reset_index()
-        _demangle = lambda _str: cxxfilt.demangle(_str)
-        _df["demangled_name"] = _df["mangled_name"].apply(_demangle)
+        with self._DEMANGLER_FACTORY(self._config) as demangler:
+            lookup = demangler.demangle(_df["mangled_name"].dropna().astype(str).unique().tolist())
+        _df["demangled_name"] = _df["mangled_name"].astype(object).map(lookup)
         return _df
 
-
     @property
     @required_columns(['hash', 'prefix', 'mangled_name'])
-    @cached
+    @stage()
     def hash_to_callable_df(self):
-        df = pd.DataFrame.from_records(self.shims_dicts)
-        return df[['hash', 'prefix', 'mangled_name']]
-
+        df = self._manifest.callables_df[['hash', 'prefix', 'mangled_name']]
+        return df.astype(dict(prefix="category", mangled_name="category"))
 
     @property
     @required_columns(['hash', 'prefix'])
-    @cached
+    @stage("hash_to_callable_df", "parsed_f0cal_events_df")
     def unique_callables_df(self):
         df = self.hash_to_callable_df
         events_hashes = self.parsed_f0cal_events_df['hash'].unique()
-        events_hashes_df = pd.DataFrame({'hash':events_hashes})
-        df = events_hashes_df.merge(df)
-        return df
+        df = df[df['hash'].isin(events_hashes)]
+        return df.assign(hash=self._event_hashes(df['hash']))
 
     @property
     @required_columns(['hash', 'arg_num', 'arg_type'])
-    @cached
+    @stage("parsed_f0cal_events_df")
     def unique_callable_args_df(self):
-        # Todo there is a faster way to do this
-        args_dicts = []
-        for item in self.shims_dicts:
-            for arg in item['arg_list']:
-                args_dicts.append({'hash':item['hash'], **arg})
+        args_df = self._manifest.args_df[['hash', 'arg_num', 'arg_type']]
+        # Only the callables seen in the trace, coded like the events' hashes
+        args_df = args_df.assign(hash=self._event_hashes(args_df['hash']))
+        return args_df[args_df['hash'].notnull()]
 
-        args_df = pd.DataFrame.from_records(args_dicts)
-        return args_df[['hash', 'arg_num', 'arg_type']]
+    def _event_hashes(self, hashes):
+        """``hashes`` as a categorical with the categories of the events' hashes,
+        so that joins against the events keep it categorical."""
+        categories = self.parsed_f0cal_events_df['hash'].cat.categories
+        return pd.Categorical(hashes, categories=categories)
 
     @property
-    @cached
+    @stage(
+        "calls_df", "parsed_f0cal_events_df", "unique_callables_df", "unique_callable_args_df", "arg_fields_df",
+        params=["_shaped_only"],
+    )
     def big_table_df(self):
-        dt_df = self.dt_df
+        calls_df = self.calls_df
         fe_df = self.parsed_f0cal_events_df
-        fe_df["event_id"] =fe_df.index
+        df = self._call_args_df(calls_df["entry"].values)
+        calls = df.pop("call").values
+        rows = positions(fe_df.index, df["event_id"].values)
+        columns = {_c: take(fe_df[_c], rows) for _c in fe_df.columns if _c not in df}
+        columns.update((_c, np.take(calls_df[_c].values, calls)) for _c in calls_df.columns)
+        head = pd.DataFrame(columns, index=df.index)
+        return pd.concat([head, df], axis="columns")
 
-        _df1 = pd.merge(fe_df, dt_df, left_index=True, right_on="entry")
-        uc_df = self.unique_callables_df
-        ua_df = self.unique_callable_args_df
-        _df2 = pd.merge(uc_df, ua_df)
-        _df = pd.merge(_df1, _df2, right_index=True, on="hash")
-        f_df = self.arg_fields_df
-        return pd.merge(_df, f_df, on=["event_id", "arg_num"], how="left")
+    @property
+    @stage("big_table_df", params=["_stat_keys"])
+    def latency_aggregates_df(self):
+        """The ``aggregate`` table of the call latencies per ``stat_keys`` and
+        histogram bucket: what ``stats_df`` is derived from, and what is
+        merged across runs and traces by ``merged_stats_df``."""
+        return aggregate.aggregate(latency_df(self.big_table_df), self._stat_keys, "dt")
 
-class Stacker:
-    def __init__(self, df):
-        self._df = df
-        self._df["is_entry"] = df["io"] == "i"
-        self._stack = []
+    @property
+    def stats_df(self):
+        """``dt_stats_df`` of ``latency_df(big_table_df)`` per ``stat_keys``."""
+        return aggregate.metrics_df(self.latency_aggregates_df, self._stat_keys)
 
     @property
-    def pairs_df(self):
-        _worker = lambda _s: self._worker(_s["hash"], _s["is_entry"], _s.name)
-        return self._df.apply(_worker, axis="columns").query(
-            "entry.notnull()", engine="python"
+    @required_columns(['event_id', 'hash', 'prefix', 'arg_num', 'width', 'height', 'ptr'])
+    @stage(
+        "parsed_f0cal_events_df", "unique_callables_df", "unique_callable_args_df", "arg_fields_df",
+        params=["_shaped_only"],
+    )
+    def entry_args_df(self):
+        """The args of every call entry, i.e. ``big_table_df`` before pairing."""
+        fe_df = self.parsed_f0cal_events_df
+        df = self._call_args_df(fe_df.index.values[(fe_df["io"] == "i").values])
+        return df.drop(columns="call")
+
+    def _call_args_df(self, entries):
+        """A row per arg of each call entered at the event ids ``entries``,
+        with ``call`` the position of the call in ``entries``.
+
+        The callables, their args and the decoded arg fields are looked up
+        through integer arrays indexed by hash code and by event position
+        rather than joined: ``callable_of`` maps a hash code to its row in
+        ``unique_callables_df`` (one per hash), the args of a hash code are a
+        contiguous run of the code-sorted ``unique_callable_args_df``.
+        """
+        fe_df = self.parsed_f0cal_events_df
+        uc_df = self.unique_callables_df
+        ua_df = self.unique_callable_args_df
+        f_df = self.arg_fields_df
+        n_hashes = len(fe_df["hash"].cat.categories)
+
+        callable_of = np.full(n_hashes, -1, dtype=np.int64)
+        callable_of[uc_df["hash"].cat.codes.values] = np.arange(len(uc_df))
+        arg_codes = ua_df["hash"].cat.codes.values
+        arg_order = np.argsort(arg_codes, kind="stable")
+        arg_counts = np.bincount(arg_codes, minlength=n_hashes)
+        arg_starts = np.cumsum(arg_counts) - arg_counts
+
+        codes = fe_df["hash"].cat.codes.values[positions(fe_df.index, entries)]
+        calls = np.flatnonzero(callable_of[codes] >= 0)
+        codes = codes[calls]
+        counts = arg_counts[codes]
+        call = np.repeat(calls, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        arg_rows = arg_order[np.repeat(arg_starts[codes], counts) + within]
+        callable_rows = np.repeat(callable_of[codes], counts)
+        event_id = entries[call]
+        arg_num = ua_df["arg_num"].values[arg_rows].astype(np.int64)
+
+        # Arg fields are keyed by (event_id, arg_num); find them by binary search
+        span = int(max(arg_num.max(initial=0), f_df["arg_num"].max() if len(f_df) else 0)) + 1
+        keys = f_df["event_id"].values.astype(np.int64) * span + f_df["arg_num"].values
+        key_order = np.argsort(keys, kind="stable")
+        wanted = event_id * span + arg_num
+        found = np.searchsorted(keys[key_order], wanted).clip(max=max(len(keys) - 1, 0))
+        matched = (keys[key_order][found] == wanted) if len(keys) else np.zeros(len(wanted), dtype=bool)
+        field_rows = np.where(matched, key_order[found] if len(keys) else -1, -1)
+        if self._shaped_only:
+            keep = np.flatnonzero(matched)
+            call, event_id, arg_num = call[keep], event_id[keep], arg_num[keep]
+            arg_rows, callable_rows, field_rows = arg_rows[keep], callable_rows[keep], field_rows[keep]
+
+        columns = dict(call=call, event_id=event_id)
+        columns.update((_c, take(uc_df[_c], callable_rows)) for _c in uc_df.columns)
+        columns.update(arg_num=arg_num, arg_type=take(ua_df["arg_type"], arg_rows))
+        columns.update(
+            (_c, take(f_df[_c], field_rows)) for _c in f_df.columns if _c not in ("event_id", "arg_num")
         )
+        return pd.DataFrame(columns)
 
-    def _worker(self, name_hash, is_entry, index):
-        prev_index = pd.np.nan
-        if is_entry:
-            self._stack.append((name_hash, index))
-        else:
-            prev_hash, prev_index = self._stack.pop()
-            assert name_hash == prev_hash
-        return pd.Series(dict(entry=prev_index, exit=index), name=index)
 
-class HDFCache:
-    def __init__(self, store):
-        self._store = store
+class StreamingTraceParser:
+    """The ``pr view`` statistics of a trace, computed in fixed-size event batches.
 
-    def __setitem__(self, item, value):
-        assert isinstance(item, str), item
-        assert isinstance(value, pd.DataFrame), value
-        self._store[item] = value
+    Each batch goes through its own ``TraceParser``; what has to outlive a
+    batch is the calls still open (their args and entry clock) and the
+    running statistics.  ``max_memory`` (bytes) sizes the batches and bounds
+    the statistics kept in memory before they are spilled to disk.
+    """
 
-    def __getitem__(self, item):
-        assert isinstance(item, str), item
-        df = self._store[item]
-        return df
+    BYTES_PER_EVENT = 4096
+    MIN_BATCH_SIZE = 1024
+    STATS_SHARE = 4
+    # The budget of an incremental read without one
+    MAX_MEMORY = "1G"
 
-    def __contains__(self, item):
-        return self._store.__contains__(item)
+    def __init__(self, trace_iter, config, max_memory, shaped_only=False, manifest=None):
+        self._trace_iter = trace_iter
+        self._config = config
+        self._max_memory = max_memory
+        self._shaped_only = shaped_only
+        self._manifest = ManifestIndex.from_config(config) if manifest is None else manifest
 
     @classmethod
-    def from_path(cls, path):
-        # assert os.path.exists(path)
-        return cls(pd.HDFStore(path))
+    def from_lttng_trace(
+        cls, trace_path, config, max_memory, iterator_cls=None, window=None, marks=None, since=None, **dargs
+    ):
+        it = TraceParser.open_trace(
+            trace_path, config, iterator_cls=iterator_cls, window=window, marks=marks, since=since
+        )
+        return cls(it, config, max_memory, **dargs)
+
+    @classmethod
+    def ingest(cls, trace_path, config, keys, cache, max_memory=None, shaped_only=False, sketch=None):
+        """``stats_df(keys, sketch=sketch)`` of the trace at ``trace_path``,
+        decoding only the packets written since the last call: the
+        ``IngestState`` is kept in ``cache`` (a ``StageCache``).  Raises
+        ``UnsupportedTrace`` when the trace can't be read by packet."""
+        max_memory = parse_size(cls.MAX_MEMORY) if max_memory is None else max_memory
+        manifest = ManifestIndex.from_config(config)
+        code = code_version(
+            *TraceParser._CODE_MODULES, aggregate.__name__, PairCarry.__module__, decoder_cls("native").__module__
+        )
+        sketch_key = None if sketch is None else (sketch.capacity, sketch.weight)
+        key = stage_key(
+            "ingest", os.path.abspath(trace_path), manifest.fingerprint, code, keys, shaped_only, sketch_key
+        )
+        try:
+            state = cache[key]
+        except KeyError:
+            state = IngestState()
+        options = dict(shaped_only=shaped_only, manifest=manifest)
+        stp = cls.from_lttng_trace(trace_path, config, max_memory, marks=state.marks, since=state.since, **options)
+        if state.begin is not None and stp._trace_iter.begin != state.begin:
+            # Recorded again at the same path since: start over
+            state = IngestState()
+            stp = cls.from_lttng_trace(trace_path, config, max_memory, marks=state.marks, **options)
+        stats_df = stp.stats_df(keys, state, sketch)
+        cache[key] = state
+        return stats_df
+
+    @property
+    def batch_size(self):
+        return max(self.MIN_BATCH_SIZE, self._max_memory // self.BYTES_PER_EVENT)
+
+    def _batch_parser(self, frames):
+        return TraceParser(
+            FrameIterator(frames),
+            self._config,
+            cache=dict(),
+            shaped_only=self._shaped_only,
+            manifest=self._manifest,
+        )
+
+    def _batches(self, first_event, horizon=None):
+        """``batches`` with events numbered from ``first_event``, and a None
+        between the events before ``horizon`` and the others."""
+        before = horizon is not None
+        for frames in self._trace_iter.batches(self.batch_size):
+            for df in frames.values():
+                df.index += first_event
+            if before:
+                split = np.searchsorted(frames["events"]["timestamp"].values, horizon)
+                if split < len(frames["events"]):
+                    before = False
+                    yield {_s: _df.iloc[:split] for _s, _df in frames.items()}
+                    yield None
+                    frames = {_s: _df.iloc[split:] for _s, _df in frames.items()}
+            yield frames
+        if before:
+            yield None
+
+    def stats_df(self, keys, state=None, sketch=None):
+        """``dt_stats_df`` of ``latency_df(big_table_df)``, without ever building
+        the big table.  With a ``SpaceSaving`` ``sketch``, only for the
+        heaviest groups, see ``RunningStats``.
+
+        With an ``IngestState``, the statistics, sketch and open calls it
+        holds are carried on from, and it is moved up to the ``horizon`` of
+        the trace iterator: the events past it are counted in, but read again
+        next time.
+        """
+        carry = PairCarry() if state is None else state.carry
+        if state is not None and state.sketch is not None:
+            sketch = copy.deepcopy(state.sketch)
+        stats = RunningStats(keys, "dt", max_bytes=self._max_memory // self.STATS_SHARE, sketch=sketch)
+        open_df, read, horizon = None, 0, None
+        if state is not None:
+            stats.merge(state.aggregates_df)
+            open_df, read, horizon = state.open_df, state.events, self._trace_iter.horizon
+        try:
+            for frames in self._batches(read, horizon):
+                if frames is None:
+                    state.events, state.since = read, horizon
+                    state.marks, state.begin = self._trace_iter.marks, self._trace_iter.begin
+                    state.carry, state.open_df, state.aggregates_df = copy.copy(carry), open_df, stats.aggregates_df
+                    state.sketch = copy.deepcopy(stats.sketch)
+                    continue
+                read += len(frames["events"])
+                tp = self._batch_parser(frames)
+                clock = tp._trace_iter.stream_event_context_df["perf_thread_cpu_clock"]
+                pairs_df = carry.pairs_df(tp.threaded_f0cal_events_df, clock)
+                calls_df = pd.concat([open_df, tp.entry_args_df], axis="index", ignore_index=True, sort=False)
+                _df = pd.merge(calls_df, pairs_df, left_on="event_id", right_on="entry")
+                stats.update(latency_df(_df))
+                open_df = calls_df[calls_df["event_id"].isin(carry.open_entries)]
+            return stats.stats_df
+        finally:
+            stats.close()
+
+
+def latency_df(df):
+    """The call rows the reports aggregate: integer shapes and ``dt`` in ms."""
+    df = df.assign(dt=df["dt"] * 1e-6)
+    df[["width", "height"]] = df[["width", "height"]].astype(int)
+    return df
+
+
+def dt_stats_df(df, keys):
+    """The ``aggregate.METRICS`` and quantiles of ``dt`` per ``keys``; the
+    streaming path merges the very same aggregates batch by batch."""
+    stats = RunningStats(keys, "dt")
+    stats.update(df)
+    return stats.stats_df
+
+
+def merged_stats_df(aggregates_dfs, keys):
+    """``dt_stats_df`` of the calls of several runs or traces, from their
+    ``TraceParser.latency_aggregates_df`` (or ``RunningStats.aggregates_df``)
+    over the same ``keys``."""
+    return aggregate.metrics_df(aggregate.merge(aggregates_dfs, keys), keys)
+
+
+# The columns of each metric of a report, by section; latencies are in ms
+_LATENCY = "Latency (ms)"
+REPORT_METRICS = dict(
+    count=[("", "count")],
+    sum=[(_LATENCY, "sum")],
+    min=[(_LATENCY, "min")],
+    max=[(_LATENCY, "max")],
+    mean=[(_LATENCY, "mean")],
+    var=[(_LATENCY, "var")],
+    std=[(_LATENCY, "std")],
+    p50=[(_LATENCY, "p50")],
+    p90=[(_LATENCY, "p90")],
+    p99=[(_LATENCY, "p99")],
+    **{"p99.9": [(_LATENCY, "p99.9")]},
+    # The fastest call has the highest frame rate
+    fps=[("Throughput (fps)", "max"), ("Throughput (fps)", "min"), ("Throughput (fps)", "mean")],
+)
+_FPS_OF = dict(max="min", min="max", mean="mean")
+DEFAULT_KEYS = ["prefix", "width", "height"]
+# What --by can group calls by: the columns of the call rows of every read
+GROUP_KEYS = [
+    "prefix", "mangled_name", "hash", "depth", "arg_num", "arg_type", "width", "height", "ndim", "numel",
+    "channels", "elem_size", "nbytes", "ptr",
+]
+DEFAULT_METRICS = ["count", "min", "max", "mean", "p50", "p90", "p99", "p99.9", "fps"]
+# What --top ranks the rows by, and the weight the heavy-hitter sketch
+# counts for it: the p99 isn't additive, the candidates are the most called
+RANKS = dict(total_time="sum", count="count", p99="p99")
+_RANK_WEIGHTS = dict(total_time="sum", count="count", p99="count")
+# Counters kept per row asked for, so the top rows are all counted
+TOP_CAPACITY = 10
+
+
+def format_report_df(stats_df, scale=None, metrics=DEFAULT_METRICS):
+    """The report table: the ``REPORT_METRICS`` named in ``metrics``, from
+    ``dt_stats_df``.  For a sampled trace, ``scale`` is the inverse of the
+    share of the trace decoded: an estimate of the calls in the whole trace
+    and a 95% confidence interval on the mean latency are added."""
+    columns = {}
+    for metric in metrics:
+        for section, name in REPORT_METRICS[metric]:
+            values = 1000.0 / stats_df[_FPS_OF[name]] if metric == "fps" else stats_df[name]
+            columns[(section, name)] = values
+    if scale is not None:
+        _ci = 1.96 * stats_df["std"] / np.sqrt(stats_df["count"])
+        section = "Estimate (95% CI, ms)"
+        columns[(section, "count")] = stats_df["count"] * scale
+        columns[(section, "mean -")] = stats_df["mean"] - _ci
+        columns[(section, "mean +")] = stats_df["mean"] + _ci
+    if "error" in stats_df:
+        # Streamed with a heavy-hitter sketch: an upper bound on the weight
+        section = "Top (upper bound)"
+        columns[(section, "estimate")] = stats_df["estimate"]
+        columns[(section, "± error")] = stats_df["error"]
+    report_df = pd.DataFrame(columns, index=stats_df.index)[list(columns)]
+    return report_df.round(2)
+
+
+def format_tree_df(paths_df):
+    """The call tree table: a row per call path in tree order, named by its
+    callable indented by its level, with its calls and their inclusive and
+    exclusive latency (ms)."""
+    df = paths_df.loc[call_tree.depth_first(paths_df)]
+    names = ["  " * _l + _n for _l, _n in zip(df["level"].values, df["name"].astype(str).values)]
+    columns = {
+        ("", "count"): df["count"].values,
+        (_LATENCY, "inclusive"): df["inclusive"].values * 1e-6,
+        (_LATENCY, "exclusive"): df["exclusive"].values * 1e-6,
+    }
+    report_df = pd.DataFrame(columns, index=pd.Index(names, name="call"))[list(columns)]
+    return report_df.round(2)
+
+
+def _names(value):
+    """A comma-separated command line list."""
+    return [_n.strip() for _n in value.split(",") if _n.strip()]
+
 
 def _pr_list_args(parser):
     parser.add_argument('--query', default=None)
 
+
 @f0cal.entrypoint(['pr', 'list'], args=_pr_list_args)
 def _pr_list_entrypoint(parser, core, query):
-    ProfileManager.SESSION_CLS = object() # (br) HACK
+    ProfileManager.SESSION_CLS = object()  # (br) HACK
     mgr = ProfileManager.from_config(core.config)
     df = mgr.traces_df
+    # Read from the packet headers, nothing is decoded
+    summaries = [trace_summary(_p) or {} for _p in df['trace_path']]
+    df = df.join(pd.DataFrame.from_records(summaries, index=df.index, columns=SUMMARY_COLUMNS))
     if query is not None:
         df = df.query(query)
     print(df)
 
-def _pr_view_args(parser):
-    parser.add_argument('--query', default=None)
-    parser.add_argument('--html', default=False, action='store_true')
 
-@f0cal.entrypoint(['pr', 'view'], args=_pr_view_args)
-def _pr_view_entrypoint(parser, core, query, html):
-    ProfileManager.SESSION_CLS = object() # (br) HACK
-    mgr = ProfileManager.from_config(core.config)
+def _select_trace(mgr, query):
     df = mgr.traces_df
 
     # Either get the most recent trace or select via the query
@@ -382,67 +754,242 @@ def _pr_view_entrypoint(parser, core, query, html):
     else:
         df = df.sort_values(by=['start_time'], ascending=False)
         trace = df.iloc[0]
+    return trace
 
-    if pd.isnull(trace.get('hdf_path')):
-        trace_id = trace['id']
-        hdf_path = mgr.create_hdf_path(trace_id)
-    else:
-        hdf_path = trace.get('hdf_path')
 
-    TraceParser._CACHE_FACTORY = lambda _: HDFCache.from_path(hdf_path)
-    tp = TraceParser.from_lttng_trace(trace.get('trace_path'), core.config)
-    _df = tp.big_table_df
+def convert_trace(mgr, trace_id, config):
+    """Decodes and pairs the trace ``trace_id`` into the dataset ``pr view``
+    reads instead of the trace from then on."""
+    trace_path = mgr.trace_metadata[trace_id]['trace_path']
+    tp = TraceParser.from_lttng_trace(trace_path, config, cache=dict())
+    dataset_path = mgr.create_dataset_path(trace_id)
+    columnar.write_dataset(tp, dataset_path)
+    return dataset_path
+
+
+def _pr_convert_args(parser):
+    parser.add_argument('--query', default=None)
+
+
+@f0cal.entrypoint(['pr', 'convert'], args=_pr_convert_args)
+def _pr_convert_entrypoint(parser, core, query):
+    ProfileManager.SESSION_CLS = object()  # (br) HACK
+    if not columnar.AVAILABLE:
+        parser.error("Converting traces needs pyarrow: pip install pyarrow")
+    mgr = ProfileManager.from_config(core.config)
+    trace = _select_trace(mgr, query)
+    print(convert_trace(mgr, trace['id'], core.config))
+
 
-    _df = _df.query("width.notnull() and width>0", engine="python")
-    _df[["width", "height"]] = _df[["width", "height"]].astype(int)
+def _pr_view_args(parser):
+    parser.add_argument('--query', default=None)
+    parser.add_argument('--html', default=False, action='store_true')
+    parser.add_argument('--max-memory', default=None, type=parse_size)
+    # Durations since the start of the trace, e.g. 12.5s or 300ms
+    parser.add_argument(
+        '--from', dest='start', default=None, type=parse_duration,
+        help="start of the window read, e.g. 12.5s; with decoder=bt2, read by the native decoder, since "
+             "babeltrace 2 can't skip the packets before it",
+    )
+    parser.add_argument('--to', dest='stop', default=None, type=parse_duration)
+    # A quick, approximate report from a share of the packets, e.g. 5%
+    parser.add_argument('--sample', default=None, type=parse_fraction)
+    # Refresh the report every so many seconds as the trace grows
+    parser.add_argument('--follow', default=None, type=float, metavar='SECONDS')
+    # The report's rows and columns, e.g. --by prefix,ndim --metrics count,mean,std
+    parser.add_argument('--by', default=DEFAULT_KEYS, type=_names)
+    parser.add_argument('--metrics', default=DEFAULT_METRICS, type=_names)
+    # Only the heaviest rows, e.g. --top 20 --rank p99
+    parser.add_argument('--top', default=None, type=int, metavar='N')
+    parser.add_argument('--rank', default='total_time', choices=sorted(RANKS))
+    # The call tree, printed or as flame graph collapsed stacks (ns of exclusive time)
+    parser.add_argument('--tree', default=False, action='store_true')
+    parser.add_argument('--flamegraph', default=None, metavar='PATH')
+
+
+def top_stats_df(stats_df, top, rank):
+    """The ``top`` rows of ``stats_df`` by ``rank``, heaviest first.  Rows
+    streamed with a sketch are ranked by its estimate, which bounds their
+    weight including the part counted before they were."""
+    column = RANKS[rank]
+    if "estimate" in stats_df and rank != "p99":
+        column = "estimate"
+    return stats_df.sort_values(column, ascending=False, kind="mergesort").head(top)
+
+
+def _sketch(top, rank):
+    return None if top is None else SpaceSaving(TOP_CAPACITY * top, _RANK_WEIGHTS[rank])
+
+
+def _view_stats_df(trace, config, keys, max_memory, window, sample, top=None, rank='total_time', follow=False):
+    """The latency statistics of ``trace`` per ``keys``, and the scale of
+    its estimates when it is sampled.  With ``top``, streamed traces only
+    keep the groups of a ``SpaceSaving`` sketch for ``rank``; the others are
+    complete and ranked exactly.  To ``follow`` a growing trace, only what
+    was written since the last call is decoded, when the trace allows it."""
+    trace_path = trace.get('trace_path')
+    if sample is not None:
+        cache = StageCache.from_config(config)
+        tp = TraceParser.from_lttng_trace(
+            trace_path, config, sample=sample, shaped_only=True, cache=cache, stat_keys=keys
+        )
+        return tp.stats_df, 1.0 / tp._trace_iter.coverage
+    dataset_path = None if pd.isnull(trace.get('dataset_path')) else trace.get('dataset_path')
+    if follow:
+        try:
+            cache = StageCache.from_config(config)
+            stats_df = StreamingTraceParser.ingest(
+                trace_path, config, keys, cache, max_memory, shaped_only=True, sketch=_sketch(top, rank)
+            )
+            return stats_df, None
+        except UnsupportedTrace as e:
+            LOG.warning("%s can't be read incrementally (%s); each refresh reads all of it", trace_path, e)
+    if max_memory is not None:
+        # Bounded memory: no big table and no stage cache, the trace is streamed
+        stp = StreamingTraceParser.from_lttng_trace(trace_path, config, max_memory, window=window, shaped_only=True)
+        return stp.stats_df(keys, sketch=_sketch(top, rank)), None
+    tp = TraceParser.from_lttng_trace(
+        trace_path, config, dataset_path=dataset_path, window=window, shaped_only=True,
+        cache=StageCache.from_config(config), stat_keys=keys,
+    )
+    return tp.stats_df, None
+
+
+def _view_call_paths_df(trace, config, window):
+    """``TraceParser.call_paths_df`` of ``trace``."""
+    dataset_path = None if pd.isnull(trace.get('dataset_path')) else trace.get('dataset_path')
+    tp = TraceParser.from_lttng_trace(
+        trace.get('trace_path'), config, dataset_path=dataset_path, window=window, cache=StageCache.from_config(config)
+    )
+    return tp.call_paths_df
 
-    if trace.get('ldd') == True:
-        log_path = trace['ldd_log_path']
-        files = glob.glob('{path}.*'.format(path=log_path))
 
-        lp = LDDebugOutputParser.from_list(files, core.config)
+def _report_key(trace, config, keys, max_memory, window, sample, ldd_files, top=None, rank=None):
+    """The stage cache key of a ``pr view`` report: what it is computed from,
+    down to the file stamps of the trace and of the ldd logs, and how: the
+    decoder and the memory bound of a streamed read."""
+    trace_path = trace.get('trace_path')
+    fingerprint = trace_fingerprint(
+        trace_path, TraceParser._PROJECTION, TraceParser._EVENT_PREFIXES, (window, sample)
+    )
+    code = code_version(
+        *TraceParser._CODE_MODULES, aggregate.__name__, RunningStats.__module__, LDDebugOutputParser.__module__
+    )
+    ldd_stamps = file_stamps(*sorted(ldd_files), config['profiler']['symbols_file']) if ldd_files else None
+    manifest = ManifestIndex.from_config(config)
+    decoder = config['profiler'].get('decoder', DEFAULT_DECODER)
+    return stage_key(
+        "report", fingerprint, manifest.fingerprint, code, keys, ldd_stamps, top, rank, decoder, max_memory
+    )
+
+
+def _view_report(trace, config, keys, max_memory, window, sample, top=None, rank='total_time', follow=False):
+    """``(stats_df, scale, not_traced_df)`` for ``pr view``: the statistics
+    (with the lib of each prefix for ldd traces), the scale of a sample's
+    estimates and the lib functions that weren't traced.  Kept in the stage
+    cache, so viewing an unchanged trace again only loads a small table."""
+    # Each prefix resolves to a single lib, so the libs can only be told by prefix
+    ldd = pd.notnull(trace.get('ldd')) and bool(trace.get('ldd')) and 'prefix' in keys
+    ldd_files = glob.glob('{path}.*'.format(path=trace['ldd_log_path'])) if ldd else []
+    cache = StageCache.from_config(config)
+    key = _report_key(trace, config, keys, max_memory, window, sample, ldd_files, top, rank)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+
+    stats_df, scale = _view_stats_df(trace, config, keys, max_memory, window, sample, top, rank, follow)
+    not_traced_df = None
+    if ldd:
+        lp = LDDebugOutputParser.from_list(ldd_files, config)
         calls_df = lp.calls_df
         calls_df = calls_df.query("dst.str.contains('libopencv')", engine="python")
         calls_df = calls_df.drop_duplicates('prefix')
 
         calls_df = calls_df[['prefix', 'dst']]
-        calls_df = calls_df.rename(columns={'dst': 'lib_path'})
-
-        not_traced_df = pd.merge(_df, calls_df, on='prefix', how='outer', indicator=True)
-        not_traced_df = not_traced_df[not_traced_df['_merge'] == 'right_only'][
-            ['prefix', 'lib_path']]
+        calls_df = calls_df.rename(columns={'dst': 'lib_path'}).astype(dict(lib_path='category'))
 
-        _df = pd.merge(_df, calls_df, on='prefix')
+        traced = calls_df['prefix'].isin(stats_df.index.get_level_values('prefix'))
+        not_traced_df = calls_df[~traced].reset_index(drop=True)
 
-    _df.dt = _df.dt * 1e-6
+        # Each prefix resolves to a single lib, so it can be joined after aggregating
+        stats_df = pd.merge(stats_df.reset_index(), calls_df, on='prefix')
+        stats_df = stats_df.set_index(keys + ['lib_path'])
 
-    keys = ["prefix", "width", "height"]
-    if trace.get('ldd') == True:
-        keys.append('lib_path')
+    if top is not None:
+        stats_df = top_stats_df(stats_df, top, rank)
 
-    _grp = _df.groupby(keys)
-    _df1 = _grp.agg(dict(dt=["count"]))
-    _df2 = _grp.agg(dict(dt=["min", "max", "mean"]))
-    _df3 = (1000.0 / _df2[["dt"]])
+    cache[key] = report = (stats_df, scale, not_traced_df)
+    return report
 
-    _df1 = _df1.rename(dict(dt=""), axis="columns")
-    _df2 = _df2.rename(dict(dt="Latency (ms)"), axis="columns")
-    _df3 = _df3.rename(dict(min="max", max="min"), axis="columns") \
-               .rename(dict(dt="Throughput (fps)"), axis="columns")
 
-    report_df = pd.concat([_df1, _df2, _df3], axis='columns').round(2)
-
-    if html:
-        with open(tempfile.mktemp(), "w") as f:
-            template_str = open(os.path.join(HERE, TABLE_TEMPLATE)).read()
-            json_str = report_df.reset_index().to_json(orient="split")
-            template_str = template_str.replace(BLOB_FIELD, json_str)
-            f.write(template_str)
-            browser = core.config['f0cal']['browser']
-            os.system("{browser} {fname}".format(browser=browser, fname=f.name))
-    else:
-        print(report_df)
-        if trace.get('ldd') == True:
-            print('=' * 80)
-            print("Not traced functions")
-            print(not_traced_df.reset_index())
+@f0cal.entrypoint(['pr', 'view'], args=_pr_view_args)
+def _pr_view_entrypoint(
+    parser, core, query, html, max_memory, start, stop, sample, follow, by, metrics, top, rank, tree, flamegraph
+):
+    window = None if start is None and stop is None else (start, stop)
+    unknown = set(metrics) - set(REPORT_METRICS)
+    if unknown:
+        parser.error("Unknown metrics {}; pick from {}".format(sorted(unknown), sorted(REPORT_METRICS)))
+    unknown = set(by) - set(GROUP_KEYS)
+    if unknown:
+        parser.error("Unknown --by keys {}; pick from {}".format(sorted(unknown), sorted(GROUP_KEYS)))
+    if sample is not None and max_memory is not None:
+        parser.error("--sample and --max-memory can't be combined")
+    if max_memory is not None and not decoder_from_config(core.config).STREAMS:
+        parser.error("--max-memory needs a decoder that streams the trace")
+    if follow is not None and (html or sample is not None or window is not None):
+        parser.error("--follow can't be combined with --html, --sample, --from or --to")
+    if follow is not None and not decoder_from_config(core.config).INGESTS:
+        parser.error("--follow needs a decoder that reads a growing trace incrementally")
+    if top is not None and top < 1:
+        parser.error("--top must be at least 1")
+    if (tree or flamegraph is not None) and (html or follow is not None or sample is not None or max_memory):
+        # The tree needs every call of what is read, decoded at once
+        parser.error("--tree and --flamegraph can't be combined with --html, --follow, --sample or --max-memory")
+    ProfileManager.SESSION_CLS = object()  # (br) HACK
+    mgr = ProfileManager.from_config(core.config)
+    trace = _select_trace(mgr, query)
+
+    if tree or flamegraph is not None:
+        paths_df = _view_call_paths_df(trace, core.config, window)
+        if flamegraph is not None:
+            with open(flamegraph, "w") as f:
+                f.writelines(_l + "\n" for _l in call_tree.collapsed_stacks(paths_df))
+        if tree:
+            print(format_tree_df(paths_df))
+        return
+
+    keys = by
+    while True:
+        stats_df, scale, not_traced_df = _view_report(
+            trace, core.config, keys, max_memory, window, sample, top, rank, follow=follow is not None
+        )
+        ldd = not_traced_df is not None
+
+        report_df = format_report_df(stats_df, scale, metrics)
+
+        if html:
+            with open(tempfile.mktemp(), "w") as f:
+                template_str = open(os.path.join(HERE, TABLE_TEMPLATE)).read()
+                json_str = report_df.reset_index().to_json(orient="split")
+                template_str = template_str.replace(BLOB_FIELD, json_str)
+                f.write(template_str)
+                browser = core.config['f0cal']['browser']
+                os.system("{browser} {fname}".format(browser=browser, fname=f.name))
+        else:
+            if follow is not None:
+                # Clear the terminal and redraw from the top
+                print("\x1b[H\x1b[2J", end="")
+            print(report_df)
+            if ldd:
+                print('=' * 80)
+                print("Not traced functions")
+                print(not_traced_df.reset_index())
+
+        if follow is None:
+            break
+        try:
+            time.sleep(follow)
+        except KeyboardInterrupt:
+            break
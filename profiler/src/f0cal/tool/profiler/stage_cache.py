@@ -0,0 +1,114 @@
+"""A content-addressed, on-disk cache for ``TraceParser`` stages.
+
+Entries are pickles named by the stage key, which ``TraceParser`` derives
+from the trace fingerprint, the manifest index fingerprint, the parser code
+and the stage's parameters and upstream stages.  Anything that changes one
+of those changes the key, so a stale entry is simply never read again and
+ages out: entries are touched when read and the least recently used ones are
+removed once the cache is over its disk budget.
+
+Entries are written aside and renamed into place, so concurrent readers
+either see a whole entry or none; an entry evicted under a reader is a miss.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from .streaming import parse_size
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(*module_names):
+    """A digest of the source of ``module_names``."""
+    digest = hashlib.sha1()
+    for name in module_names:
+        with open(sys.modules[name].__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def file_stamps(*paths):
+    """``(path, size, mtime)`` of each of ``paths``, None for those missing:
+    what a key of something derived from files is made of."""
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stamps.append((path, None))
+            continue
+        stamps.append((path, stat.st_size, stat.st_mtime_ns))
+    return stamps
+
+
+def stage_key(*parts):
+    return hashlib.sha1("\0".join(str(_p) for _p in parts).encode()).hexdigest()
+
+
+class StageCache:
+    DIR_NAME = "stages"
+    BUDGET = "2G"
+    _SUFFIX = ".pkl"
+
+    def __init__(self, directory, budget=parse_size(BUDGET)):
+        self._directory = directory
+        self._budget = budget
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        directory = os.path.join(config["profiler"]["profiler_dir"], cls.DIR_NAME)
+        return cls(directory, parse_size(config["profiler"].get("stage_cache_budget", cls.BUDGET)))
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self._SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """Stores ``value``, unless it alone is over the budget: it would only
+        evict everything else and then itself."""
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, prefix=".", suffix=self._SUFFIX)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        if size > self._budget:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries beyond the budget."""
+        entries = []
+        for name in os.listdir(self._directory):
+            if name.startswith(".") or not name.endswith(self._SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(_s for _, _s, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self._budget:
+                break
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,270 @@
+"""State that is carried between the event batches of a streamed trace.
+
+``TraceParser`` builds every table over the whole trace.  For traces larger
+than the analysis host's memory, ``StreamingTraceParser`` walks the trace in
+fixed-size batches instead and only keeps:
+
+* the calls still open at the end of a batch (``PairCarry``), since an
+  entry and its exit may land in different batches;
+* per-group latency statistics (``RunningStats``), which are mergeable and
+  are spilled to disk when they outgrow their share of the memory budget;
+  with a ``SpaceSaving`` sketch, only those of the heaviest groups.
+
+The same state carries over from one ``pr view`` to the next: an
+``IngestState`` stores it along with where each stream was read up to, so a
+trace that grew since is only decoded from there on.
+"""
+import heapq
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import aggregate
+from .pairing import pair_calls
+
+_SIZE_REGEX = re.compile(r"^\s*(?P<num>\d+(\.\d+)?)\s*(?P<unit>[kmgt]?)i?b?\s*$", re.IGNORECASE)
+_SIZE_UNITS = dict(k=1 << 10, m=1 << 20, g=1 << 30, t=1 << 40)
+# The index level of ``RunningStats`` rows that tells which admission of
+# their group by the sketch they were counted in
+TAKEN_IN = "taken_in"
+
+
+def parse_size(size):
+    """Bytes in a human-readable size such as ``512M`` or ``4G``."""
+    match = _SIZE_REGEX.match(str(size))
+    assert match is not None, size
+    unit = _SIZE_UNITS.get(match.group("unit").lower(), 1)
+    return int(float(match.group("num")) * unit)
+
+
+class PairCarry:
+    """Pairs calls batch after batch.
+
+    The entries still open at the end of a batch are fed again in front of
+    the next one; ``pair_calls`` leaves them in time order, which is also
+    stack order, so pairing picks up where it stopped.  Entries keep their
+    ``perf_thread_cpu_clock`` so that ``dt`` is known as soon as the exit is.
+    """
+
+    def __init__(self):
+        self._open_df = None
+
+    def pairs_df(self, threaded_df, clock):
+        """``entry``, ``exit``, ``depth`` and ``dt`` of every call closed in this batch."""
+        df = pd.DataFrame(
+            dict(
+                pid=threaded_df["pid"].values,
+                thid=threaded_df["thid"].values,
+                hash=threaded_df["hash"].values,
+                is_entry=(threaded_df["io"] == "i").values,
+                clock=clock.reindex(threaded_df.index).values,
+            ),
+            index=threaded_df.index,
+        )
+        df = pd.concat([self._open_df, df], axis="index", sort=False)
+        threads = df.groupby(["pid", "thid"], sort=False).ngroup().values
+        entry, exit, depth, still_open = pair_calls(threads, df["is_entry"].values, df["hash"].values)
+        self._open_df = df.iloc[still_open]
+        event_ids, cpu_clock = df.index.values, df["clock"].values
+        return pd.DataFrame(
+            dict(entry=event_ids[entry], exit=event_ids[exit], depth=depth, dt=cpu_clock[exit] - cpu_clock[entry])
+        )
+
+    @property
+    def open_entries(self):
+        """Event ids of the calls still open."""
+        return np.zeros(0, dtype=np.int64) if self._open_df is None else self._open_df.index.values
+
+
+class SpaceSaving:
+    """The heaviest groups of a stream, in bounded memory.
+
+    Keeps ``capacity`` counters of the ``weight`` aggregate (``count`` or
+    ``sum``) of a group.  A group that isn't counted yet takes over the
+    smallest counter, as if it had that weight already, so a count is over
+    the true weight by at most its ``error``.  Every group heavier than
+    ``total / capacity`` is counted, and no error exceeds that (Metwally et
+    al.).  Batches come in as exact per-group weights: those of the groups
+    already counted are added, then the others are fed one by one, heaviest
+    first, each taking over the smallest counter at that point.  A counter's
+    ``taken_in`` is the update its group was last taken in at.
+    """
+
+    def __init__(self, capacity, weight="sum"):
+        self.capacity = capacity
+        self.weight = weight
+        self.total = 0.0
+        self.updates = 0
+        self.counts_df = pd.DataFrame(
+            dict(count=np.zeros(0), error=np.zeros(0), taken_in=np.zeros(0, dtype=np.int64))
+        )
+
+    def update(self, weights):
+        """Adds ``weights``, the weight of each group of a batch."""
+        weights = weights[weights.values > 0]
+        update, self.updates = self.updates, self.updates + 1
+        if not len(weights):
+            return
+        self.total += float(weights.sum())
+        df = self.counts_df
+        positions = df.index.get_indexer(weights.index) if len(df) else np.full(len(weights), -1)
+        known = positions >= 0
+        counts = df["count"].values.astype(float)
+        counts[positions[known]] += weights.values[known]
+        errors = df["error"].values.astype(float)
+        taken_in = df["taken_in"].values.astype(np.int64)
+
+        new = weights[~known]
+        new = new.iloc[np.argsort(-new.values, kind="stable")]
+        labels = df.index.append(new.index) if len(df) else new.index
+        # The label of each counter, as a position in ``labels``
+        slots = np.arange(len(df))
+        free = max(self.capacity - len(df), 0)
+        slots = np.r_[slots, len(df) + np.arange(min(free, len(new)))]
+        counts = np.r_[counts, new.values[:free]]
+        errors = np.r_[errors, np.zeros(min(free, len(new)))]
+        taken_in = np.r_[taken_in, np.full(min(free, len(new)), update)]
+        if len(new) > free:
+            # Counters are taken over one at a time: the smallest count may be
+            # one just taken over
+            heap = [(_c, _s) for _s, _c in enumerate(counts.tolist())]
+            heapq.heapify(heap)
+            for position, weight in enumerate(new.values[free:].tolist(), len(df) + free):
+                floor, slot = heap[0]
+                slots[slot], counts[slot], errors[slot] = position, floor + weight, floor
+                taken_in[slot] = update
+                heapq.heapreplace(heap, (floor + weight, slot))
+        df = pd.DataFrame(dict(count=counts, error=errors, taken_in=taken_in), index=labels[slots])
+        self.counts_df = df.iloc[np.argsort(-df["count"].values, kind="stable")]
+
+    @property
+    def bound(self):
+        """The largest possible error of any count."""
+        return self.total / self.capacity
+
+
+class RunningStats:
+    """Mergeable ``aggregate.AGGREGATES`` of a value per group and histogram bucket.
+
+    Partial aggregates are folded together as batches come in; once the
+    folded table is bigger than ``max_bytes`` it is written to ``spill_dir``
+    and started over.  ``stats_df`` merges everything back.
+
+    With a ``SpaceSaving`` ``sketch``, only the aggregates of the groups it
+    counts are kept; a group's statistics then cover its calls since it was
+    last taken in, which is all of them when its ``error`` is 0.  Rows are
+    tagged with the update their group was taken in at (a ``TAKEN_IN`` index
+    level), and those of an earlier admission, folded or spilled before the
+    group was evicted, are dropped when merged.
+    """
+
+    FOLD_EVERY = 16
+
+    def __init__(self, keys, value, max_bytes=None, spill_dir=None, sketch=None):
+        self._keys = list(keys)
+        self._value = value
+        self._max_bytes = max_bytes
+        self._spill_dir = spill_dir
+        self._own_spill_dir = False
+        self._partials = []
+        self._spilled = []
+        self.sketch = sketch
+
+    @property
+    def _merge_keys(self):
+        return self._keys if self.sketch is None else self._keys + [TAKEN_IN]
+
+    def _tagged(self, aggregates_df):
+        """The rows of the groups the sketch counts, tagged with the update
+        each was taken in at."""
+        groups = aggregates_df.index.droplevel(aggregate.BUCKET)
+        taken_in = self.sketch.counts_df["taken_in"].reindex(groups)
+        df = aggregates_df[taken_in.notnull().values].reset_index()
+        df[TAKEN_IN] = taken_in.dropna().values.astype(np.int64)
+        return df.set_index(self._merge_keys + [aggregate.BUCKET])
+
+    def _counted(self, aggregates_df):
+        """The rows of ``_tagged`` tables of the groups the sketch counts, as
+        last taken in."""
+        groups = aggregates_df.index.droplevel([TAKEN_IN, aggregate.BUCKET])
+        taken_in = self.sketch.counts_df["taken_in"].reindex(groups).values
+        return aggregates_df[taken_in == aggregates_df.index.get_level_values(TAKEN_IN).values]
+
+    def update(self, df):
+        if not len(df):
+            return
+        partial = aggregate.aggregate(df, self._keys, self._value)
+        if self.sketch is not None:
+            levels = list(range(len(self._keys)))
+            self.sketch.update(partial[self.sketch.weight].groupby(level=levels).sum())
+            partial = self._tagged(partial)
+        self._partials.append(partial)
+        if len(self._partials) >= self.FOLD_EVERY:
+            self._partials = [aggregate.merge(self._partials, self._merge_keys)]
+            if self.sketch is not None:
+                self._partials = [self._counted(self._partials[0])]
+            if self._max_bytes is not None and self._partials[0].memory_usage(deep=True).sum() > self._max_bytes:
+                self._spill()
+
+    def _spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="f0cal-stats-")
+            self._own_spill_dir = True
+        path = os.path.join(self._spill_dir, "stats-{}.pkl".format(len(self._spilled)))
+        aggregate.merge(self._partials, self._merge_keys).to_pickle(path)
+        self._spilled.append(path)
+        self._partials = []
+
+    def merge(self, aggregates_df):
+        """Folds in ``aggregates_df``, as ``aggregates_df`` of another instance
+        (of the groups the sketch counts now, with one)."""
+        if aggregates_df is not None and len(aggregates_df):
+            self._partials.append(aggregates_df if self.sketch is None else self._tagged(aggregates_df))
+
+    @property
+    def aggregates_df(self):
+        """The aggregates per group, merged."""
+        df = aggregate.merge([pd.read_pickle(_p) for _p in self._spilled] + self._partials, self._merge_keys)
+        return df if self.sketch is None else self._counted(df).droplevel(TAKEN_IN)
+
+    @property
+    def stats_df(self):
+        """Every ``aggregate.METRICS`` and ``aggregate.QUANTILES`` per group,
+        and with a sketch the ``estimate`` of each group's weight and its
+        ``error``."""
+        df = aggregate.metrics_df(self.aggregates_df, self._keys)
+        if self.sketch is not None:
+            counts_df = self.sketch.counts_df.reindex(df.index)
+            df["estimate"], df["error"] = counts_df["count"].values, counts_df["error"].values
+        return df
+
+    def close(self):
+        for path in self._spilled:
+            os.remove(path)
+        self._spilled = []
+        if self._own_spill_dir:
+            os.rmdir(self._spill_dir)
+            self._spill_dir, self._own_spill_dir = None, False
+
+
+class IngestState:
+    """Where an incremental read of a trace stopped, and what it carries over.
+
+    Everything before ``since`` (ns) was read: ``marks`` is the ``{stream
+    path: offset}`` of the last packet of each stream that ends before it and
+    ``events`` the number of events before it, the next event id.  ``begin``
+    is the timestamp of the first packet of the trace, which tells a trace
+    that grew from one that was recorded again at the same path.
+    """
+
+    def __init__(self):
+        self.begin = self.since = None
+        self.marks = {}
+        self.events = 0
+        self.carry = PairCarry()
+        self.open_df = None
+        self.aggregates_df = None
+        self.sketch = None
@@ -0,0 +1,274 @@
+import hashlib
+import importlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import payload
+from .pandas_helpers import required_columns
+
+# Decoder backends by the name used for ``[profiler] decoder``.  They are
+# imported on first use, so a host only needs the bindings of the backend it
+# is configured for.
+DECODERS = dict(
+    bt1="babeltrace_if:CtfTraceIterator",
+    bt2="babeltrace2_if:Bt2TraceIterator",
+    native="ctf_native:NativeCtfTraceIterator",
+)
+DEFAULT_DECODER = "bt1"
+
+
+def decoder_cls(name):
+    assert name in DECODERS, (name, sorted(DECODERS))
+    module_name, cls_name = DECODERS[name].split(":")
+    module = importlib.import_module("." + module_name, __package__)
+    return getattr(module, cls_name)
+
+
+def decoder_from_config(config):
+    return decoder_cls(config["profiler"].get("decoder", DEFAULT_DECODER))
+
+
+_DURATION_REGEX = re.compile(r"^\s*(?P<num>\d+(\.\d+)?)\s*(?P<unit>ns|us|ms|s|m|h)?\s*$")
+_DURATION_UNITS = dict(ns=1, us=1000, ms=1000000, s=1000000000, m=60 * 1000000000, h=3600 * 1000000000)
+
+
+def parse_duration(duration):
+    """Nanoseconds in a duration such as ``12.5s`` or ``300ms``; seconds by default."""
+    match = _DURATION_REGEX.match(str(duration))
+    assert match is not None, duration
+    return int(round(float(match.group("num")) * _DURATION_UNITS[match.group("unit") or "s"]))
+
+
+def parse_fraction(fraction):
+    """A fraction given as ``5%`` or ``0.05``."""
+    text = str(fraction).strip()
+    value = float(text[:-1]) / 100 if text.endswith("%") else float(text)
+    assert 0 < value <= 1, fraction
+    return value
+
+
+def window_bounds(window, begin):
+    """``[low, high)`` in trace timestamps of a ``(start, stop)`` window of ns
+    since ``begin``, the start of the trace; either end may be None."""
+    start, stop = window
+    low = np.iinfo(np.int64).min if start is None else begin + start
+    high = np.iinfo(np.int64).max if stop is None else begin + stop
+    return low, high
+
+
+def segment_of(segments, timestamps):
+    """The index of the ``(lows, highs)`` segment holding each of ``timestamps``,
+    -1 for those in none of them."""
+    lows, highs = segments
+    segment = np.searchsorted(lows, timestamps, side="right") - 1
+    inside = (segment >= 0) & (timestamps < highs[segment.clip(min=0)])
+    return np.where(inside, segment, -1)
+
+
+def encode_names(frames):
+    """Event names dictionary-encoded: a trace has a few hundred distinct
+    names over millions of events."""
+    events = frames.get("events")
+    if events is not None and "name" in events and not isinstance(events["name"].dtype, pd.CategoricalDtype):
+        events["name"] = events["name"].astype("category")
+    return frames
+
+
+def trace_fingerprint(trace_path, scopes, name_prefixes, selection=None):
+    """A digest of the trace files under ``trace_path`` (paths, sizes and
+    mtimes) and of what is decoded from them: the projection and, if not the
+    whole trace, the ``selection`` of events (e.g. the window)."""
+    decoded = (sorted(scopes.items()), name_prefixes)
+    digest = hashlib.sha1(repr(decoded if selection is None else decoded + (selection,)).encode())
+    for root, dirs, files in os.walk(trace_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            stamp = os.path.relpath(path, trace_path), stat.st_size, stat.st_mtime_ns
+            digest.update(repr(stamp).encode())
+    return digest.hexdigest()
+
+
+def _with_columns(df, columns, is_payload):
+    """``df`` with every one of ``columns``, in that order."""
+    missing = [_c for _c in columns if _c not in df.columns]
+    if not missing:
+        return df if list(df.columns) == list(columns) else df[list(columns)]
+    absent = {
+        _c: payload.absent_column(_c, len(df)) if is_payload else np.full(len(df), np.nan) for _c in missing
+    }
+    df = pd.concat([df, pd.DataFrame(absent, index=df.index)], axis=1)
+    return df[list(columns)]
+
+
+class TraceIterator:
+    """The frames every trace decoder backend hands to ``TraceParser``.
+
+    Subclasses implement ``_decode``, which walks the trace once and returns
+    ``{scope: DataFrame}`` for every requested scope.  All frames are aligned
+    on a ``RangeIndex`` over the decoded (i.e. not skipped) events, in
+    timestamp order, and event names are categorical.
+    """
+
+    _DEFAULT_SCOPES = ("events", "event_fields", "stream_event_context", "stream_packet_context")
+    # Whether ``batches`` decodes the trace a batch at a time
+    STREAMS = False
+    # Whether it can read only the packets written since ``marks``
+    INGESTS = False
+    # Whether a window only reads the packets it overlaps
+    SEEKS = False
+
+    def __init__(self, scopes=None, name_prefixes=None, window=None):
+        """``scopes`` is either a sequence of scope names or a ``{scope: fields}``
+        projection, where ``fields`` of None means every field of that scope.
+        Events whose name does not start with one of ``name_prefixes`` are
+        skipped before any of their fields are read.  With a ``window``, a
+        ``(start, stop)`` pair of ns since the start of the trace, only the
+        events in ``[start, stop)`` are decoded."""
+        self._scopes = self._projection(self._DEFAULT_SCOPES if scopes is None else scopes)
+        self._name_prefixes = None if name_prefixes is None else tuple(name_prefixes)
+        self._window = None if window is None else tuple(window)
+        self._selection = self._window
+        self._frames = None
+        self._len = None
+        self._source_path = None
+
+    @staticmethod
+    def _projection(scopes):
+        if isinstance(scopes, dict):
+            return dict(scopes)
+        return {_s: None for _s in scopes}
+
+    def _with_source(self, trace_path):
+        self._source_path = trace_path
+        return self
+
+    @property
+    def fingerprint(self):
+        """``trace_fingerprint`` of what this decodes, or None when the frames
+        don't come from a trace."""
+        if self._source_path is None:
+            return None
+        return trace_fingerprint(self._source_path, self._scopes, self._name_prefixes, self._selection)
+
+    @property
+    def segments(self):
+        """``(lows, highs)``, the ``[low, high)`` time spans that were decoded,
+        for backends that decode disjoint parts of the trace; None otherwise.
+        Calls are only paired within a segment."""
+        return None
+
+    @property
+    def entry_segments(self):
+        """For a sampled trace, the ``(lows, highs)`` time spans that were
+        sampled: only the calls entered in them count, the rest of
+        ``segments`` is there for them to exit; None otherwise."""
+        return None
+
+    @property
+    def coverage(self):
+        """The share of the trace's time span that was sampled."""
+        return 1.0
+
+    @classmethod
+    def options_from_config(cls, config):
+        """Backend-specific ``from_path`` keyword arguments taken from ``config``."""
+        return {}
+
+    @classmethod
+    def is_valid_ctf_path(cls, trace_path):
+        assert os.path.exists(trace_path), trace_path
+        assert os.path.isdir(trace_path), trace_path
+        return True
+
+    def _decode(self):
+        raise NotImplementedError()
+
+    @property
+    def frames(self):
+        """All requested scopes, decoded together in a single walk of the trace."""
+        if self._frames is None:
+            self._frames = encode_names(self._decode())
+        return self._frames
+
+    def _frame(self, scope):
+        assert scope in self._scopes, (scope, self._scopes)
+        return self.frames[scope]
+
+    @property
+    @required_columns(["name", "cycles", "timestamp"])
+    def events_df(self):
+        return self._frame("events")
+
+    @property
+    def event_fields_df(self):
+        return self._frame("event_fields")
+
+    @property
+    @required_columns(['perf_thread_cpu_clock', 'perf_thread_cycles', 'pthread_id', 'vpid'])
+    def stream_event_context_df(self):
+        return self._frame("stream_event_context")
+
+    @property
+    @required_columns(['content_size', 'cpu_id', 'events_discarded', 'packet_seq_num',
+                       'packet_size', 'timestamp_begin', 'timestamp_end'])
+    def stream_packet_context_df(self):
+        return self._frame("stream_packet_context")
+
+    @property
+    def calls_df(self):
+        """The calls as ``TraceParser.calls_df`` pairs them, for backends that
+        store them alongside the events; None otherwise."""
+        return None
+
+    def batches(self, batch_size):
+        """Yields the frames of consecutive runs of at most ``batch_size`` events
+        as ``{scope: DataFrame}``, indexed by event number within the whole
+        trace.
+
+        Every batch has the columns a full decode would have, as far as they
+        are known by then: those ``_schema`` declares and those of every
+        batch before it.  A batch lacking some, e.g. one of exit events only,
+        gets them filled in as the full frame has them for events without
+        the field."""
+        schema = {
+            _s: dict.fromkeys(payload.field_columns(_n) if _s == "event_fields" else _n)
+            for _s, _n in self._schema().items()
+        }
+        for frames in self._batches(batch_size):
+            for scope, df in frames.items():
+                columns = schema.setdefault(scope, {})
+                columns.update(dict.fromkeys(df.columns))
+                frames[scope] = _with_columns(df, columns, scope == "event_fields")
+            yield frames
+
+    def _batches(self, batch_size):
+        """``batches`` as decoded.  Backends that can decode incrementally
+        (see ``STREAMS``) override this so that only a batch is ever held in
+        memory; this one decodes everything first."""
+        frames = self.frames
+        for start in range(0, len(self), batch_size):
+            yield {_s: _df.iloc[start:start + batch_size] for _s, _df in frames.items()}
+
+    def _schema(self):
+        """``{scope: field names}`` known to be in a full decode before
+        decoding, e.g. from the trace metadata."""
+        return {}
+
+    def __len__(self):
+        if self._len is None:
+            self._frames = self.frames
+        return self._len
+
+
+class FrameIterator(TraceIterator):
+    """Frames that were decoded elsewhere, e.g. one batch of a larger trace."""
+
+    def __init__(self, frames):
+        super().__init__(scopes=list(frames))
+        self._frames = frames
+        self._len = len(next(iter(frames.values()))) if frames else 0
@@ -1,11 +1,220 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-    Dummy conftest.py for profiler.
+    Fixtures for profiler.
 
-    If you don't know what this is for, just leave it empty.
-    Read more about conftest.py under:
-    https://pytest.org/latest/plugins.html
+    ``lttng_trace`` writes small LTTng-UST-like CTF traces: a per-CPU stream
+    file of 4 KiB packets each, compact event headers with 27-bit wrapping
+    timestamps and extended ones past a wrap, and f0cal entry/exit events
+    interleaved with events of another provider.
 """
+import configparser
+import json
+import os
+import random
+import struct
 
-# import pytest
+import pytest
+
+CLOCK_OFFSET = 1554384928453479557
+PACKET_SIZE = 4096
+METADATA = r"""/* CTF 1.8 */
+typealias integer { size = 8; align = 8; signed = false; } := uint8_t;
+typealias integer { size = 32; align = 8; signed = false; } := uint32_t;
+typealias integer { size = 64; align = 8; signed = false; } := uint64_t;
+typealias integer { size = 5; align = 1; signed = false; } := uint5_t;
+
+trace {
+    major = 1;
+    minor = 8;
+    uuid = "2a6422d0-6cee-11e0-8c08-cb07d7b3a564";
+    byte_order = le;
+    packet.header := struct {
+        uint32_t magic;
+        uint8_t  uuid[16];
+        uint32_t stream_id;
+        uint64_t stream_instance_id;
+    };
+};
+
+clock {
+    name = "monotonic";
+    uuid = "aaaa";
+    freq = 1000000000;
+    offset = %(offset)d;
+};
+
+typealias integer { size = 27; align = 1; signed = false; map = clock.monotonic.value; } := uint27_clock_t;
+typealias integer { size = 64; align = 1; signed = false; map = clock.monotonic.value; } := uint64_clock_t;
+
+stream {
+    id = 0;
+    event.header := struct {
+        enum : uint5_t { compact = 0 ... 30, extended = 31 } id;
+        variant <id> {
+            struct { uint27_clock_t timestamp; } compact;
+            struct { uint32_t id; uint64_clock_t timestamp; } extended;
+        } v;
+    } align(8);
+    packet.context := struct {
+        uint64_clock_t timestamp_begin;
+        uint64_clock_t timestamp_end;
+        uint64_t content_size;
+        uint64_t packet_size;
+        uint64_t packet_seq_num;
+        uint64_t events_discarded;
+        uint32_t cpu_id;
+    };
+    event.context := struct {
+        integer { size = 64; align = 8; signed = 1; } _perf_thread_cpu_clock;
+        integer { size = 64; align = 8; signed = 1; } _perf_thread_cycles;
+        integer { size = 64; align = 8; signed = 0; } _pthread_id;
+        integer { size = 32; align = 8; signed = 1; } _vpid;
+    };
+};
+
+event {
+    name = "f0cal:opencv_iabc";
+    id = 0;
+    stream_id = 0;
+    fields := struct {
+        integer { size = 64; align = 8; signed = 0; base = 16; } _v0_ptr;
+        integer { size = 64; align = 8; signed = 0; } __v0_shape_length;
+        integer { size = 32; align = 8; signed = 1; } _v0_shape[ __v0_shape_length ];
+        string _mangled_name_field;
+    };
+};
+
+event {
+    name = "f0cal:opencv_oabc";
+    id = 1;
+    stream_id = 0;
+    fields := struct {
+        string _mangled_name_field;
+    };
+};
+
+event {
+    name = "other:noise";
+    id = 40;
+    stream_id = 0;
+    fields := struct {
+        integer { size = 16; align = 8; signed = 0; } _x;
+        string _s;
+    };
+};
+""" % dict(offset=CLOCK_OFFSET)
+ENTRY_NAME = "f0cal:opencv_iabc"
+EXIT_NAME = "f0cal:opencv_oabc"
+NOISE_NAME = "other:noise"
+# The shim of the entry events, with a cv::Mat argument
+MANIFEST = dict(
+    shims=[
+        dict(hash="abc", prefix="cv::foo", mangled_name="_Z3foov", arg_list=[dict(arg_num=0, arg_type="cv::Mat")])
+    ]
+)
+_IDS = {ENTRY_NAME: 0, EXIT_NAME: 1, NOISE_NAME: 40}
+_CONTEXT_SIZE = 8 * 6 + 4
+
+
+def _event_bytes(event, previous):
+    event_id = _IDS[event["name"]]
+    if event_id < 31 and event["cycles"] - previous < 1 << 27:
+        header = struct.pack("<I", event_id | (event["cycles"] & ((1 << 27) - 1)) << 5)
+    else:
+        header = bytes([31]) + struct.pack("<IQ", event_id, event["cycles"])
+    context = struct.pack("<qqQi", event["cpu_clock"], event["cpu_clock"] * 3, event["pthread_id"], 77)
+    if event["name"] == ENTRY_NAME:
+        shape = event["shape"]
+        fields = struct.pack("<QQ", event["ptr"], len(shape)) + struct.pack("<{}i".format(len(shape)), *shape)
+        fields += event["mangled_name"].encode() + b"\0"
+    elif event["name"] == EXIT_NAME:
+        fields = event["mangled_name"].encode() + b"\0"
+    else:
+        fields = struct.pack("<H", 5) + b"hello\0"
+    return header + context + fields
+
+
+def write_stream(path, cpu, events):
+    packets = []
+    index = 0
+    while index < len(events):
+        body = b""
+        pos = 32 + _CONTEXT_SIZE
+        begin = previous = events[index]["cycles"]
+        while index < len(events):
+            record = _event_bytes(events[index], previous)
+            if pos + len(record) > PACKET_SIZE:
+                break
+            body += record
+            pos += len(record)
+            previous = events[index]["cycles"]
+            index += 1
+        header = struct.pack("<I16sIQ", 0xC1FC1FC1, b"\0" * 16, 0, 0)
+        context = struct.pack("<QQQQQQI", begin, previous, pos * 8, PACKET_SIZE * 8, len(packets), 0, cpu)
+        packet = header + context + body
+        packets.append(packet + b"\0" * (PACKET_SIZE - len(packet)))
+    with open(path, "wb") as f:
+        f.write(b"".join(packets))
+
+
+def write_trace(root, count, cpus=2, seed=0, dims=(2, 3)):
+    """Writes a trace of ``count`` events to ``root``, with shapes of one of
+    ``dims`` dimensions; returns the events, a dict each, in timestamp
+    order."""
+    rng = random.Random(seed)
+    trace_dir = os.path.join(root, "ust", "uid", "1000", "64-bit")
+    os.makedirs(trace_dir)
+    with open(os.path.join(trace_dir, "metadata"), "w") as f:
+        f.write(METADATA)
+    events = []
+    cycles = 1000
+    clocks = {}
+    for number in range(count):
+        # Past the compact header's 27 bits now and then
+        cycles += rng.randint(1, 5000) if number % 100 else 1 << 28
+        pthread_id = rng.choice([11, 12])
+        clocks[pthread_id] = clocks.get(pthread_id, 0) + rng.randint(10, 100)
+        event = dict(cpu=rng.randrange(cpus), cycles=cycles, cpu_clock=clocks[pthread_id], pthread_id=pthread_id)
+        draw = rng.random()
+        if draw < 0.45:
+            shape = [rng.choice([640, 0]), 480, 3][: rng.choice(dims)]
+            event.update(name=ENTRY_NAME, ptr=0x1000 + number, shape=shape)
+            event.update(mangled_name=rng.choice(["_Z3foov", "_ZN2cv6resizeEv"]))
+        elif draw < 0.9:
+            event.update(name=EXIT_NAME, mangled_name="_Z3barv")
+        else:
+            event.update(name=NOISE_NAME)
+        events.append(event)
+    for cpu in range(cpus):
+        write_stream(
+            os.path.join(trace_dir, "channel0_{}".format(cpu)), cpu, [_e for _e in events if _e["cpu"] == cpu]
+        )
+    return events
+
+
+@pytest.fixture
+def lttng_trace(tmp_path):
+    """A function writing a trace (see ``write_trace``) under a fresh
+    directory, returning ``(trace_path, events)``."""
+    traces = []
+
+    def make(count, **kwargs):
+        root = str(tmp_path / "trace{}".format(len(traces)))
+        traces.append(root)
+        return root, write_trace(root, count, **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def profiler_config(tmp_path):
+    """A config with a fresh profiler directory and the ``MANIFEST`` shims,
+    decoding with the native reader."""
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(MANIFEST))
+    config = configparser.ConfigParser()
+    config["profiler"] = dict(
+        profiler_dir=str(tmp_path / "profiler"), manifest_glob=str(manifest_path), decoder="native"
+    )
+    return config
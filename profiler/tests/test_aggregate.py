@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from f0cal.tool.profiler import aggregate
+
+KEYS = ["prefix", "width"]
+
+
+def _calls_df(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        dict(
+            prefix=pd.Categorical(rng.choice(["cv::resize", "cv::blur", "cv::add"], size)),
+            width=rng.choice([640, 320, 0], size),
+            dt=rng.lognormal(0, 1, size),
+        )
+    )
+
+
+def test_metrics():
+    """The metrics of an aggregate table are those of a groupby over the
+    rows."""
+    df = _calls_df(5000)
+    metrics_df = aggregate.metrics_df(aggregate.aggregate(df, KEYS, "dt"), KEYS, list(aggregate.METRICS))
+    grouped = df.groupby(KEYS, observed=True)["dt"]
+    expected = grouped.agg(["count", "sum", "min", "max", "mean", "var", "std"]).fillna(0.0)
+    pd.testing.assert_frame_equal(metrics_df, expected, check_dtype=False, check_names=False)
+
+
+def test_merge():
+    """Tables of batches merge into the table of all the rows at once."""
+    df = _calls_df(3000)
+    whole = aggregate.aggregate(df, KEYS, "dt")
+    partials = [aggregate.aggregate(df.iloc[_s:_s + 700], KEYS, "dt") for _s in range(0, len(df), 700)]
+    merged = aggregate.merge(partials, KEYS)
+    pd.testing.assert_frame_equal(merged[["count", "min", "max"]], whole[["count", "min", "max"]], check_dtype=False)
+    np.testing.assert_allclose(merged[["sum", "sumsq"]].values, whole[["sum", "sumsq"]].values)
+
+
+def test_missing_keys():
+    """Rows missing a key are left out, as by ``groupby``."""
+    df = _calls_df(100)
+    df.loc[::3, "prefix"] = None
+    metrics_df = aggregate.metrics_df(aggregate.aggregate(df, KEYS, "dt"), KEYS, ["count"])
+    assert metrics_df["count"].sum() == df["prefix"].notnull().sum()
+
+
+def test_quantiles():
+    """Quantiles are those of the values to within a bucket, about 1.1%, and
+    the same from merged batch tables as from the whole."""
+    df = _calls_df(20000)
+    quantiles = list(aggregate.QUANTILES)
+    whole = aggregate.aggregate(df, KEYS, "dt")
+    metrics_df = aggregate.metrics_df(whole, KEYS, quantiles)
+    for group, values in df.groupby(KEYS, observed=True)["dt"]:
+        expected = np.quantile(values.values, list(aggregate.QUANTILES.values()))
+        np.testing.assert_allclose(metrics_df.loc[group, quantiles].values, expected, rtol=2 ** (1 / 64) - 1)
+
+    partials = [aggregate.aggregate(df.iloc[_s:_s + 3000], KEYS, "dt") for _s in range(0, len(df), 3000)]
+    merged_df = aggregate.metrics_df(aggregate.merge(partials, KEYS), KEYS, quantiles)
+    pd.testing.assert_frame_equal(merged_df, metrics_df)
+
+
+def test_quantiles_exact_values():
+    """Buckets are interpolated between their exact min and max, so a group
+    of a single value has it as every quantile, 0 included."""
+    df = pd.DataFrame(dict(prefix=["a"] * 3 + ["b"] * 4, width=0, dt=[2.5, 2.5, 2.5, 0.0, 0.0, 0.0, 0.0]))
+    metrics_df = aggregate.metrics_df(aggregate.aggregate(df, KEYS, "dt"), KEYS, ["p50", "p99", "p99.9"])
+    assert metrics_df.loc[("a", 0)].tolist() == [2.5, 2.5, 2.5]
+    assert metrics_df.loc[("b", 0)].tolist() == [0.0, 0.0, 0.0]
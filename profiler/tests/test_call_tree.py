@@ -0,0 +1,78 @@
+import random
+
+import numpy as np
+
+from f0cal.tool.profiler import call_tree
+from f0cal.tool.profiler.pairing import pair_calls
+
+# (thread, name, is entry): thread 0 calls a, which calls b then c, then b
+# again; thread 1 exits x, entered before the trace, then calls e from within
+# d, which never exits
+EVENTS = [(0, "a", 1), (1, "x", 0), (0, "b", 1), (1, "d", 1), (0, "b", 0), (1, "e", 1), (0, "c", 1), (1, "e", 0),
+          (0, "c", 0), (0, "a", 0), (0, "b", 1), (0, "b", 0)]
+NAMES = ["a", "b", "c", "d", "e", "x"]
+
+
+def _tree(events):
+    threads, names, is_entry = (np.array(_c) for _c in zip(*events))
+    entry, exit, depth, _ = pair_calls(threads, is_entry.astype(bool))
+    parent = call_tree.call_parents(threads[entry], entry, exit, depth)
+    return entry, exit, depth, parent, np.searchsorted(NAMES, names[entry])
+
+
+def test_call_tree():
+    entry, exit, depth, parent, names = _tree(EVENTS)
+    clock = np.arange(len(EVENTS)) * 10
+    dt = clock[exit] - clock[entry]
+    called = [NAMES[_n] for _n in names]
+    assert called == ["b", "e", "c", "a", "b"]
+    # b and c in a, e in d, which never exits: a root
+    assert [called[_p] if _p != call_tree.ROOT else None for _p in parent] == ["a", None, "a", None, None]
+    exclusive = call_tree.exclusive_times(parent, dt)
+    assert exclusive.tolist() == [20, 20, 20, 90 - 20 - 20, 10]
+
+    path, paths_df = call_tree.call_paths(parent, depth, names)
+    paths_df = call_tree.path_stats_df(paths_df, path, dt, exclusive)
+    paths_df["name"] = np.array(NAMES)[paths_df["name"].values]
+    assert call_tree.collapsed_stacks(paths_df) == ["a 50", "b 10", "e 20", "a;b 20", "a;c 20"]
+    order = call_tree.depth_first(paths_df)
+    assert [paths_df.at[_c, "name"] for _c in order] == ["a", "b", "c", "e", "b"]
+    assert paths_df.set_index("name").loc["a", ["count", "inclusive", "exclusive"]].tolist() == [1, 90, 50]
+
+
+def _random_events(count, threads=3, seed=0):
+    """Nested calls of random names, as in ``EVENTS``."""
+    rng = random.Random(seed)
+    stacks = {_t: [] for _t in range(threads)}
+    events = []
+    for _ in range(count):
+        thread = rng.randrange(threads)
+        stack = stacks[thread]
+        if rng.random() < 0.55:
+            stack.append(rng.choice(NAMES))
+            events.append((thread, stack[-1], 1))
+        else:
+            events.append((thread, stack.pop() if stack else "x", 0))
+    return events
+
+
+def _stack_parents(events, entry):
+    """The entry of the call each call was entered in, from a stack walk."""
+    stacks, enclosing = {}, {}
+    for position, (thread, _, is_entry) in enumerate(events):
+        stack = stacks.setdefault(thread, [])
+        if is_entry:
+            enclosing[position] = stack[-1] if stack else None
+            stack.append(position)
+        elif stack:
+            stack.pop()
+    call_of = {_e: _c for _c, _e in enumerate(entry.tolist())}
+    return [call_of.get(enclosing[_e], call_tree.ROOT) for _e in entry.tolist()]
+
+
+def test_call_parents():
+    """Parents are the calls entered last before in the thread one level up,
+    or roots when those never exited."""
+    events = _random_events(5000)
+    entry, _, _, parent, _ = _tree(events)
+    assert parent.tolist() == _stack_parents(events, entry)
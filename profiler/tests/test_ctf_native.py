@@ -0,0 +1,136 @@
+
+import numpy as np
+import pandas as pd
+
+from conftest import CLOCK_OFFSET, ENTRY_NAME, EXIT_NAME, NOISE_NAME
+from f0cal.tool.profiler.ctf_native import (
+    NativeCtfTraceIterator,
+    _HeaderDecoder,
+    _TraceDecoder,
+    find_trace_dirs,
+)
+
+
+def _decoder(trace_path, scopes=None):
+    (trace_dir,) = find_trace_dirs(trace_path)
+    return _TraceDecoder(trace_dir, scopes or {"events": None, "event_fields": None}, None)
+
+
+def test_events(lttng_trace):
+    trace_path, events = lttng_trace(5000)
+    events_df = NativeCtfTraceIterator.from_path(trace_path).events_df
+    assert events_df["name"].astype(str).tolist() == [_e["name"] for _e in events]
+    cycles = np.array([_e["cycles"] for _e in events])
+    # Compact headers only carry 27 bits; every 100th event wraps them
+    assert (events_df["cycles"].values == cycles).all()
+    assert (events_df["timestamp"].values == CLOCK_OFFSET + cycles).all()
+
+
+def test_fields(lttng_trace):
+    trace_path, events = lttng_trace(3000)
+    frames = NativeCtfTraceIterator.from_path(trace_path).frames
+    fields_df, context_df = frames["event_fields"], frames["stream_event_context"]
+    entries = [_i for _i, _e in enumerate(events) if _e["name"] == ENTRY_NAME]
+    exits = [_i for _i, _e in enumerate(events) if _e["name"] == EXIT_NAME]
+    assert fields_df["v0_ptr"].values[entries].tolist() == [events[_i]["ptr"] for _i in entries]
+    for index in entries:
+        shape = events[index]["shape"]
+        assert [fields_df["v0_shape_{}".format(_d)].values[index] for _d in range(len(shape))] == shape
+    names = fields_df["mangled_name_field"].astype(str).values
+    assert names[entries + exits].tolist() == [events[_i]["mangled_name"] for _i in entries + exits]
+    assert context_df["pthread_id"].tolist() == [_e["pthread_id"] for _e in events]
+    assert context_df["perf_thread_cpu_clock"].tolist() == [_e["cpu_clock"] for _e in events]
+
+
+def test_name_prefixes(lttng_trace):
+    trace_path, events = lttng_trace(2000)
+    events_df = NativeCtfTraceIterator.from_path(trace_path, name_prefixes=("f0cal",)).events_df
+    kept = [_e for _e in events if _e["name"] != NOISE_NAME]
+    assert events_df["name"].astype(str).tolist() == [_e["name"] for _e in kept]
+    assert events_df["cycles"].tolist() == [_e["cycles"] for _e in kept]
+
+
+def test_packet_subsets(lttng_trace):
+    """Packets walked alone or a few at a time decode as in a walk of the
+    whole stream."""
+    trace_path, _ = lttng_trace(3000)
+    decoder = _decoder(trace_path)
+    path = next(decoder.stream_files())
+    with open(path, "rb") as f:
+        buf = f.read()
+    offsets = list(decoder._packet_offsets(buf, len(buf)))
+    whole = decoder.walk(buf)
+    for packets in [offsets[:1], offsets[3:4], offsets[1:6:2], offsets[-2:]]:
+        part = decoder.walk(buf, packets)
+        expected = np.concatenate([whole.cycles[whole.packet_of_event == offsets.index(_o)] for _o in packets])
+        assert (part.cycles == expected).all()
+
+
+def test_workers(lttng_trace):
+    trace_path, _ = lttng_trace(3000)
+    serial = NativeCtfTraceIterator.from_path(trace_path).frames
+    pooled = NativeCtfTraceIterator.from_path(trace_path, workers=2).frames
+    assert set(serial) == set(pooled)
+    for scope, df in serial.items():
+        pd.testing.assert_frame_equal(df, pooled[scope])
+
+
+def test_walk_steps(lttng_trace, monkeypatch):
+    """Packets are walked side by side, a step per event of the longest one,
+    not one per event of the stream."""
+    trace_path, _ = lttng_trace(4000 * 8)
+    decoder = _decoder(trace_path)
+    steps = []
+    decode = _HeaderDecoder.decode
+
+    def _counted(self, u8, positions):
+        steps.append(len(positions))
+        return decode(self, u8, positions)
+
+    monkeypatch.setattr(_HeaderDecoder, "decode", _counted)
+    for path in decoder.stream_files():
+        with open(path, "rb") as f:
+            buf = f.read()
+        steps.clear()
+        walk = decoder.walk(buf)
+        per_packet = np.bincount(walk.packet_of_event)
+        assert len(steps) == per_packet.max()
+        assert sum(steps) == len(walk.cycles) and len(per_packet) > 1
+
+
+def test_batches(lttng_trace):
+    """Batches hold the events of a whole decode, with its columns: even a
+    batch of exit events only has the entry payload columns, filled as in
+    the whole frame."""
+    trace_path, _ = lttng_trace(800, dims=(2,))
+    for window in [None, (10 ** 5, 3 * 10 ** 8)]:
+        frames = NativeCtfTraceIterator.from_path(trace_path, window=window).frames
+        for batch_size in [1, 64, 10 ** 6]:
+            batches = list(NativeCtfTraceIterator.from_path(trace_path, window=window).batches(batch_size))
+            assert all(len(_b["events"]) <= batch_size for _b in batches)
+            for scope, df in frames.items():
+                assert all(set(_b[scope].columns) == set(df.columns) for _b in batches), scope
+                batched = pd.concat([_b[scope] for _b in batches])[df.columns]
+                pd.testing.assert_frame_equal(batched, df, check_dtype=False, check_categorical=False)
+
+
+def test_batch_walks(lttng_trace, monkeypatch):
+    """Batches walk their packets a group at a time: once per stream when the
+    trace fits a group, and never once per packet when it doesn't."""
+    trace_path, _ = lttng_trace(3000)
+    walks = []
+    walk = _TraceDecoder.walk
+
+    def _counted(self, buf, packets=None):
+        walks.append(len(packets))
+        return walk(self, buf, packets)
+
+    monkeypatch.setattr(_TraceDecoder, "walk", _counted)
+    list(NativeCtfTraceIterator.from_path(trace_path).batches(16))
+    assert len(walks) == 2
+    packet_count = sum(walks)
+    monkeypatch.setattr(NativeCtfTraceIterator, "MIN_WALK_BYTES", 0)
+    walks.clear()
+    list(NativeCtfTraceIterator.from_path(trace_path).batches(1024))
+    assert sum(walks) == packet_count
+    assert 2 < len(walks) < packet_count / 4
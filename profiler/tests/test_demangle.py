@@ -0,0 +1,32 @@
+import sqlite3
+
+import pytest
+
+from f0cal.tool.profiler.demangle import DemangleCache
+
+NAMES = {"_Z3foov": "foo()", "_ZN2cv6resizeEv": "cv::resize()", "main": "main"}
+
+
+def test_demangle(tmp_path):
+    """Names are demangled once and found again by a later cache on the same
+    file."""
+    path = str(tmp_path / DemangleCache.FILE_NAME)
+    with DemangleCache(path) as cache:
+        assert cache.demangle(list(NAMES) + ["_Z3foov"]) == NAMES
+    with DemangleCache(path) as cache:
+        assert len(cache) == len(NAMES)
+        assert cache.demangle(["_ZN2cv6resizeEv"]) == {"_ZN2cv6resizeEv": "cv::resize()"}
+
+
+def test_max_entries():
+    with DemangleCache(max_entries=2) as cache:
+        cache.demangle(list(NAMES))
+        assert len(cache) == 2
+
+
+def test_closed():
+    """Leaving the context closes the connection."""
+    with DemangleCache() as cache:
+        cache.demangle(["_Z3foov"])
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(cache)
@@ -0,0 +1,43 @@
+import logging
+import os
+
+import numpy as np
+
+from f0cal.tool.profiler import packet_index
+
+
+def _write_index(stream_path, offsets):
+    """An LTTng index for the stream file at ``stream_path`` listing packets at
+    ``offsets``."""
+    index_dir = os.path.join(os.path.dirname(stream_path), packet_index.INDEX_DIR_NAME)
+    os.makedirs(index_dir, exist_ok=True)
+    fields = len(packet_index._INDEX_FIELDS)
+    header = np.array([packet_index.INDEX_MAGIC, 1, 1, 8 * fields], dtype=">u4")
+    entries = np.zeros((len(offsets), fields), dtype=">u8")
+    entries[:, 0], entries[:, 2] = offsets, 8 * 4096
+    with open(os.path.join(index_dir, os.path.basename(stream_path) + packet_index.INDEX_SUFFIX), "wb") as f:
+        f.write(header.tobytes() + entries.tobytes())
+
+
+def _stream_paths(trace_path):
+    return [
+        os.path.join(_d, _f) for _d, _, _files in os.walk(trace_path) for _f in _files if _f.startswith("channel")
+    ]
+
+
+def test_trace_summary(lttng_trace):
+    trace_path, _ = lttng_trace(3000)
+    summary = packet_index.trace_summary(trace_path)
+    assert summary["discarded"] == 0 and summary["events"] > 0
+    assert set(summary) == set(packet_index.SUMMARY_COLUMNS)
+
+
+def test_corrupt_trace_summary(lttng_trace, caplog):
+    """A trace whose index doesn't match its streams has no summary, and a
+    warning says so."""
+    trace_path, _ = lttng_trace(3000)
+    path = _stream_paths(trace_path)[0]
+    _write_index(path, [os.path.getsize(path) + 4096])
+    with caplog.at_level(logging.WARNING):
+        assert packet_index.trace_summary(trace_path) is None
+    assert trace_path in caplog.text
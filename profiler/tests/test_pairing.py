@@ -0,0 +1,60 @@
+import random
+
+import numpy as np
+
+from f0cal.tool.profiler.pairing import call_dts, pair_calls
+
+
+def _events(count, threads=3, seed=0):
+    """``(threads, is_entry, hashes)`` of nested calls in a few threads, some
+    exiting calls entered before tracing started and some never exiting."""
+    rng = random.Random(seed)
+    stacks = {_t: [] for _t in range(threads)}
+    events = []
+    for _ in range(count):
+        thread = rng.randrange(threads)
+        stack = stacks[thread]
+        if rng.random() < 0.55:
+            stack.append(rng.choice("abc"))
+            events.append((thread, True, stack[-1]))
+        else:
+            # An empty stack exits a call entered before the trace
+            events.append((thread, False, stack.pop() if stack else rng.choice("abc")))
+    threads, is_entry, hashes = zip(*events)
+    return np.array(threads), np.array(is_entry), np.array(hashes)
+
+
+def _stack_pairs(threads, is_entry):
+    """``pair_calls`` one event at a time, with a stack per thread."""
+    stacks, pairs = {}, []
+    for position, (thread, entry) in enumerate(zip(threads, is_entry)):
+        stack = stacks.setdefault(thread, [])
+        if entry:
+            stack.append(position)
+        elif stack:
+            pairs.append((stack.pop(), position, len(stack)))
+    entry, exit, depth = (np.array(_c, dtype=np.int64) for _c in zip(*pairs))
+    still_open = np.array(sorted(_p for _s in stacks.values() for _p in _s), dtype=np.int64)
+    return entry, exit, depth, still_open
+
+
+def test_pair_calls():
+    threads, is_entry, hashes = _events(5000)
+    for result, expected in zip(pair_calls(threads, is_entry, hashes), _stack_pairs(threads, is_entry)):
+        assert (result == expected).all()
+
+
+def test_empty():
+    assert all(len(_r) == 0 for _r in pair_calls([], []))
+
+
+def test_call_dts_workers():
+    """Threads paired in a process pool pair as in a single pass."""
+    threads, is_entry, hashes = _events(3000, threads=5)
+    clock = np.cumsum(np.random.default_rng(0).integers(1, 100, len(threads)))
+    serial = call_dts(threads, is_entry, hashes, clock)
+    pooled = call_dts(threads, is_entry, hashes, clock, workers=2)
+    for result, expected in zip(pooled, serial):
+        assert (result == expected).all()
+    entry, exit, _, dt = serial
+    assert (dt == clock[exit] - clock[entry]).all()
@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import f0cal
+import pandas as pd
+import pytest
+
+from conftest import PACKET_SIZE
+from f0cal.tool.profiler import columnar
+from f0cal.tool.profiler.ctf_native import NativeCtfTraceIterator, _TraceDecoder
+from f0cal.tool.profiler.stage_cache import StageCache
+from f0cal.tool.profiler.trace_iterator import FrameIterator, TraceIterator
+
+if not hasattr(f0cal, "entrypoint"):
+    # Only the namespace of this package, without the f0cal core
+    pytest.skip("needs the f0cal package", allow_module_level=True)
+
+from f0cal.tool.profiler import reportage  # noqa: E402
+
+KEYS = ["prefix", "width", "height"]
+
+
+def _streamed_stats_df(trace_path, config):
+    stp = reportage.StreamingTraceParser.from_lttng_trace(trace_path, config, 1 << 30, shaped_only=True)
+    return stp.stats_df(KEYS)
+
+
+def test_ingest(lttng_trace, profiler_config, tmp_path):
+    """A trace read as it grows, a few packets at a time, has the statistics
+    of the whole trace read at once."""
+    trace_path, _ = lttng_trace(6000)
+    expected = _streamed_stats_df(trace_path, profiler_config)
+    growing = str(tmp_path / "growing")
+    shutil.copytree(trace_path, growing)
+    streams = [
+        os.path.join(_d, _f) for _d, _, _files in os.walk(trace_path) for _f in _files if _f.startswith("channel")
+    ]
+    cache = StageCache(str(tmp_path / "cache"))
+    for share in (0.3, 0.6, 1.0, 1.0):
+        for path in streams:
+            with open(path, "rb") as f:
+                data = f.read()
+            packets = len(data) // PACKET_SIZE
+            with open(os.path.join(growing, os.path.relpath(path, trace_path)), "wb") as f:
+                f.write(data[: int(packets * share) * PACKET_SIZE])
+        stats_df = reportage.StreamingTraceParser.ingest(growing, profiler_config, KEYS, cache, shaped_only=True)
+    pd.testing.assert_frame_equal(stats_df, expected)
+
+
+def test_ingest_walks(lttng_trace, profiler_config, tmp_path, monkeypatch):
+    """Ingest walks the new packets of each stream at once, not a packet at a
+    time."""
+    trace_path, _ = lttng_trace(6000)
+    walks = []
+    walk = _TraceDecoder.walk
+
+    def _counted(self, buf, packets=None):
+        walks.append(len(packets))
+        return walk(self, buf, packets)
+
+    monkeypatch.setattr(_TraceDecoder, "walk", _counted)
+    cache = StageCache(str(tmp_path / "cache"))
+    reportage.StreamingTraceParser.ingest(trace_path, profiler_config, KEYS, cache, shaped_only=True)
+    assert len(walks) == 2 and sum(walks) > 2
+    walks.clear()
+    reportage.StreamingTraceParser.ingest(trace_path, profiler_config, KEYS, cache, shaped_only=True)
+    assert len(walks) <= 2
+
+
+def test_report_key(lttng_trace, profiler_config):
+    """Reports of the same trace read differently are cached apart."""
+    trace_path, _ = lttng_trace(100)
+    trace = dict(trace_path=trace_path)
+
+    def key(max_memory=None):
+        return reportage._report_key(trace, profiler_config, KEYS, max_memory, None, None, [])
+
+    assert key() == key()
+    assert key(1 << 20) != key()
+    native = key()
+    profiler_config["profiler"]["decoder"] = "bt1"
+    assert key() != native
+
+
+def test_cached_stages(lttng_trace, profiler_config):
+    """Stages of a trace are cached under their keys and read back by the
+    next parser of the trace; frames from elsewhere are only memoized."""
+    trace_path, _ = lttng_trace(500)
+    cache = {}
+    tp = reportage.TraceParser.from_lttng_trace(trace_path, profiler_config, cache=cache)
+    calls_df = tp.calls_df
+    assert tp._stage_key("calls_df") in cache
+    again = reportage.TraceParser.from_lttng_trace(trace_path, profiler_config, cache=cache)
+    assert again.calls_df is cache[tp._stage_key("calls_df")]
+    pd.testing.assert_frame_equal(again.calls_df, calls_df)
+
+    cache = {}
+    tp = reportage.TraceParser(FrameIterator(tp._trace_iter.frames), profiler_config, cache=cache)
+    pd.testing.assert_frame_equal(tp.calls_df, calls_df)
+    assert not cache
+
+
+def test_merged_stats(lttng_trace, profiler_config):
+    """The aggregates of two traces merge into the statistics, quantiles
+    included, of all their calls at once; the aggregates are a cached stage."""
+    cache = {}
+    parsers = [
+        reportage.TraceParser.from_lttng_trace(
+            lttng_trace(2000, seed=_s)[0], profiler_config, cache=cache, shaped_only=True, stat_keys=KEYS
+        )
+        for _s in (0, 1)
+    ]
+    merged_df = reportage.merged_stats_df([_p.latency_aggregates_df for _p in parsers], KEYS)
+    calls_df = pd.concat([reportage.latency_df(_p.big_table_df) for _p in parsers])
+    pd.testing.assert_frame_equal(merged_df, reportage.dt_stats_df(calls_df, KEYS))
+    assert parsers[0]._stage_key("latency_aggregates_df") in cache
+    expected = reportage.dt_stats_df(reportage.latency_df(parsers[0].big_table_df), KEYS)
+    pd.testing.assert_frame_equal(parsers[0].stats_df, expected)
+
+
+@pytest.mark.skipif(not columnar.AVAILABLE, reason="needs pyarrow")
+def test_dataset(lttng_trace, profiler_config, tmp_path):
+    """A converted trace reads back in event order, with the calls of the
+    trace."""
+    trace_path, _ = lttng_trace(2000)
+    tp = reportage.TraceParser.from_lttng_trace(trace_path, profiler_config, cache={})
+    dataset_path = str(tmp_path / "dataset")
+    columnar.write_dataset(tp, dataset_path)
+    read = reportage.TraceParser.from_lttng_trace(trace_path, profiler_config, dataset_path=dataset_path, cache={})
+    assert isinstance(read._trace_iter, columnar.DatasetTraceIterator)
+    for scope, df in tp._trace_iter.frames.items():
+        pd.testing.assert_frame_equal(read._trace_iter.frames[scope], df, check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(read.calls_df, tp.calls_df, check_dtype=False)
+
+
+def test_window_decoder(lttng_trace, profiler_config, monkeypatch):
+    """A window is read by the native reader when the configured decoder
+    would walk the whole trace for it."""
+    trace_path, _ = lttng_trace(500)
+
+    class _Walking(TraceIterator):
+        pass
+
+    monkeypatch.setattr(reportage, "decoder_from_config", lambda _config: _Walking)
+    it = reportage.TraceParser.open_trace(trace_path, profiler_config, window=(0, 10 ** 8))
+    assert isinstance(it, NativeCtfTraceIterator)
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from f0cal.tool.profiler.stage_cache import StageCache, stage_key
+
+
+def test_round_trip(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = stage_key("calls_df", "abc", 1)
+    with pytest.raises(KeyError):
+        cache[key]
+    cache[key] = dict(rows=[1, 2, 3])
+    assert key in cache
+    assert cache[key] == dict(rows=[1, 2, 3])
+    assert stage_key("calls_df", "abc", 2) not in cache
+
+
+def test_eviction(tmp_path):
+    """Beyond the budget, the least recently used entries go first."""
+    cache = StageCache(str(tmp_path), budget=3500)
+    keys = [stage_key("stage", _i) for _i in range(3)]
+    for age, key in enumerate(keys):
+        cache[key] = os.urandom(1000)
+        # A second apart, as file times may be coarse
+        os.utime(cache._path(key), (age, age))
+    cache[keys[0]]
+    cache[stage_key("stage", 3)] = os.urandom(1000)
+    assert [_k in cache for _k in keys] == [True, False, True]
+
+
+def test_over_budget(tmp_path):
+    """A value bigger than the whole budget isn't stored, nor does it evict
+    anything."""
+    cache = StageCache(str(tmp_path), budget=2000)
+    cache["small"] = os.urandom(100)
+    cache["big"] = os.urandom(5000)
+    assert "small" in cache and "big" not in cache
+    assert sorted(os.listdir(str(tmp_path))) == ["small.pkl"]
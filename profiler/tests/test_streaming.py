@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from f0cal.tool.profiler.streaming import RunningStats, SpaceSaving
+
+
+def _batches(count, size, seed=0):
+    """Per-group weights of ``count`` batches of ``size`` skewed draws, by
+    (prefix, group)."""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        groups = rng.zipf(1.3, size) % 500
+        index = pd.MultiIndex.from_arrays([groups % 7, groups], names=["prefix", "group"])
+        yield pd.Series(rng.random(size) * 10, index=index).groupby(level=[0, 1]).sum()
+
+
+def test_space_saving():
+    """A count is over a group's weight by at most its error, and every group
+    heavier than the bound is counted."""
+    sketch = SpaceSaving(20)
+    weights = []
+    for batch in _batches(40, 200):
+        sketch.update(batch)
+        weights.append(batch)
+    true = pd.concat(weights).groupby(level=[0, 1]).sum()
+    counts_df = sketch.counts_df
+    assert len(counts_df) == sketch.capacity
+    counted = true.reindex(counts_df.index).values
+    assert (counts_df["count"].values - counts_df["error"].values <= counted + 1e-9).all()
+    assert (counted <= counts_df["count"].values + 1e-9).all()
+    assert (counts_df["error"].values <= sketch.bound + 1e-9).all()
+    assert true[true > sketch.bound].index.isin(counts_df.index).all()
+
+
+def test_space_saving_sequential():
+    """Merging a batch is feeding its new groups one by one, heaviest first:
+    each takes over the smallest counter, possibly one just taken over."""
+    sketch = SpaceSaving(2)
+    sketch.update(pd.Series([5.0, 3.0], index=["a", "b"]))
+    sketch.update(pd.Series([1.0, 4.0], index=["c", "d"]))
+    # d takes over b (3), after which a (5) is the smallest counter
+    counts_df = sketch.counts_df
+    assert counts_df.to_dict("index") == dict(
+        d=dict(count=7.0, error=3.0, taken_in=1), c=dict(count=6.0, error=5.0, taken_in=1)
+    )
+
+
+@pytest.mark.parametrize("fold_every", [1, RunningStats.FOLD_EVERY])
+def test_running_stats_readmitted(fold_every, monkeypatch, tmp_path):
+    """A group evicted by the sketch and taken in again only has the
+    statistics of its calls since, even once folded and spilled."""
+    monkeypatch.setattr(RunningStats, "FOLD_EVERY", fold_every)
+    stats = RunningStats(["name"], "dt", max_bytes=0, spill_dir=str(tmp_path), sketch=SpaceSaving(1, "count"))
+    try:
+        for name, count, dt in [("a", 3, 1.0), ("b", 5, 2.0), ("a", 10, 4.0)]:
+            stats.update(pd.DataFrame(dict(name=[name] * count, dt=np.full(count, dt))))
+        stats_df = stats.stats_df
+    finally:
+        stats.close()
+    assert stats_df.index.tolist() == ["a"]
+    row = stats_df.loc["a"]
+    assert (row["count"], row["min"], row["max"]) == (10, 4.0, 4.0)
+    assert (row["estimate"], row["error"]) == (18.0, 8.0)